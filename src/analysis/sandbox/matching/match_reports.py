@@ -6,6 +6,8 @@ import geopandas as gpd
 from dotenv import load_dotenv
 import sqlalchemy as sa
 
+from match.helpers import stream_to_file
+
 load_dotenv()
 
 pd.options.display.max_columns = None
@@ -17,40 +19,46 @@ EPSG = os.environ["WSB_EPSG"]
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
 
-#%%
-# Load up the supermodel
-
-supermodel = gpd.GeoDataFrame.from_postgis(
-    "SELECT * FROM pws_contributors;", conn, geom_col="geometry")
-
-mk_matches = pd.read_sql("SELECT * FROM matches;", conn)
-
-#%%
-
-# This is helpful in a few places
-masters = supermodel[supermodel["source_system"] == "sdwis"]["master_key"]
+# Everything below is computed in the database; only aggregates (and the
+# streamed report rows) come back to Python.
 
 #%% ################################
 # Report some stats
 ####################################
 
-distinct_pwsid_matches = mk_matches['master_key'].drop_duplicates()
-total_pwsid_count = len(masters)
-labeled_pwsids = supermodel[supermodel["source_system"] == "labeled"]["pwsid"]
+stats = pd.read_sql("""
+    WITH matched AS (
+        SELECT DISTINCT mk.master_key
+        FROM matches m
+        JOIN master_keys mk ON mk.master_sk = m.master_sk
+    ),
+    labeled AS (
+        SELECT DISTINCT pwsid
+        FROM pws_contributors
+        WHERE source_system = 'labeled'
+    )
+    SELECT
+        (SELECT count(*) FROM pws_contributors WHERE source_system = 'sdwis') AS total_pwsid_count,
+        (SELECT count(*) FROM matched) AS matched_count,
+        (SELECT count(*) FROM labeled) AS labeled_count,
+        (SELECT count(*) FROM (SELECT master_key FROM matched UNION SELECT pwsid FROM labeled) u) AS total_coverage_count;
+    """, conn).iloc[0]
+
+total_pwsid_count = stats["total_pwsid_count"]
 
 print(
-    f"Distinct PWSID's with candidate matches: {len(distinct_pwsid_matches):,}" +
-    f" ({(len(distinct_pwsid_matches) / total_pwsid_count)*100:.1f}%)")
+    f"Distinct PWSID's with candidate matches: {stats['matched_count']:,}" +
+    f" ({(stats['matched_count'] / total_pwsid_count)*100:.1f}%)")
 
 # 32,013 distinct pwsid's have matches to TIGER or MHP. Interesting! 64.7%.
 
 # Distinct PWSID's with labeled matches
 print(
-    f"Distinct PWSID's with labeled data: {len(labeled_pwsids):,}" +
-    f" ({(len(labeled_pwsids) / total_pwsid_count)*100:.1f}%)")
+    f"Distinct PWSID's with labeled data: {stats['labeled_count']:,}" +
+    f" ({(stats['labeled_count'] / total_pwsid_count)*100:.1f}%)")
 
 # Total coverage across known labels and match candidates
-total_coverage_count = len(pd.concat([distinct_pwsid_matches, labeled_pwsids]).drop_duplicates())
+total_coverage_count = stats["total_coverage_count"]
 print(
     f"Total coverage:  {total_coverage_count:,}" +
     f" ({(total_coverage_count / total_pwsid_count)*100:.1f}%)")
@@ -79,73 +87,96 @@ Rules taking shape:
     - Possible variation: Only do this if it's a zip or county centroid. Counterexample: There are some bad address matches.
 """
 
-mk_matches["match_rule"].value_counts()
+pd.read_sql("""
+    SELECT match_rule_label, count(*) AS count
+    FROM matches
+    GROUP BY match_rule_label
+    ORDER BY count DESC;
+    """, conn)
 
 
 #%% ###########################
 # Generate a stacked match report (for manual review)
 ###############################
 
-# This will include all contributors where the master key is already known and there is a match to TIGER
-anchors = supermodel[supermodel["master_key"].isin(mk_matches["master_key"])]
-
-candidates = (supermodel
-    .drop(columns="master_key")
-    .merge(mk_matches, left_on="contributor_id", right_on="candidate_contributor_id")
-    .rename(columns={"master_key": "mk_match"}))
-
-#%%
-
-base_columns = ["type", "mk_match", "match_rule"]
-remainder = [c for c in candidates.columns if c not in base_columns]
-
-stacked_match = (pd.concat([
-        anchors.assign(type="anchor", mk_match=anchors["master_key"]),
-        candidates.assign(type="candidate")])
-    .sort_values(["mk_match", "type"])
-    [base_columns + remainder]
+# This will include all contributors where the master key is already known and there is a match to TIGER.
+# Instead of actual geometry, which isn't very helpful in an Excel report, let's just sub in the type of geometry.
+# The "color" column just toggles on and off per match group (odd / even dense rank of the group).
+
+columns = [
+    c["name"] for c in sa.inspect(conn).get_columns("pws_contributors")
+    if c["name"] not in ("geometry", "master_key")]
+
+contributor_columns = ", ".join(f"c.{c}" for c in columns)
+
+STACKED_MATCH_SQL = f"""
+    WITH matched AS (
+        SELECT
+            mk.master_key,
+            m.candidate_contributor_sk,
+            ck.contributor_id AS candidate_contributor_id,
+            m.match_rule,
+            m.match_rule_label
+        FROM matches m
+        JOIN master_keys mk ON mk.master_sk = m.master_sk
+        JOIN contributor_keys ck ON ck.contributor_sk = m.candidate_contributor_sk
+    ),
+    stacked AS (
+        SELECT
+            'anchor' AS type,
+            c.master_key AS mk_match,
+            NULL AS match_rule_label,
+            {contributor_columns},
+            c.master_key,
+            NULL AS candidate_contributor_id,
+            NULL::INT AS match_rule,
+            replace(ST_GeometryType(c.geometry), 'ST_', '') AS geometry_type
+        FROM pws_contributors c
+        WHERE c.master_key IN (SELECT master_key FROM matched)
+
+        UNION ALL
+
+        SELECT
+            'candidate' AS type,
+            m.master_key AS mk_match,
+            m.match_rule_label,
+            {contributor_columns},
+            NULL AS master_key,
+            m.candidate_contributor_id,
+            m.match_rule,
+            replace(ST_GeometryType(c.geometry), 'ST_', '') AS geometry_type
+        FROM matched m
+        JOIN pws_contributors c ON c.contributor_sk = m.candidate_contributor_sk
     )
-
-# Instead of actual geometry, which isn't very helpful in an Excel report, let's just sub in the type of geometry
-# (We might want to leave the actual geometry if this will be consumed by R or something to create another report)
-stacked_match["geometry_type"] = stacked_match["geometry"].geom_type
-
-# Let's add a "color" column that just toggles on and off per match group
-# First, we'll number each match group. Then, we'll color odd numbers.
-stacked_match["color"] = (stacked_match["mk_match"].rank(method="dense") % 2) == 0
-
-# Convert Python lists to strings
-stacked_match["match_rule"] = stacked_match["match_rule"].astype(str)
+    SELECT *, dense_rank() OVER (ORDER BY mk_match) % 2 = 0 AS color
+    FROM stacked
+    ORDER BY mk_match, type;
+"""
 
 #%% ###########################
 # Save the report
 ###############################
 
-(stacked_match
-    .drop(columns=["geometry"])
-    .to_excel(OUTPUT_PATH + "/stacked_match_report.xlsx", index=False))
+# Streamed from the database straight to the workbook
+stream_to_file(conn, STACKED_MATCH_SQL, OUTPUT_PATH + "/stacked_match_report.xlsx")
 
 #%% ###########################
 # The "unmatched" report helps ID why records didn't match
 ###############################
 
-tokens = pd.read_sql("SELECT * FROM tokens;", conn)
-
-# Unmatched report
-anchors = tokens[
-    tokens["source_system"].isin(["sdwis"]) & 
-    (~tokens["master_key"].isin(mk_matches["master_key"]))]
-
-candidates = tokens[
-    (tokens["source_system"] == "tiger")
-    # Let's include ALL tiger, not just unmatched
-    #& (~tokens["master_key"].isin(mk_matches["master_key_y"]))
-    ]
-
-umatched_report = pd.concat([anchors, candidates]).sort_values(["state", "name_tkn"])
+# Unmatched SDWIS anchors, and ALL tiger (not just unmatched)
+UNMATCHED_SQL = """
+    SELECT *
+    FROM tokens t
+    WHERE
+        (t.source_system = 'sdwis' AND
+            NOT EXISTS (SELECT 1 FROM matches m WHERE m.master_sk = t.master_sk)) OR
+        t.source_system = 'tiger'
+    ORDER BY t.state, t.name_tkn;
+"""
 
 #%%
-umatched_report.to_excel("unmatched_report.xlsx", index=False)
+stream_to_file(conn, UNMATCHED_SQL, "unmatched_report.xlsx")
 
 
 #%% #########################################
@@ -154,22 +185,20 @@ umatched_report.to_excel("unmatched_report.xlsx", index=False)
 
 # How many distinct records did each master match to?
 
-matches_with_system = (mk_matches
-    .merge(
-        supermodel[["contributor_id", "source_system"]],
-        left_on="candidate_contributor_id", right_on="contributor_id"))
-
-# For each MK that matched, get counts of how many of each system it matched to
-match_counts = (matches_with_system
-    .groupby(["master_key", "source_system"])
-    .size()
-    .unstack())
-
-# Join match counts to the full set of masters (to include those that matched to nothing)
-mk_match_counts = (masters
-    .to_frame()
-    .join(match_counts, on="master_key", how="left")
-    .fillna(0))
+# For each MK, get counts of how many of each system it matched to
+# (including the masters that matched to nothing)
+mk_match_counts = (pd.read_sql("""
+        SELECT
+            s.master_key,
+            count(*) FILTER (WHERE c.source_system = 'tiger') AS tiger,
+            count(*) FILTER (WHERE c.source_system = 'mhp') AS mhp
+        FROM pws_contributors s
+        LEFT JOIN matches m ON m.master_sk = s.master_sk
+        LEFT JOIN pws_contributors c ON c.contributor_sk = m.candidate_contributor_sk
+        WHERE s.source_system = 'sdwis'
+        GROUP BY s.master_key;
+        """, conn)
+    .set_index("master_key"))
 
 print("PWS matches to distinct TIGER's and MHP's:")
 mk_match_counts.agg(["mean", "median", "min", "max"])
@@ -182,9 +211,14 @@ mk_match_counts.hist()
 
 # How about the other way around?
 # Of the candidates that matched, how many masters did they match to?
-mhp_and_tiger_matches = (matches_with_system
-    .groupby(["candidate_contributor_id", "source_system"])
-    .size())
+mhp_and_tiger_matches = (pd.read_sql("""
+        SELECT c.contributor_id AS candidate_contributor_id, c.source_system, count(*) AS matches
+        FROM matches m
+        JOIN pws_contributors c ON c.contributor_sk = m.candidate_contributor_sk
+        GROUP BY c.contributor_id, c.source_system;
+        """, conn)
+    .set_index(["candidate_contributor_id", "source_system"])
+    ["matches"])
 
 (mhp_and_tiger_matches
     .groupby("source_system")
@@ -213,9 +247,23 @@ mhp_and_tiger_matches.loc[:,"tiger"].hist(log=True, bins=20)
 # The name match is better.
 # The spatial match is because the address is an admin address (Chippewa Indians Office)
 
-subset = stacked_match[
-    (stacked_match["mk_match"] == "043740039") &
-    (stacked_match["geometry"].notna())]
+# Only this match group's geometries are loaded
+subset = gpd.GeoDataFrame.from_postgis("""
+        SELECT c.*, 'anchor' AS type
+        FROM pws_contributors c
+        WHERE c.master_key = %(mk)s
+
+        UNION ALL
+
+        SELECT c.*, 'candidate' AS type
+        FROM matches m
+        JOIN master_keys mk ON mk.master_sk = m.master_sk
+        JOIN pws_contributors c ON c.contributor_sk = m.candidate_contributor_sk
+        WHERE mk.master_key = %(mk)s;
+        """,
+    conn, geom_col="geometry", params={"mk": "043740039"})
+
+subset = subset[subset["geometry"].notna()]
 
 # Assign a rank so that bigger polygons (in general) appear under smaller polygons and points
 # subset["rank"] = subset["geometry_type"].map({
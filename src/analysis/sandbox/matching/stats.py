@@ -8,6 +8,9 @@ import geopandas as gpd
 import sqlalchemy as sa
 from dotenv import load_dotenv
 
+from match.features import load_features, projected_geometry
+from match.helpers import MATCHES_SQL
+
 load_dotenv()
 
 DATA_PATH = os.environ["WSB_STAGING_PATH"] + "/../outputs"
@@ -16,23 +19,22 @@ EPSG = os.environ["WSB_EPSG"]
 # Connect to local PostGIS instance
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
-PROJ = os.environ["WSB_EPSG_AW"]
-
 #%%
 # Load up the data sources
+# (Projected geometries come straight from the matching feature table)
+
+features = load_features(
+    ["contributor_id", "source_system", "master_key", "pwsid", "geometry_proj"],
+    source_systems=["tiger", "mhp", "labeled"])
 
-supermodel = gpd.GeoDataFrame.from_postgis(
-    "SELECT * FROM pws_contributors WHERE source_system NOT IN ('ucmr');",
-    conn, geom_col="geometry")
+supermodel = gpd.GeoDataFrame(
+    features.drop(columns="geometry_proj"),
+    geometry=projected_geometry(features))
 
 candidates = supermodel[supermodel["source_system"].isin(["tiger", "mhp"])].set_index("contributor_id")
 labeled = supermodel[supermodel["source_system"] == "labeled"]
 
-matches = pd.read_sql("SELECT * FROM matches;", conn)
-
-
-candidates = candidates.to_crs(PROJ)
-labeled = labeled.to_crs(PROJ)
+matches = pd.read_sql(MATCHES_SQL, conn)
 
 
 # Q: Which match type leads to the best results?
@@ -60,7 +62,7 @@ candidate_matches = gpd.GeoDataFrame(matches
     .join(candidates[["source_system", "geometry"]], on="candidate_contributor_id")
     .rename(columns={"master_key": "pwsid"})
     .set_index("pwsid")
-    [["geometry", "match_rule", "source_system"]])
+    [["geometry", "match_rule_label", "source_system"]])
 
 # Filter to only the PWS's that appear in both series
 # 7,423 match
@@ -90,7 +92,7 @@ candidate_matches["score"] = candidate_matches["distance"] < PROXIMITY_BUFFER
 # How did our match rules (and combos of rules) perform for TIGER?
 (candidate_matches
     .loc[candidate_matches["source_system"] == "tiger"]
-    .groupby(["match_rule", "source_system"])
+    .groupby(["match_rule_label", "source_system"])
     .agg(
         points = ("score", "sum"),
         total = ("score", "size")
@@ -1,10 +1,19 @@
 #%%
 
 import os
+import json
 import pandas as pd
 import geopandas as gpd
 import sqlalchemy as sa
 import match.helpers as helpers
+from match.schema import apply_schema, release_schema
+from export.change_sets import diff_inputs, input_hashes, write_delta
+from export.overlaps import find_overlaps, summarize_overlaps, trim_neighbors, trim_overlaps
+from export.optimize import DEFAULT_GRID_SIZE, optimize_geometries, parse_tolerances
+from export.writers import read_geoparquet, write_flatgeobuf, write_geopackage, write_geoparquet
+from export.vector_tiles import build_mbtiles
+from model.tier3 import read_tier3, tier3_circles
+from model.coastline import clip_to_land
 from dotenv import load_dotenv
 from shapely.geometry import Polygon
 
@@ -14,23 +23,123 @@ STAGING_PATH = os.environ["WSB_STAGING_PATH"]
 OUTPUT_PATH = os.environ["WSB_OUTPUT_PATH"]
 EPSG = os.environ["WSB_EPSG"]
 
+# Comma-separated list of output formats: gpkg, parquet, fgb, mbtiles
+EXPORT_FORMATS = [
+    f.strip() for f in os.environ.get("WSB_EXPORT_FORMATS", "gpkg,parquet,fgb").split(",") if f.strip()]
+
+# Simplification tolerance of each tier ("tier:tolerance,...") and the coordinate
+# grid size for the exports, in the units of WSB_EPSG. Empty / 0 to turn off.
+SIMPLIFY_TOLERANCES = parse_tolerances(
+    os.environ.get("WSB_SIMPLIFY_TOLERANCES", "1:0.00001,2:0.00001,3:0.0001"))
+GRID_SIZE = float(os.environ.get("WSB_OUTPUT_GRID_SIZE", DEFAULT_GRID_SIZE))
+
+# Set to 0 to leave the Tier 3 circles unclipped by the coastline / Great Lakes
+CLIP_TIER3_TO_LAND = os.environ.get("WSB_CLIP_TIER3_TO_LAND", "1") == "1"
+
+# Set to 1 to trim lower-tier boundaries where they overlap higher-tier ones
+TRIM_OVERLAPS = os.environ.get("WSB_TRIM_OVERLAPS", "0") == "1"
+
+# Highest zoom level of the vector tiles
+TILES_MAX_ZOOM = int(os.environ.get("WSB_TILES_MAX_ZOOM", "12"))
+
+# Set to 1 to recombine every PWS, instead of only those whose inputs changed
+COMBINE_FULL = os.environ.get("WSB_COMBINE_FULL", "") == "1"
+
+# The previous combined layer, with the input hash of each PWS, and the
+# settings it was combined and exported with
+COMBINED_PATH = os.path.join(STAGING_PATH, "temm_combined.parquet")
+SETTINGS_PATH = os.path.join(STAGING_PATH, "temm_combined_settings.json")
+
+# Changing these recombines every PWS
+COMBINE_SETTINGS = {"clip_tier3_to_land": CLIP_TIER3_TO_LAND}
+
+# Changing these rewrites the exports, even if no PWS changed
+EXPORT_SETTINGS = {
+    "export_formats":       EXPORT_FORMATS,
+    "simplify_tolerances":  {str(tier): tolerance for tier, tolerance in SIMPLIFY_TOLERANCES.items()},
+    "grid_size":            GRID_SIZE,
+    "trim_overlaps":        TRIM_OVERLAPS,
+    "tiles_max_zoom":       TILES_MAX_ZOOM
+}
+
+# The columns of the exported layer, with nullable dtypes so the cached rows
+# and the recombined rows always concatenate to the same types
+OUTPUT_SCHEMA = {
+    "pwsid":                        "string",
+    "pws_name":                     "string",
+    "primacy_agency_code":          "string",
+    "state_code":                   "string",
+    "city_served":                  "string",
+    "county_served":                "string",
+    "population_served_count":      "Int64",
+    "service_connections_count":    "Int64",
+    "service_area_type_code":       "string",
+    "owner_type_code":              "string",
+    "is_wholesaler_ind":            "boolean",
+    "primacy_type":                 "string",
+    "primary_source_code":          "string",
+    "tier":                         "Int64",
+    "centroid_lat":                 "Float64",
+    "centroid_lon":                 "Float64",
+    "centroid_quality":             "string",
+    "geometry_source_detail":       "string",
+    "pred_05":                      "Float64",
+    "pred_50":                      "Float64",
+    "pred_95":                      "Float64",
+    "input_hash":                   "string"
+}
+
 # Connect to local PostGIS instance
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
+#%%
+# Find the PWS's whose inputs changed since the last run ------------------
+
+# Tier 3: MODELED boundaries - just the centroids and radii (median and CIs).
+# The circles are generated later, only for the PWS's that end up in Tier 3.
+t3 = (read_tier3()
+    [[
+        "pwsid", "pred_05", "pred_50", "pred_95",
+        "centroid_lat", "centroid_lon", "centroid_quality",
+        "geometry_source_detail"
+    ]])
+
+hashes = input_hashes(conn, t3)
+
+previous_settings = {}
+if os.path.exists(SETTINGS_PATH):
+    with open(SETTINGS_PATH) as file:
+        previous_settings = json.load(file)
+
+previous = None
+if (not COMBINE_FULL and os.path.exists(COMBINED_PATH) and
+        previous_settings.get("combine") == COMBINE_SETTINGS):
+    previous = read_geoparquet(COMBINED_PATH)
+
+changes = diff_inputs(previous, hashes)
+
+# Only the added and changed PWS's are recombined
+pwsids = changes.loc[changes["change"] != "removed", "pwsid"].tolist()
+
+print(
+    f"Recombining {len(pwsids)} of {len(hashes)} PWS's " +
+    ("(full run)." if previous is None else f"({(changes['change'] == 'removed').sum()} removed)."))
+
 #%%
 # load geometries for each tier -------------------------------------------
 
 print("Loading geometries for Tiers 1-3...") 
 
 # Tier 1: LABELED (and CONTRIBUTED) boundaries
-t1 = gpd.GeoDataFrame.from_postgis("""
+t1 = gpd.GeoDataFrame.from_postgis(sa.text("""
             SELECT pwsid, centroid_lat, centroid_lon, centroid_quality, geometry, geometry_source_detail
             FROM pws_contributors
             WHERE
                 source_system IN ('labeled', 'contributed') AND
-                NOT st_isempty(geometry)
-            ORDER BY source_system, pwsid;""",
-        conn, geom_col="geometry")
+                NOT st_isempty(geometry) AND
+                pwsid = ANY(CAST(:pwsids AS TEXT[]))
+            ORDER BY source_system, pwsid;"""),
+        conn, geom_col="geometry", params={"pwsids": pwsids})
 
 # If there are duplicates, it's likely because we have a contributed AND a labeled bound.
 # Take only the contributed.
@@ -43,7 +152,7 @@ if len(t1) < before_count:
 print("Retrieved Tier 1: Labeled boundaries.")
 
 # Tier 2: MATCHED boundaries (only the best)
-t2 = gpd.GeoDataFrame.from_postgis("""
+t2 = gpd.GeoDataFrame.from_postgis(sa.text("""
             SELECT
                 m.master_key        AS pwsid,
                 t.source_system_id  AS matched_bound_geoid,
@@ -54,27 +163,17 @@ t2 = gpd.GeoDataFrame.from_postgis("""
                 t.geometry,
                 t.geometry_source_detail
             FROM matches_ranked m
-            JOIN pws_contributors t ON m.candidate_contributor_id = t.contributor_id
+            JOIN pws_contributors t ON m.candidate_contributor_sk = t.contributor_sk
             WHERE
                 m.best_match AND
-                t.source_system = 'tiger'""",
-        conn, geom_col="geometry")
+                t.source_system = 'tiger' AND
+                m.master_key = ANY(CAST(:pwsids AS TEXT[]))"""),
+        conn, geom_col="geometry", params={"pwsids": pwsids})
 
 print("Retrieved Tier 2: Matched boundaries.")
 
-# Tier 3: MODELED boundaries - use median result geometry but bring in CIs
-t3 = (gpd
-    .read_file(os.path.join(STAGING_PATH, "tier3_median.gpkg"))
-    [[
-        "pwsid", ".pred_lower", ".pred", ".pred_upper",
-        "centroid_lat", "centroid_lon", "centroid_quality",
-        "geometry", "geometry_source_detail"
-    ]]
-    .rename(columns={
-        ".pred_lower": "pred_05",
-        ".pred":       "pred_50",
-        ".pred_upper": "pred_95"
-    })) #type:ignore
+# Tier 3: MODELED boundaries (read above)
+t3 = t3.loc[t3["pwsid"].isin(pwsids)].assign(geometry=None)
 
 print("Retrieved Tier 3: Modeled boundaries.")
 
@@ -91,10 +190,13 @@ t3["tier"] = 3
 # read and format matched output
 print("Reading SDWIS for base attributes...")
 
-base = pd.read_sql(f"""
+base = apply_schema(pd.read_sql(sa.text("""
     SELECT *
     FROM pws_contributors
-    WHERE source_system = 'sdwis';""", conn)
+    WHERE
+        source_system = 'sdwis' AND
+        pwsid = ANY(CAST(:pwsids AS TEXT[]));"""),
+    conn, params={"pwsids": pwsids}))
 
 base = base.drop(columns=[
     "tier", "centroid_lat", "centroid_lon", "centroid_quality",
@@ -113,9 +215,20 @@ combined = gpd.GeoDataFrame(pd
     .concat([t1, t2, t3])
     .sort_values(by="tier") #type:ignore
     .drop_duplicates(subset="pwsid", keep="first")
+    .reset_index(drop=True)
     [["pwsid", "tier", "centroid_lat", "centroid_lon", "centroid_quality",
     "geometry", "geometry_source_detail", "pred_05", "pred_50", "pred_95"]])
 
+combined = apply_schema(combined)
+
+# Generate the median circles for the Tier 3 winners
+is_t3 = combined["tier"] == 3
+combined.loc[is_t3, "geometry"] = tier3_circles(combined.loc[is_t3], "pred_50")
+
+# Remove the ocean and lakes from the circles
+if CLIP_TIER3_TO_LAND:
+    combined.loc[is_t3, "geometry"] = clip_to_land(combined.loc[is_t3, "geometry"])
+
 # Join again to get matched boundary info
 # we do this to get boundary info for ALL tiers
 combined = combined.merge(
@@ -142,9 +255,11 @@ print("Combined a spatial layer using best available tiered data.\n")
 
 #%%
 
-# Save to the database
+# Save to the database. On an incremental run, only the changed and removed
+# PWS's are replaced.
 helpers.load_to_postgis("master",
-    temm.drop(columns=["matched_bound_geoid", "matched_bound_name", "pred_05", "pred_50", "pred_95"]))
+    temm.drop(columns=["matched_bound_geoid", "matched_bound_name", "pred_05", "pred_50", "pred_95"]),
+    replace_ids=None if previous is None else ("master." + changes["pwsid"]).tolist())
 
 #%%
 # Export
@@ -160,16 +275,86 @@ columns = [
     "geometry", "geometry_source_detail", "pred_05", "pred_50", "pred_95"]
 
 # Backwards compatibility
-output = (temm[columns]
+# (Not every writer understands categoricals, so write plain strings)
+recombined = (release_schema(temm[columns])
     .rename(columns={
         "name": "pws_name",
         "state": "state_code",
         "county": "county_served"
-    }))
+    })
+    .merge(hashes, on="pwsid", how="left")
+    .astype(OUTPUT_SCHEMA))
+
+# Splice the recombined PWS's into the previous layer
+if previous is None:
+    combined_layer = recombined
+else:
+    kept = previous.loc[~previous["pwsid"].isin(changes["pwsid"])].astype(OUTPUT_SCHEMA)
+
+    combined_layer = gpd.GeoDataFrame(
+        pd.concat([kept, recombined], ignore_index=True).sort_values("pwsid", ignore_index=True),
+        crs=recombined.crs)
+
+# The combined layer is cached (at full resolution) after the exports succeed
+output = combined_layer.drop(columns="input_hash")
+
+#%%
+# Find the overlapping boundaries, for review
+overlaps = find_overlaps(output)
+overlaps.to_csv(os.path.join(OUTPUT_PATH, "temm_overlaps.csv"), index=False)
+summarize_overlaps(overlaps).to_csv(os.path.join(OUTPUT_PATH, "temm_overlaps_by_state.csv"), index=False)
+
+# The delta also gets the PWS's whose exported geometry changed only because
+# of the trimming: the lower-tier neighbors of the changed PWS's, or every
+# trimmed PWS if trimming was just turned on or off
+retrimmed = []
+if previous is not None:
+    if TRIM_OVERLAPS != previous_settings.get("export", {}).get("trim_overlaps", False):
+        retrimmed = overlaps.loc[(overlaps["tier_a"] < overlaps["tier_b"]).fillna(False), "pwsid_b"].unique()
+    elif TRIM_OVERLAPS:
+        retrimmed = trim_neighbors(output, overlaps, changes, previous)
+
+delta_changes = (pd
+    .concat([changes, pd.DataFrame({"pwsid": retrimmed, "change": "changed"})], ignore_index=True)
+    .drop_duplicates(subset="pwsid", keep="first"))
+
+if TRIM_OVERLAPS:
+    output = trim_overlaps(output, overlaps)
+
+#%%
+# Simplify and reduce the precision of the published geometries. The database
+# and the cached layer keep the full resolution.
+output, vertex_report = optimize_geometries(output, SIMPLIFY_TOLERANCES, GRID_SIZE)
+vertex_report.to_csv(os.path.join(OUTPUT_PATH, "temm_vertex_report.csv"), index=False)
+
+# The delta since the last run
+write_delta(delta_changes, output, previous, os.path.join(OUTPUT_PATH, "temm_delta.parquet"))
+
+#%%
+# Write the national layer in each of the export formats. GeoParquet and
+# FlatGeobuf can be read one state / bbox at a time.
+if previous is not None and len(changes) == 0 and previous_settings.get("export") == EXPORT_SETTINGS:
+    print("No changes since the last run. Skipping exports.")
+    EXPORT_FORMATS = []
+
+if "gpkg" in EXPORT_FORMATS:
+    write_geopackage(output, os.path.join(OUTPUT_PATH, "temm.gpkg"))
+
+if "parquet" in EXPORT_FORMATS:
+    write_geoparquet(output, os.path.join(OUTPUT_PATH, "temm.parquet"), partition_column="state_code")
+
+if "fgb" in EXPORT_FORMATS:
+    write_flatgeobuf(output, os.path.join(OUTPUT_PATH, "temm.fgb"))
+
+# Vector tiles for the web map
+if "mbtiles" in EXPORT_FORMATS:
+    build_mbtiles(output, os.path.join(OUTPUT_PATH, "temm.mbtiles"), max_zoom=TILES_MAX_ZOOM)
+
+print("Wrote data to export formats.\n")
 
 #%%
-# paths to write
-path_geopkg   = os.path.join(OUTPUT_PATH, "temm.gpkg")
-output.to_file(path_geopkg, driver="GPKG")
+# Save the combined layer and the settings for the next run
+write_geoparquet(combined_layer, COMBINED_PATH, partition_column="state_code")
 
-print("Wrote data to geopackage.\n")
\ No newline at end of file
+with open(SETTINGS_PATH, "w") as file:
+    json.dump({"combine": COMBINE_SETTINGS, "export": EXPORT_SETTINGS}, file, indent=2)
\ No newline at end of file
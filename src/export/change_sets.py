@@ -0,0 +1,127 @@
+"""
+Change sets for the combined TEMM layer.
+
+Every PWS gets a hash of all the inputs combine_tiers.py uses for it: its SDWIS
+attributes, its labeled / contributed boundaries, its best matched TIGER
+boundary, and its modeled centroid and radii. Comparing these to the hashes
+saved with the previous output tells which PWS's were added, changed or
+removed, so only those need to be recombined and reloaded.
+"""
+
+from typing import Optional
+
+import pandas as pd
+import geopandas as gpd
+
+from export.writers import write_geoparquet
+
+# One row per SDWIS PWS, with a hash of each database input (null if it has none)
+INPUT_HASHES_SQL = """
+    WITH sdwis AS (
+        SELECT pwsid, md5(CAST(c AS TEXT)) AS sdwis_hash
+        FROM pws_contributors c
+        WHERE source_system = 'sdwis'
+    ),
+    labeled AS (
+        SELECT
+            pwsid,
+            md5(string_agg(md5(CAST(c AS TEXT)), '|' ORDER BY source_system, contributor_id)) AS labeled_hash
+        FROM pws_contributors c
+        WHERE
+            source_system IN ('labeled', 'contributed') AND
+            NOT st_isempty(geometry)
+        GROUP BY pwsid
+    ),
+    matched AS (
+        SELECT
+            m.master_key AS pwsid,
+            md5(string_agg(md5(CAST(t AS TEXT)), '|' ORDER BY t.contributor_id)) AS matched_hash
+        FROM matches_ranked m
+        JOIN pws_contributors t ON m.candidate_contributor_sk = t.contributor_sk
+        WHERE
+            m.best_match AND
+            t.source_system = 'tiger'
+        GROUP BY m.master_key
+    )
+    SELECT s.pwsid, s.sdwis_hash, l.labeled_hash, m.matched_hash
+    FROM sdwis s
+    LEFT JOIN labeled l ON l.pwsid = s.pwsid
+    LEFT JOIN matched m ON m.pwsid = s.pwsid;
+"""
+
+CHANGES = ("added", "changed", "removed")
+
+
+def input_hashes(conn, t3: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    The pwsid and input_hash of every PWS in SDWIS. t3 is the Tier 3 centroid
+    and radius table (model.tier3.read_tier3).
+    """
+
+    hashes = pd.read_sql(INPUT_HASHES_SQL, conn)
+
+    modeled = t3.drop_duplicates(subset="pwsid").set_index("pwsid")
+    modeled_hash = pd.util.hash_pandas_object(modeled, index=False).map("{:016x}".format)
+
+    hashes["modeled_hash"] = hashes["pwsid"].map(modeled_hash)
+
+    parts = hashes[["sdwis_hash", "labeled_hash", "matched_hash", "modeled_hash"]].astype(object).fillna("")
+
+    return pd.DataFrame({
+        "pwsid": hashes["pwsid"],
+        "input_hash": pd.util.hash_pandas_object(
+            parts["sdwis_hash"].str.cat(parts.drop(columns="sdwis_hash"), sep="|"),
+            index=False).map("{:016x}".format).to_numpy()
+    })
+
+
+def diff_inputs(previous: Optional[pd.DataFrame], current: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    Compare the current input hashes to the previous ones (pwsid, input_hash).
+    Returns the pwsid and change (added, changed or removed) of every PWS that
+    differs. With no previous hashes, every PWS is added.
+    """
+
+    if previous is None:
+        return pd.DataFrame({"pwsid": current["pwsid"], "change": "added"})
+
+    both = previous[["pwsid", "input_hash"]].merge(
+        current[["pwsid", "input_hash"]], on="pwsid", how="outer", suffixes=("_previous", ""), indicator=True)
+
+    change = pd.Series(pd.NA, index=both.index, dtype="object")
+    change[both["_merge"] == "right_only"] = "added"
+    change[both["_merge"] == "left_only"] = "removed"
+    change[(both["_merge"] == "both") & (both["input_hash_previous"] != both["input_hash"])] = "changed"
+
+    return (pd.DataFrame({"pwsid": both["pwsid"], "change": change})
+        .dropna()
+        .reset_index(drop=True))
+
+
+def write_delta(
+        changes: pd.DataFrame,
+        output: gpd.GeoDataFrame,
+        previous: Optional[gpd.GeoDataFrame],
+        path: str
+    ):
+
+    """
+    Write the changed rows as GeoParquet, with a change column. Added and
+    changed PWS's have their new row; removed PWS's have their last row.
+    """
+
+    removed = changes.loc[changes["change"] == "removed", "pwsid"]
+
+    rows = [output.loc[output["pwsid"].isin(changes["pwsid"])]]
+    if previous is not None:
+        rows.append(previous.loc[previous["pwsid"].isin(removed)])
+
+    delta = gpd.GeoDataFrame(pd.concat(rows, ignore_index=True), crs=output.crs)
+    delta = delta.merge(changes, on="pwsid", how="left")
+
+    write_geoparquet(delta.drop(columns="input_hash", errors="ignore"), path, partition_column="state_code")
+
+    counts = changes["change"].value_counts()
+    print("Delta: " + ", ".join(f"{counts.get(c, 0)} {c}" for c in CHANGES) + ".")
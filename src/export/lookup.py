@@ -0,0 +1,298 @@
+"""
+Point -> water system lookup over the combined TEMM layer.
+
+The boundaries are indexed once with a BoundaryIndex (STRtree + prepared
+polygons). The index and the precedence arrays are persisted next to the
+layer (the geometries as WKB, the tree is rebuilt on load) and reused as long
+as the layer file doesn't change. Points are looked up in vectorized chunks. Where
+boundaries overlap, matches are ordered by tier precedence (Tier 1 before
+Tier 2 before Tier 3), then by area (smallest first).
+
+Usage:
+    python -m export.lookup points.csv matches.csv --lon lon --lat lat
+    python -m export.lookup --serve --port 8080
+
+The server answers GET /lookup?lon=-97.7&lat=30.3 and POST /lookup with a
+JSON body {"points": [[lon, lat], ...]}.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from dotenv import load_dotenv
+
+from export.writers import read_geoparquet
+from match.spatial_index import BoundaryIndex
+
+load_dotenv()
+
+OUTPUT_PATH = os.environ["WSB_OUTPUT_PATH"]
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+
+LAYER_PATH = os.path.join(OUTPUT_PATH, "temm.parquet")
+INDEX_PATH = os.path.join(STAGING_PATH, "temm_lookup_index.pkl")
+
+# Points per vectorized query
+CHUNK_SIZE = 1_000_000
+
+# Coordinates of the input points
+POINT_CRS = "EPSG:4326"
+
+
+class ServiceAreaLookup:
+    """
+    Finds the water system(s) whose service area contains each point.
+    """
+
+    def __init__(self, layer: gpd.GeoDataFrame, fingerprint: str = ""):
+
+        """
+        The layer is the national TEMM layer (as exported by combine_tiers),
+        with at least pwsid, tier, state_code and geometry.
+        """
+
+        has_geometry = ~(layer.geometry.isna() | layer.geometry.is_empty)
+
+        layer = layer.loc[has_geometry]
+
+        # BoundaryIndex expects state and geometry columns
+        boundaries = gpd.GeoDataFrame({
+                "pwsid": layer["pwsid"].to_numpy(),
+                "tier": layer["tier"].to_numpy(),
+                "state": layer["state_code"].to_numpy()
+            },
+            geometry=layer.geometry.to_numpy(), crs=layer.crs)
+
+        self.fingerprint = fingerprint
+        self.crs = layer.crs
+
+        # Precedence of each boundary, by its position in the index
+        self.pwsids = boundaries["pwsid"].to_numpy()
+        self.tiers = boundaries["tier"].to_numpy(dtype=np.int64)
+        # (area is only a tie-breaker, so the CRS units don't matter)
+        precedence = np.lexsort((shapely.area(boundaries.geometry.to_numpy()), self.tiers))
+        self.rank = np.empty(len(boundaries), dtype=np.int64)
+        self.rank[precedence] = np.arange(len(boundaries))
+
+        # The index reports positions, so the attributes and rank are array lookups
+        boundaries["boundary_pos"] = np.arange(len(boundaries))
+
+        self.index = BoundaryIndex(boundaries, id_column="boundary_pos")
+
+    @staticmethod
+    def from_parquet(path: str = LAYER_PATH) -> "ServiceAreaLookup":
+        return ServiceAreaLookup(
+            read_geoparquet(path, columns=["pwsid", "tier", "state_code"]), layer_fingerprint(path))
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load_or_build(path: str = LAYER_PATH, index_path: str = INDEX_PATH) -> "ServiceAreaLookup":
+
+        """
+        Reuse the persisted lookup if it was built from the same layer file,
+        otherwise build a new one from the layer and persist it.
+        """
+
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as file:
+                lookup = pickle.load(file)
+
+            if lookup.fingerprint == layer_fingerprint(path):
+                print("Loaded lookup index from disk.")
+                return lookup
+
+        lookup = ServiceAreaLookup.from_parquet(path)
+        lookup.save(index_path)
+        print(f"Built and saved lookup index ({len(lookup.pwsids)} boundaries).")
+
+        return lookup
+
+    def lookup(self, lon: np.ndarray, lat: np.ndarray, all_matches: bool = False) -> pd.DataFrame:
+
+        """
+        Look up points given as lon / lat arrays (EPSG:4326). Returns one row per
+        match with the point's position, pwsid, tier and match_rank (0 is the
+        preferred match). Unless all_matches is set, only the preferred match
+        for each point is returned; points outside every boundary are left out.
+        """
+
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+
+        results = [
+            self._lookup_chunk(lon[start:start + CHUNK_SIZE], lat[start:start + CHUNK_SIZE], start, all_matches)
+            for start in range(0, len(lon), CHUNK_SIZE)]
+
+        if not results:
+            return self._lookup_chunk(lon, lat, 0, all_matches)
+
+        return pd.concat(results, ignore_index=True)
+
+    def _lookup_chunk(self, lon: np.ndarray, lat: np.ndarray, offset: int, all_matches: bool) -> pd.DataFrame:
+        points = gpd.GeoDataFrame(
+            geometry=gpd.GeoSeries(shapely.points(lon, lat), crs=POINT_CRS).to_crs(self.crs))
+
+        hits = self.index.query(points)
+
+        point_pos = hits["point_pos"].to_numpy()
+        boundary_pos = hits["boundary_id"].to_numpy(dtype=np.int64)
+
+        # Sort each point's matches by precedence
+        order = np.lexsort((self.rank[boundary_pos], point_pos))
+        point_pos, boundary_pos = point_pos[order], boundary_pos[order]
+
+        first = np.ones(len(point_pos), dtype=bool)
+        first[1:] = point_pos[1:] != point_pos[:-1]
+        starts = np.flatnonzero(first)
+        match_rank = np.arange(len(point_pos)) - np.repeat(starts, np.diff(np.r_[starts, len(point_pos)]))
+
+        if not all_matches:
+            point_pos, boundary_pos, match_rank = point_pos[first], boundary_pos[first], match_rank[first]
+
+        return pd.DataFrame({
+            "point_pos": point_pos + offset,
+            "pwsid": self.pwsids[boundary_pos],
+            "tier": self.tiers[boundary_pos],
+            "match_rank": match_rank
+        })
+
+
+def layer_fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def lookup_csv(
+        engine: ServiceAreaLookup,
+        input_path: str,
+        output_path: str,
+        lon_column: str = "lon",
+        lat_column: str = "lat",
+        all_matches: bool = False
+    ):
+
+    """
+    Look up every point in a CSV, CHUNK_SIZE rows at a time, and write the input
+    rows with pwsid, tier and match_rank appended. Unmatched points are kept
+    with empty matches.
+    """
+
+    n_points = 0
+    n_matched = 0
+
+    for i, chunk in enumerate(pd.read_csv(input_path, chunksize=CHUNK_SIZE)):
+        matches = engine.lookup(chunk[lon_column].to_numpy(), chunk[lat_column].to_numpy(), all_matches)
+
+        chunk = chunk.reset_index(drop=True)
+        output = chunk.merge(matches, left_index=True, right_on="point_pos", how="left").drop(columns="point_pos")
+        output["tier"] = output["tier"].astype("Int64")
+        output["match_rank"] = output["match_rank"].astype("Int64")
+
+        output.to_csv(output_path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+
+        n_points += len(chunk)
+        n_matched += matches["point_pos"].nunique()
+
+    print(f"Matched {n_matched} of {n_points} points. Wrote {output_path}.")
+
+
+def serve(engine: ServiceAreaLookup, host: str = "127.0.0.1", port: int = 8080):
+
+    """
+    Serve lookups over HTTP (local use only; there is no authentication).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/lookup":
+                return self._reply(404, {"error": "not found"})
+
+            params = parse_qs(url.query)
+            try:
+                lon = [float(params["lon"][0])]
+                lat = [float(params["lat"][0])]
+            except (KeyError, ValueError):
+                return self._reply(400, {"error": "lon and lat are required"})
+
+            self._reply(200, self._lookup(lon, lat, "all" in params))
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/lookup":
+                return self._reply(404, {"error": "not found"})
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                points = np.asarray(body["points"], dtype=float).reshape(-1, 2)
+            except (KeyError, ValueError, TypeError):
+                return self._reply(400, {"error": "expected {\"points\": [[lon, lat], ...]}"})
+
+            self._reply(200, self._lookup(points[:, 0], points[:, 1], bool(body.get("all", False))))
+
+        def _lookup(self, lon, lat, all_matches: bool) -> dict:
+            matches = engine.lookup(lon, lat, all_matches)
+            results = [[] for _ in range(len(lon))]
+
+            for pos, pwsid, tier in zip(matches["point_pos"], matches["pwsid"], matches["tier"]):
+                results[pos].append({"pwsid": pwsid, "tier": int(tier)})
+
+            return {"results": results}
+
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving lookups on http://{host}:{port}/lookup")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up the water system serving each point.")
+    parser.add_argument("input", nargs="?", help="CSV of points.")
+    parser.add_argument("output", nargs="?", help="Output CSV.")
+    parser.add_argument("--lon", default="lon", help="Longitude column (EPSG:4326).")
+    parser.add_argument("--lat", default="lat", help="Latitude column (EPSG:4326).")
+    parser.add_argument("--all", action="store_true", help="Return every overlapping system, not just the preferred one.")
+    parser.add_argument("--layer", default=LAYER_PATH, help="GeoParquet TEMM layer.")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP endpoint instead.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if not args.serve and not (args.input and args.output):
+        parser.error("input and output are required unless --serve is given")
+
+    engine = ServiceAreaLookup.load_or_build(args.layer)
+
+    if args.serve:
+        serve(engine, args.host, args.port)
+    else:
+        lookup_csv(engine, args.input, args.output, args.lon, args.lat, args.all)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Size optimization of the published geometries.
+
+Each geometry is simplified with a tolerance that depends on its tier, without
+changing its topology (no self-intersections, no collapsed rings). The
+coordinates are then snapped to a fixed precision grid, which keeps the result
+valid. Both use the units of the layer's CRS. States are processed in
+parallel.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+import match.helpers as helpers
+
+# Tolerances in degrees (WSB_EPSG 4326), about 1 m for the labeled and TIGER
+# boundaries and 10 m for the modeled circles
+DEFAULT_TOLERANCES = {1: 0.00001, 2: 0.00001, 3: 0.0001}
+
+# About 10 cm in degrees
+DEFAULT_GRID_SIZE = 0.000001
+
+
+def parse_tolerances(value: str) -> Dict[int, float]:
+
+    """
+    Parse "tier:tolerance" pairs, e.g. "1:0.00001,2:0.00001,3:0.0001".
+    """
+
+    tolerances = {}
+
+    for pair in value.split(","):
+        if pair.strip():
+            tier, tolerance = pair.split(":")
+            tolerances[int(tier)] = float(tolerance)
+
+    return tolerances
+
+
+def optimize_geometries(
+        gdf: gpd.GeoDataFrame,
+        tolerances: Dict[int, float] = DEFAULT_TOLERANCES,
+        grid_size: float = DEFAULT_GRID_SIZE,
+        partition_column: str = "state_code",
+        workers: Optional[int] = None
+    ) -> Tuple[gpd.GeoDataFrame, pd.DataFrame]:
+
+    """
+    Simplify each geometry by its tier's tolerance (tiers not in tolerances,
+    and rows without a tier, are not simplified) and reduce the coordinate
+    precision to grid_size (0 to keep full precision).
+
+    Returns the optimized copy of gdf and a report of the vertex counts before
+    and after, by partition and tier.
+    """
+
+    geoms = gdf.geometry.to_numpy()
+    tiers = gdf["tier"].astype("Float64").to_numpy(dtype=float, na_value=np.nan)
+
+    tolerance = np.zeros(len(gdf))
+    for tier, value in tolerances.items():
+        tolerance[tiers == tier] = value
+
+    partitions = gdf[partition_column].astype(object).fillna("").to_numpy()
+    groups = [np.flatnonzero(partitions == p) for p in pd.unique(partitions)]
+    tasks = [(geoms[rows], tolerance[rows], grid_size) for rows in groups]
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        results = [_optimize(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_optimize, tasks))
+
+    optimized = np.empty(len(gdf), dtype=object)
+    for rows, result in zip(groups, results):
+        optimized[rows] = result
+
+    report = pd.DataFrame({
+        partition_column:   partitions,
+        "tier":             gdf["tier"].array,
+        "vertices_before":  shapely.get_num_coordinates(geoms),
+        "vertices_after":   shapely.get_num_coordinates(optimized)
+    })
+
+    report = (report
+        .groupby([partition_column, "tier"], dropna=False)
+        [["vertices_before", "vertices_after"]]
+        .sum()
+        .reset_index())
+
+    before = report["vertices_before"].sum()
+    after = report["vertices_after"].sum()
+    print(f"Optimized geometries: {before} -> {after} vertices ({1 - after / max(before, 1):.0%} smaller).")
+
+    return gdf.set_geometry(gpd.GeoSeries(optimized, index=gdf.index, crs=gdf.crs)), report
+
+
+def _optimize(task: Tuple[np.ndarray, np.ndarray, float]) -> np.ndarray:
+    geoms, tolerance, grid_size = task
+
+    result = geoms.copy()
+
+    simplify = tolerance > 0
+    result[simplify] = shapely.simplify(geoms[simplify], tolerance[simplify], preserve_topology=True)
+
+    if grid_size > 0:
+        # Drop vertices that collapse onto the same grid point, but keep
+        # polygons that would collapse entirely (tiny systems) as they are
+        snapped = shapely.set_precision(result, grid_size, mode="valid_output")
+        collapsed = shapely.is_empty(snapped) & ~shapely.is_empty(result)
+        result = np.where(collapsed, result, snapped)
+
+    return result
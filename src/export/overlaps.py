@@ -0,0 +1,209 @@
+"""
+Overlaps between the boundaries of the combined TEMM layer.
+
+All intersecting pairs are found with one STRtree query over the layer, and
+the area of each overlap is computed in the equal-area CRS (WSB_EPSG_AW).
+Optionally, lower-tier geometries are trimmed by the higher-tier geometries
+they overlap (e.g. a Tier 3 circle loses the part inside a Tier 1 boundary).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from dotenv import load_dotenv
+
+import match.helpers as helpers
+
+load_dotenv()
+
+PROJ = os.environ["WSB_EPSG_AW"]
+
+# Pairs per task
+CHUNK_SIZE = 5000
+
+# Overlaps smaller than this (in m^2) are treated as shared borders
+MIN_OVERLAP_AREA = 1.0
+
+
+def find_overlaps(
+        gdf: gpd.GeoDataFrame,
+        min_area: float = MIN_OVERLAP_AREA,
+        workers: Optional[int] = None
+    ) -> pd.DataFrame:
+
+    """
+    Every pair of overlapping boundaries in gdf (pwsid, tier, state_code and
+    geometry). Returns one row per pair, with the higher-precedence system
+    (lower tier) first: pwsid_a, tier_a, pwsid_b, tier_b, state_code_a,
+    state_code_b, overlap_area (m^2), and the share of each system's area.
+    """
+
+    gdf = gdf.reset_index(drop=True)
+    geoms = gdf.geometry.to_numpy()
+
+    tree = shapely.STRtree(geoms)
+    left, right = tree.query(geoms, predicate="intersects")
+
+    # Each pair once, and not a geometry with itself
+    keep = left < right
+    left, right = left[keep], right[keep]
+
+    # Order each pair by tier (then by position)
+    tiers = gdf["tier"].astype("Float64").to_numpy(dtype=float, na_value=np.inf)
+    swap = (tiers[right] < tiers[left])
+    left, right = np.where(swap, right, left), np.where(swap, left, right)
+
+    tasks = [
+        (geoms[left[i:i + CHUNK_SIZE]], geoms[right[i:i + CHUNK_SIZE]], gdf.crs)
+        for i in range(0, len(left), CHUNK_SIZE)]
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        results = [_overlap_areas(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_overlap_areas, tasks))
+
+    overlap_area = np.concatenate(results) if results else np.array([])
+    area = gdf.geometry.to_crs(PROJ).area.to_numpy()
+
+    overlaps = pd.DataFrame({
+        "pwsid_a":          gdf["pwsid"].to_numpy()[left],
+        "tier_a":           gdf["tier"].array[left],
+        "pwsid_b":          gdf["pwsid"].to_numpy()[right],
+        "tier_b":           gdf["tier"].array[right],
+        "state_code_a":     gdf["state_code"].to_numpy()[left],
+        "state_code_b":     gdf["state_code"].to_numpy()[right],
+        "overlap_area":     overlap_area,
+        "share_a":          overlap_area / area[left],
+        "share_b":          overlap_area / area[right]
+    })
+
+    overlaps = overlaps.loc[overlaps["overlap_area"] >= min_area].reset_index(drop=True)
+
+    print(f"Found {len(overlaps)} overlapping pairs among {len(gdf)} boundaries.")
+
+    return overlaps
+
+
+def summarize_overlaps(overlaps: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    Overlap counts and areas by state (of the lower-tier system) and tier pair.
+    """
+
+    return (overlaps
+        .assign(
+            state_code=overlaps["state_code_b"],
+            tiers=overlaps["tier_a"].astype(str) + "-" + overlaps["tier_b"].astype(str),
+            overlap_km2=overlaps["overlap_area"] / 1e6)
+        .groupby(["state_code", "tiers"], dropna=False)
+        .agg(
+            pairs=("pwsid_a", "size"),
+            systems=("pwsid_b", "nunique"),
+            overlap_km2=("overlap_km2", "sum"),
+            max_share=("share_b", "max"))
+        .reset_index())
+
+
+def trim_overlaps(
+        gdf: gpd.GeoDataFrame,
+        overlaps: pd.DataFrame,
+        workers: Optional[int] = None
+    ) -> gpd.GeoDataFrame:
+
+    """
+    Remove from each geometry the parts covered by higher-tier geometries
+    (same-tier overlaps are left alone). Geometries that would be left empty
+    are kept whole. Returns a copy of gdf.
+    """
+
+    lower = overlaps.loc[(overlaps["tier_a"] < overlaps["tier_b"]).fillna(False)]
+
+    position = pd.Series(np.arange(len(gdf)), index=gdf["pwsid"].to_numpy())
+    position = position[~position.index.duplicated()]
+
+    geoms = gdf.geometry.to_numpy()
+
+    targets = position[lower["pwsid_b"]].to_numpy()
+    cutters = position[lower["pwsid_a"]].to_numpy()
+
+    order = np.argsort(targets, kind="stable")
+    targets, cutters = targets[order], cutters[order]
+
+    unique_targets, starts = np.unique(targets, return_index=True)
+    cutter_groups = np.split(cutters, starts[1:])
+
+    tasks = [
+        (geoms[unique_targets[i:i + CHUNK_SIZE]], [geoms[c] for c in cutter_groups[i:i + CHUNK_SIZE]])
+        for i in range(0, len(unique_targets), CHUNK_SIZE)]
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        results = [_trim(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_trim, tasks))
+
+    trimmed = geoms.copy()
+    if results:
+        trimmed[unique_targets] = np.concatenate(results)
+
+    print(f"Trimmed {len(unique_targets)} lower-tier boundaries.")
+
+    return gdf.set_geometry(gpd.GeoSeries(trimmed, index=gdf.index, crs=gdf.crs))
+
+
+def trim_neighbors(
+        gdf: gpd.GeoDataFrame,
+        overlaps: pd.DataFrame,
+        changes: pd.DataFrame,
+        previous: Optional[gpd.GeoDataFrame]
+    ) -> np.ndarray:
+
+    """
+    The PWS's that didn't change themselves, but whose trimmed geometry can
+    differ from the last run's: the lower-tier systems that overlap the new
+    geometry (from overlaps) or the previous geometry of a changed PWS. Call
+    it with the untrimmed gdf.
+    """
+
+    changed = changes["pwsid"].to_numpy()
+
+    lower = overlaps.loc[(overlaps["tier_a"] < overlaps["tier_b"]).fillna(False)]
+    neighbors = [lower.loc[lower["pwsid_a"].isin(changed), "pwsid_b"].to_numpy(dtype=object)]
+
+    if previous is not None:
+        old = previous.loc[previous["pwsid"].isin(changed)]
+
+        tree = shapely.STRtree(gdf.geometry.to_numpy())
+        old_pos, pos = tree.query(old.geometry.to_numpy(), predicate="intersects")
+
+        old_tiers = old["tier"].astype("Float64").to_numpy(dtype=float, na_value=np.inf)
+        tiers = gdf["tier"].astype("Float64").to_numpy(dtype=float, na_value=np.inf)
+
+        lower = old_tiers[old_pos] < tiers[pos]
+        neighbors.append(gdf["pwsid"].to_numpy(dtype=object)[pos[lower]])
+
+    neighbors = pd.unique(np.concatenate(neighbors))
+
+    return neighbors[~pd.Series(neighbors).isin(changed).to_numpy()]
+
+
+def _overlap_areas(task) -> np.ndarray:
+    left, right, crs = task
+    overlap = gpd.GeoSeries(shapely.intersection(left, right), crs=crs)
+
+    return overlap.to_crs(PROJ).area.to_numpy()
+
+
+def _trim(task: Tuple[np.ndarray, List[np.ndarray]]) -> np.ndarray:
+    geoms, cutter_groups = task
+
+    cutters = np.array([shapely.union_all(group) for group in cutter_groups], dtype=object)
+    trimmed = shapely.difference(geoms, cutters)
+
+    return np.where(shapely.is_empty(trimmed), geoms, trimmed)
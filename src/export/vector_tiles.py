@@ -0,0 +1,249 @@
+"""
+Vector tile (MBTiles) export of the combined TEMM layer, for the web map.
+
+Geometries are reprojected to Web Mercator and simplified once per zoom level
+(to about a pixel at that zoom). Each tile is clipped from an STRtree over the
+simplified geometries and encoded as a Mapbox Vector Tile. Tiles are built in
+parallel, in batches by zoom level and tile range, and written to a single
+MBTiles (SQLite) file by the main process. No tile server is needed.
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import mapbox_vector_tile
+import shapely
+
+import match.helpers as helpers
+
+LAYER_NAME = "temm"
+ATTRIBUTES = ["pwsid", "tier", "pws_name"]
+
+# Half the width of the Web Mercator square, in meters
+MERCATOR_HALF = 20037508.342789244
+
+EXTENT = 4096
+
+# Geometries are clipped a little outside each tile so strokes don't show seams
+CLIP_BUFFER = 64 / EXTENT
+
+# Tiles per task
+BATCH_SIZE = 256
+
+# Per-worker state (see _init_worker)
+_layer: Optional[gpd.GeoDataFrame] = None
+_zoom_cache: Dict[int, Tuple[shapely.STRtree, np.ndarray]] = {}
+
+
+def tile_size(zoom: int) -> float:
+    return 2 * MERCATOR_HALF / 2 ** zoom
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+
+    """
+    Web Mercator bounds (xmin, ymin, xmax, ymax) of an XYZ tile.
+    """
+
+    size = tile_size(zoom)
+    xmin = -MERCATOR_HALF + x * size
+    ymax = MERCATOR_HALF - y * size
+
+    return (xmin, ymax - size, xmin + size, ymax)
+
+
+def covering_tiles(bounds: np.ndarray, zoom: int) -> np.ndarray:
+
+    """
+    Every (x, y) tile at this zoom touched by any of the bounding boxes
+    (an n x 4 array of xmin, ymin, xmax, ymax in Web Mercator).
+    """
+
+    n = 2 ** zoom
+    size = tile_size(zoom)
+
+    x0 = np.clip(np.floor((bounds[:, 0] + MERCATOR_HALF) / size), 0, n - 1).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + MERCATOR_HALF) / size), 0, n - 1).astype(np.int64)
+    y0 = np.clip(np.floor((MERCATOR_HALF - bounds[:, 3]) / size), 0, n - 1).astype(np.int64)
+    y1 = np.clip(np.floor((MERCATOR_HALF - bounds[:, 1]) / size), 0, n - 1).astype(np.int64)
+
+    widths = x1 - x0 + 1
+    heights = y1 - y0 + 1
+    counts = widths * heights
+
+    # Expand each box into its tiles, then dedupe
+    box = np.repeat(np.arange(len(bounds)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    xs = x0[box] + offset % widths[box]
+    ys = y0[box] + offset // widths[box]
+
+    return np.unique(np.column_stack([xs, ys]), axis=0)
+
+
+def build_mbtiles(
+        layer: gpd.GeoDataFrame,
+        path: str,
+        min_zoom: int = 0,
+        max_zoom: int = 12,
+        workers: Optional[int] = None
+    ):
+
+    """
+    Build an MBTiles archive from the layer (any CRS). Only tiles that contain
+    data are written.
+    """
+
+    layer = layer[ATTRIBUTES + [layer.geometry.name]].to_crs("EPSG:3857")
+
+    has_geometry = ~(layer.geometry.isna() | layer.geometry.is_empty)
+    layer = layer.loc[has_geometry].reset_index(drop=True)
+
+    bounds = shapely.bounds(layer.geometry.to_numpy())
+
+    tasks: List[Tuple[int, np.ndarray]] = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        tiles = covering_tiles(bounds, zoom)
+        tasks.extend((zoom, tiles[i:i + BATCH_SIZE]) for i in range(0, len(tiles), BATCH_SIZE))
+
+    print(f"Building {sum(len(t) for _, t in tasks)} candidate tiles for zooms {min_zoom}-{max_zoom}...")
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    db = sqlite3.connect(path)
+    _create_mbtiles(db, layer, bounds, min_zoom, max_zoom)
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        _init_worker(layer)
+        written = _write_tiles(db, map(_build_batch, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(layer,)) as executor:
+            written = _write_tiles(db, executor.map(_build_batch, tasks))
+
+    db.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);")
+    db.commit()
+    db.close()
+
+    print(f"Wrote {written} tiles to {path}.")
+
+
+def _write_tiles(db: sqlite3.Connection, results) -> int:
+    written = 0
+
+    for batch in results:
+        # MBTiles uses TMS row numbering (y flipped)
+        db.executemany(
+            "INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?);",
+            [(z, x, (2 ** z - 1) - y, data) for z, x, y, data in batch])
+        written += len(batch)
+
+    return written
+
+
+def _create_mbtiles(db: sqlite3.Connection, layer: gpd.GeoDataFrame, bounds: np.ndarray, min_zoom: int, max_zoom: int):
+    db.execute("CREATE TABLE metadata (name TEXT, value TEXT);")
+    db.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);")
+
+    lon_lat = (gpd.GeoSeries(
+            shapely.box(
+                np.nanmin(bounds[:, 0]), np.nanmin(bounds[:, 1]),
+                np.nanmax(bounds[:, 2]), np.nanmax(bounds[:, 3])),
+            crs="EPSG:3857")
+        .to_crs("EPSG:4326")
+        .total_bounds)
+
+    metadata = {
+        "name": LAYER_NAME,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": ",".join(f"{v:.6f}" for v in lon_lat),
+        "center": f"{(lon_lat[0] + lon_lat[2]) / 2:.6f},{(lon_lat[1] + lon_lat[3]) / 2:.6f},{min_zoom}",
+        "json": json.dumps({
+            "vector_layers": [{
+                "id": LAYER_NAME,
+                "minzoom": min_zoom,
+                "maxzoom": max_zoom,
+                "fields": {"pwsid": "String", "tier": "Number", "pws_name": "String"}
+            }]
+        })
+    }
+
+    db.executemany("INSERT INTO metadata (name, value) VALUES (?, ?);", metadata.items())
+
+
+def _init_worker(layer: gpd.GeoDataFrame):
+    global _layer, _zoom_cache
+    _layer = layer
+    _zoom_cache = {}
+
+
+def _zoom_geometries(zoom: int) -> Tuple[shapely.STRtree, np.ndarray]:
+
+    """
+    The layer simplified to about one pixel at this zoom, and a tree over it.
+    Built once per zoom in each worker.
+    """
+
+    if zoom not in _zoom_cache:
+        tolerance = tile_size(zoom) / EXTENT
+        simplified = shapely.simplify(_layer.geometry.to_numpy(), tolerance, preserve_topology=True)
+        _zoom_cache[zoom] = (shapely.STRtree(simplified), simplified)
+
+    return _zoom_cache[zoom]
+
+
+def _build_batch(task: Tuple[int, np.ndarray]) -> List[Tuple[int, int, int, bytes]]:
+    zoom, tiles = task
+    tree, geoms = _zoom_geometries(zoom)
+
+    properties = _layer[ATTRIBUTES]
+    results = []
+
+    for x, y in tiles:
+        x, y = int(x), int(y)
+        bounds = tile_bounds(zoom, x, y)
+
+        margin = tile_size(zoom) * CLIP_BUFFER
+        clip_box = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+
+        hits = tree.query(shapely.box(*clip_box))
+        if len(hits) == 0:
+            continue
+
+        clipped = shapely.clip_by_rect(geoms[hits], *clip_box)
+        keep = ~shapely.is_empty(clipped)
+        if not keep.any():
+            continue
+
+        features = [
+            {"geometry": geom, "properties": _properties(row)}
+            for geom, row in zip(clipped[keep], properties.iloc[hits[keep]].to_dict("records"))]
+
+        data = mapbox_vector_tile.encode(
+            [{"name": LAYER_NAME, "features": features}],
+            default_options={"quantize_bounds": bounds, "extents": EXTENT})
+
+        results.append((zoom, x, y, gzip.compress(data)))
+
+    return results
+
+
+def _properties(row: dict) -> dict:
+
+    """
+    Tile properties can't be null, so leave out missing values.
+    """
+
+    return {
+        k: v.item() if isinstance(v, np.generic) else v
+        for k, v in row.items() if not pd.isna(v)}
@@ -0,0 +1,154 @@
+"""
+Columnar writers for the combined TEMM layer.
+
+GeoParquet is written with one row group per state and a bbox covering
+column, so readers can fetch a single state or bounding box without scanning
+the national file. FlatGeobuf and GeoPackage are written through pyogrio's
+Arrow path; FlatGeobuf gets a packed Hilbert R-tree index.
+"""
+
+import json
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+
+GEOPARQUET_VERSION = "1.1.0"
+
+
+def write_geoparquet(gdf: gpd.GeoDataFrame, path: str, partition_column: str = "state_code"):
+
+    """
+    Write gdf as GeoParquet (WKB geometry + bbox covering column), sorted by
+    partition_column with one row group per distinct value.
+    """
+
+    gdf = gdf.sort_values([partition_column, "pwsid"], na_position="last").reset_index(drop=True)
+
+    geometry_column = gdf.geometry.name
+    geoms = gdf.geometry.to_numpy()
+    bounds = shapely.bounds(geoms)
+
+    table = pa.Table.from_pandas(
+        pd.DataFrame(gdf.drop(columns=geometry_column)), preserve_index=False)
+
+    table = table.append_column(geometry_column, pa.array(shapely.to_wkb(geoms), pa.binary()))
+    table = table.append_column("bbox", pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)],
+        names=["xmin", "ymin", "xmax", "ymax"]))
+
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"geo": json.dumps(_geo_metadata(gdf, bounds)).encode()})
+
+    # Each run of equal partition values becomes its own row group
+    values = gdf[partition_column].astype(object).fillna("").to_numpy()
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]]) if len(values) else np.array([], dtype=int)
+    lengths = np.diff(np.r_[starts, len(values)])
+
+    with pq.ParquetWriter(path, table.schema, compression="zstd") as writer:
+        for start, length in zip(starts, lengths):
+            writer.write_table(table.slice(start, length), row_group_size=length)
+
+    print(f"Wrote {len(gdf)} rows in {len(starts)} row groups to {path}.")
+
+
+def read_geoparquet(
+        path: str,
+        states: Optional[Sequence[str]] = None,
+        bbox: Optional[Sequence[float]] = None,
+        partition_column: str = "state_code",
+        columns: Optional[List[str]] = None
+    ) -> gpd.GeoDataFrame:
+
+    """
+    Read a GeoParquet file written by write_geoparquet. Only the row groups
+    that can contain the given states / bbox (xmin, ymin, xmax, ymax) are read.
+    """
+
+    metadata = json.loads(pq.read_schema(path).metadata[b"geo"])
+    geometry_column = metadata["primary_column"]
+
+    condition = None
+
+    if states is not None:
+        condition = pc.field(partition_column).isin(list(states))
+
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        overlaps = (
+            (pc.field("bbox", "xmin") <= xmax) & (pc.field("bbox", "xmax") >= xmin) &
+            (pc.field("bbox", "ymin") <= ymax) & (pc.field("bbox", "ymax") >= ymin))
+        condition = overlaps if condition is None else condition & overlaps
+
+    if columns is not None and geometry_column not in columns:
+        columns = columns + [geometry_column]
+
+    table = ds.dataset(path, format="parquet").to_table(columns=columns, filter=condition)
+
+    df = table.drop([c for c in ["bbox"] if c in table.column_names]).to_pandas()
+    df[geometry_column] = shapely.from_wkb(df[geometry_column].to_numpy())
+
+    crs = metadata["columns"][geometry_column].get("crs")
+
+    return gpd.GeoDataFrame(df, geometry=geometry_column, crs=json.dumps(crs) if crs else None)
+
+
+def write_flatgeobuf(gdf: gpd.GeoDataFrame, path: str):
+
+    """
+    Write gdf as FlatGeobuf with a packed Hilbert R-tree spatial index.
+    The index can't hold empty geometries, so those rows are left out.
+    """
+
+    has_geometry = ~(gdf.geometry.isna() | gdf.geometry.is_empty)
+
+    pyogrio.write_dataframe(
+        gdf.loc[has_geometry], path, driver="FlatGeobuf", use_arrow=True, SPATIAL_INDEX="YES")
+
+    print(f"Wrote {has_geometry.sum()} rows to {path} ({(~has_geometry).sum()} without geometry skipped).")
+
+
+def write_geopackage(gdf: gpd.GeoDataFrame, path: str):
+    pyogrio.write_dataframe(gdf, path, driver="GPKG", use_arrow=True)
+
+    print(f"Wrote {len(gdf)} rows to {path}.")
+
+
+def _geo_metadata(gdf: gpd.GeoDataFrame, bounds: np.ndarray) -> dict:
+    geometry_column = gdf.geometry.name
+
+    metadata = {
+        "version": GEOPARQUET_VERSION,
+        "primary_column": geometry_column,
+        "columns": {
+            geometry_column: {
+                "encoding": "WKB",
+                "geometry_types": sorted(set(gdf.geom_type.dropna())),
+                "crs": gdf.crs.to_json_dict() if gdf.crs is not None else None,
+                "covering": {
+                    "bbox": {
+                        "xmin": ["bbox", "xmin"],
+                        "ymin": ["bbox", "ymin"],
+                        "xmax": ["bbox", "xmax"],
+                        "ymax": ["bbox", "ymax"]
+                    }
+                }
+            }
+        }
+    }
+
+    # Empty layers (e.g. an empty delta) have no bbox
+    if not np.isnan(bounds).all():
+        metadata["columns"][geometry_column]["bbox"] = [
+            float(np.nanmin(bounds[:, 0])), float(np.nanmin(bounds[:, 1])),
+            float(np.nanmax(bounds[:, 2])), float(np.nanmax(bounds[:, 3]))]
+
+    return metadata
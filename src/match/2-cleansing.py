@@ -5,6 +5,8 @@ import geopandas as gpd
 from dotenv import load_dotenv
 import sqlalchemy as sa
 
+import match.helpers as helpers
+
 load_dotenv()
 
 pd.options.display.max_columns = None
@@ -160,7 +162,7 @@ print(f"Found {len(impostors)} impostors.")
 
 #%%
 # Save to the database
-impostors.to_postgis("impostors", conn, if_exists="replace")
+helpers.copy_to_table(conn, "impostors", impostors, truncate=True)
 
 #%%
 # Remove the address, lat/lon, and geometry when it's an "impostor"
@@ -1,12 +1,19 @@
 #%%
 
 import os
-from typing import List, Optional
 import pandas as pd
 import geopandas as gpd
 from dotenv import load_dotenv
 import sqlalchemy as sa
 
+import match.helpers as helpers
+from match.match_rules import (
+    ANCHOR_SYSTEMS, ATTRIBUTE_RULES, RULE_BITS, SPATIAL_RULES, rule_labels, rules_involving)
+from match.features import refresh_features
+from match.rule_engine import MatchRuleEngine
+from match.schema import apply_schema
+from match.spatial_index import BoundaryIndex
+
 load_dotenv()
 
 pd.options.display.max_columns = None
@@ -15,50 +22,48 @@ pd.options.display.max_columns = None
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
 
+# Incremental mode: set WSB_MATCH_CHANGED_SYSTEMS to a comma-separated list of
+# reloaded source systems (e.g. "mhp") to re-run only the rules that involve them.
+# Leave it empty for a full match.
+CHANGED_SYSTEMS = [
+    s.strip() for s in os.environ.get("WSB_MATCH_CHANGED_SYSTEMS", "").split(",") if s.strip()]
+
+if CHANGED_SYSTEMS:
+    attribute_rules, spatial_rules = rules_involving(CHANGED_SYSTEMS)
+else:
+    attribute_rules, spatial_rules = ATTRIBUTE_RULES, SPATIAL_RULES
+
+# The anchors are always needed, because the MHP flags are derived from them
+systems = set(ANCHOR_SYSTEMS)
+for rule in attribute_rules + spatial_rules:
+    systems.update(rule.source_systems)
+
 #%%
 # Load up the supermodel
 
 print("Pulling data from the database...", end=None)
 supermodel = gpd.GeoDataFrame.from_postgis(
-    "SELECT * FROM pws_contributors;", conn, geom_col="geometry")
+    sa.text("SELECT * FROM pws_contributors WHERE source_system IN :systems;")
+        .bindparams(sa.bindparam("systems", expanding=True)),
+    conn, geom_col="geometry", params={"systems": sorted(systems)})
 print("done.")
 
+# Low-cardinality columns (source_system, state, ...) as categoricals,
+# so the rule masks compare integer codes
+supermodel = apply_schema(supermodel)
+
+if CHANGED_SYSTEMS:
+    print(
+        f"Incremental match for {', '.join(CHANGED_SYSTEMS)}: " +
+        f"running {len(attribute_rules) + len(spatial_rules)} rules.")
+
 #%% ##############################
-# More Cleansing (or this could move to script #1, or into the tokenization)
+# Bring the feature table up to date (tokens, MHP flags, normalized address,
+# projected geometry). Only contributors whose inputs changed are recomputed.
 ##################################
 
-# These words usually indicate a mobile home park
-regex = r"\b(?:MOBILE|TRAILER|MHP|TP|CAMPGROUND|RV)\b"
-
-supermodel["likely_mhp"] = (
-    (supermodel["source_system"] == "mhp") |
-    # If ANY of systems with the same PWSID have a name that indicates likely MHP,
-    # then mark the whole set as likely MHP
-    supermodel["pwsid"].isin(
-        supermodel[
-            supermodel["source_system"].isin(["echo", "sdwis", "frs"]) &
-            supermodel["name"].notna() &
-            supermodel["name"].fillna("").str.contains(regex, regex=True)
-        ]["pwsid"]
-    )
-)
-
-# These words often (but not always) indicate a mobile home park
-regex = r"\b(?:VILLAGE|MANOR|ACRES|ESTATES)\b"
-
-supermodel["possible_mhp"] = (
-    (supermodel["source_system"] == "mhp") |
-    (supermodel["likely_mhp"]) |
-    supermodel["pwsid"].isin(
-        supermodel[
-            supermodel["source_system"].isin(["echo", "sdwis", "frs"]) &
-            supermodel["name"].notna() &
-            supermodel["name"].fillna("").str.contains(regex, regex=True)
-        ]["pwsid"]
-    ))
-
-print("Labeled likely and possible MHP's.")
-
+features = refresh_features(conn,
+    sorted(systems | set(CHANGED_SYSTEMS)) if CHANGED_SYSTEMS else None)
 
 #%% ##########################
 # Now on to the matching.
@@ -87,71 +92,20 @@ Matching
 """
 
 
-# We'll use this for name matching
-def tokenize_ws_name(series) -> pd.Series:
-    replace = (
-        r"(CITY|TOWN|VILLAGE)( OF)?|WSD|HOA|WATERING POINT|LLC|PWD|PWS|SUBDIVISION" +
-        r"|MUNICIPAL UTILITIES|WATERWORKS|MUTUAL|WSC|PSD|MUD" +
-        r"|(PUBLIC |RURAL )?WATER( DISTRICT| COMPANY| SYSTEM| WORKS| DEPARTMENT| DEPT| UTILITY)?"
-    )
-
-    return (series
-        .str.upper() # Standardize to upper-case
-        .str.replace(fr"\b({replace})\b", "", regex=True)   # Remove water and utility words
-        .str.replace(r"[^\w ]", " ", regex=True)            # Replace non-word characters
-        .str.replace(r"\s\s+", " ", regex=True)             # Normalize spaces
-        .str.strip()                                        # Remove leading and trailing spaces
-        .replace({"": pd.NA}))                              # If left with nothing, null it out
-
-def tokenize_mhp_name(series) -> pd.Series:
-    
-    # NOTE: It might be better to do standardizations instead of replacing with empty
-    replace = (
-        r"MOBILE (HOME|TRAILER)( PARK| PK)?|MOBILE (ESTATE(S?)|VILLAGE|MANOR|COURT|VILLA|HAVEN|RANCH|LODGE|RESORT)|" + 
-        r"MOBILE(HOME|LODGE)|MOBILE( PARK| PK| COM(MUNITY)?)|MHP"
-    )
-
-    return (series
-        .str.upper() # Standardize to upper-case
-        .str.replace(fr"\b({replace})\b", "", regex=True)   # Remove MHP words
-        .str.replace(r"[^\w ]", " ", regex=True)            # Replace non-word characters
-        .str.replace(r"\s\s+", " ", regex=True)             # Normalize spaces
-        .str.strip()
-        .replace({"": pd.NA}))                              # If left with nothing, null it out
-
-
-def run_match(match_rule:str, left_on: List[str], right_on: Optional[List[str]] = None, left_mask = None, right_mask = None):
-    
-    if right_on is None:
-        right_on = left_on
-
-    left = tokens if left_mask is None else tokens.loc[left_mask]
-    right = tokens if right_mask is None else tokens.loc[right_mask]
-
-    matches = (left
-        .merge(
-            right,
-            left_on=left_on,
-            right_on=right_on)
-        [["master_key_x", "contributor_id_x", "contributor_id_y"]]
-        .rename(columns={"master_key_x": "master_key"}))
-
-    matches["match_rule"] = match_rule
-
-    return matches
-
 #%% ##############################
 # Create a token table and apply standardizations
 ##################################
 
 tokens = supermodel[[
-    "source_system", "contributor_id", "master_key", "state", "name", "city_served",
-    "address_line_1", "city", "zip", "county", 
-    "geometry", "centroid_quality", "likely_mhp", "possible_mhp"
-    ]].copy()
-
-tokens["name_tkn"] = tokenize_ws_name(tokens["name"])
-tokens["mhp_name_tkn"] = tokenize_mhp_name(tokens["name"])
+    "source_system", "contributor_id", "contributor_sk", "master_key", "master_sk",
+    "state", "name", "city_served",
+    "address_line_1", "city", "zip", "county",
+    "geometry", "centroid_quality"
+    ]].merge(
+        features[[
+            "contributor_id", "name_tkn", "mhp_name_tkn", "address_norm",
+            "likely_mhp", "possible_mhp"]],
+        on="contributor_id", how="left")
 
 print("Generated token table.")
 
@@ -164,201 +118,120 @@ print("Generated token table.")
 
 # Stash the tokens WITHOUT geometry (for speed)
 # These are used in reporting later
-conn.execute("DROP TABLE IF EXISTS tokens;")
-tokens.drop(columns="geometry").to_sql("tokens", conn, index=False)
+if CHANGED_SYSTEMS:
+    with conn.begin() as tx:
+        tx.execute(
+            sa.text("DELETE FROM tokens WHERE source_system IN :systems;")
+                .bindparams(sa.bindparam("systems", expanding=True)),
+            {"systems": CHANGED_SYSTEMS})
+
+        helpers.copy_to_table(tx, "tokens", tokens
+            .loc[tokens["source_system"].isin(CHANGED_SYSTEMS)]
+            .drop(columns="geometry"))
+else:
+    helpers.copy_to_table(conn, "tokens", tokens.drop(columns="geometry"), truncate=True)
 
 print("Saved token table to database (for later analysis)")
 
 #%% #########################
-# Rule: Match on state + name to SDWIS/ECHO/FRS -> TIGER
-# 23,286 matches
-
-new_matches = run_match(
-    "state+name_tiger",
-    ["state", "name_tkn"],
-    left_mask = (
-        tokens["source_system"].isin(["sdwis", "echo", "frs"]) &
-        tokens["state"].notna() &
-        tokens["name_tkn"].notna() &
-        (~tokens["likely_mhp"])),
-    right_mask = (
-        tokens["source_system"].isin(["tiger"]) &
-        tokens["state"].notna() &
-        tokens["name_tkn"].notna()))
-
-print(f"State+Name to Tiger matches: {len(new_matches)}")
-
-matches = new_matches
-
-#%% #########################
-# Rule: Match on state + name to MHP
-# 1,875 matches
-
-new_matches = run_match(
-    "state+name_mhp",
-    ["state", "name_tkn"],
-    left_mask = (
-        tokens["source_system"].isin(["sdwis", "echo", "frs"]) &
-        tokens["state"].notna() &
-        tokens["name_tkn"].notna()),
-    right_mask = (
-        tokens["source_system"].isin(["mhp"]) &
-        tokens["state"].notna() &
-        tokens["name_tkn"].notna()))
-
-print(f"State+Name MHP matches: {len(new_matches)}")
-
-matches = pd.concat([matches, new_matches])
+# Rules: State + name, city_served, and MHP attribute matches
+# These are declared in match_rules.py and run by the rule engine.
+# Pairs are reported with the integer surrogate keys, which are cheaper to
+# deduplicate and join than the string ID's.
 
+engine = MatchRuleEngine(tokens, id_column="contributor_sk", master_column="master_sk")
+rule_matches = [engine.run(attribute_rules)] if attribute_rules else []
 
 #%% #########################
-# Rule: Spatial matches
-# 11,941 matches between echo/frs and tiger
-# (Down from 22,200 before excluding state, county, and zip centroids)
-
-left_mask = (
-    tokens["source_system"].isin(["echo", "frs"]) &
-    (~tokens["likely_mhp"]) &
-    (~tokens["centroid_quality"].isin([
-        "STATE CENTROID",
-        "COUNTY CENTROID",
-        "ZIP CODE CENTROID"
-    ])))
-
-right_mask = tokens["source_system"].isin(["tiger"])
-
-new_matches = (tokens[left_mask]
-    .sjoin(tokens[right_mask], lsuffix="x", rsuffix="y")
-    [["master_key_x", "contributor_id_x", "contributor_id_y"]]
-    .rename(columns={"master_key_x": "master_key"})
-    .assign(match_rule="spatial"))
-
+# Rules: Spatial matches to TIGER
+# All spatial rules share one STRtree over the TIGER polygons
 
-# Also require that the states match in both systems
+if spatial_rules:
+    boundary_index = BoundaryIndex(
+        tokens.loc[tokens["source_system"] == "tiger", ["contributor_sk", "state", "geometry"]],
+        id_column="contributor_sk")
 
-contributor_state = tokens.set_index("contributor_id")["state"]
+    rule_matches.append(engine.run_spatial(spatial_rules, boundary_index))
 
-new_matches_with_states = (new_matches
-    .join(contributor_state, on="contributor_id_x")
-    .join(contributor_state, on="contributor_id_y", rsuffix="_y"))
+matches = (pd.concat(rule_matches, ignore_index=True) if rule_matches
+    else pd.DataFrame(columns=["master_sk", "contributor_sk_x", "contributor_sk_y", "match_rule"]))
 
-new_matches = new_matches[new_matches_with_states["state"] == new_matches_with_states["state_y"]]
-
-print(f"Spatial matches: {len(new_matches)}")
-
-matches = pd.concat([matches, new_matches])
+#%% ################################
+# Deduplicate matches to PWSID <-> contributor_id pairs.
+####################################
 
-#%% #########################
-# Rule: match state+city_served to state&name
-# 16,265 matches
-
-new_matches = run_match(
-    "state+city_served",
-    left_on = ["state", "city_served"],
-    right_on = ["state", "name_tkn"],
-    left_mask = (
-        tokens["source_system"].isin(["sdwis"]) &
-        tokens["state"].notna() &
-        tokens["city_served"].notna() &
-        (~tokens["likely_mhp"])),
-    right_mask = (
-        tokens["source_system"].isin(["tiger"]) &
-        tokens["state"].notna() &
-        tokens["name_tkn"].notna()))
-
-print(f"Match on city_served: {len(new_matches)}")
-
-matches = pd.concat([matches, new_matches])
+# The left side contains known PWS's and can be deduplicated by crosswalking to the master_key (pwsid)
+# The right side contains unknown (candidate) matches and could stay as an contributor_id
+# (Both are carried as their surrogate keys: master_sk and contributor_sk)
 
-#%% #########################
-# Rule: UCMR to TIGER Spatial matches
-# 2,999 matches
+def deduplicate_matches(matches: pd.DataFrame) -> pd.DataFrame:
 
-left_mask = tokens["source_system"].isin(["ucmr"])
-right_mask = tokens["source_system"].isin(["tiger"])
+    # Encode each rule as a bit. Since every rule has a distinct bit, the sum of the
+    # distinct bits within a group is the same as their bitwise OR.
+    mk_matches = (matches
+        .rename(columns={"contributor_sk_y": "candidate_contributor_sk"}) #type:ignore
+        .assign(match_rule=matches["match_rule"].map(RULE_BITS).astype("int64"))
+        [["master_sk", "candidate_contributor_sk", "match_rule"]]
+        .drop_duplicates()
+        .groupby(["master_sk", "candidate_contributor_sk"], sort=False)["match_rule"]
+        .sum()
+        .reset_index())
 
-new_matches = (tokens[left_mask]
-    .sjoin(tokens[right_mask], lsuffix="x", rsuffix="y")
-    [["master_key_x", "contributor_id_x", "contributor_id_y"]]
-    .rename(columns={"master_key_x": "master_key"})
-    .assign(match_rule="ucmr_spatial"))
+    mk_matches["match_rule_label"] = rule_labels(mk_matches["match_rule"])
 
-print(f"UCMR spatial matches: {len(new_matches)}")
+    return mk_matches
 
-matches = pd.concat([matches, new_matches])
+#%%
 
-#%% #########################
-# Rule: match MHP's by tokenized name
-# 20897 matches. Not great, but then again, not all MHP's will have water systems.
-
-# We get a few hundred more matches if we exclude the county, and it *seems* like
-# MHP names should be relatively unique within the state...but I spot checked
-# some and wasn't 100% convinced. So I'm being conservative and requiring county.
-
-new_matches = run_match(
-    "state+mhp_name",
-    ["state", "mhp_name_tkn", "county"],
-    left_mask = (
-        tokens["source_system"].isin(["sdwis", "echo", "frs"]) &
-        tokens["possible_mhp"] &
-        tokens["state"].notna() &
-        tokens["mhp_name_tkn"].notna()),
-    right_mask = (
-        tokens["source_system"].isin(["mhp"]) &
-        tokens["state"].notna() &
-        tokens["mhp_name_tkn"].notna()))
-
-print(f"Match on mhp: {len(new_matches)}")
-
-matches = pd.concat([matches, new_matches])
+if not CHANGED_SYSTEMS:
 
-#%% #########################
-# Rule: match MHP's by state + city + address
+    mk_matches = deduplicate_matches(matches)
 
-# Unfortunately, half of the "MHP" system has no names, so we try this rule.
-# 228 matches
+    # Save the matches back to the database
+    helpers.copy_to_table(conn, "match_contributors", matches, truncate=True)
+    helpers.copy_to_table(conn, "matches", mk_matches, truncate=True)
 
-new_matches = run_match(
-    "mhp state+address",
-    ["state", "city", "address_line_1"],
-    left_mask = (
-        tokens["source_system"].isin(["sdwis", "echo", "frs"]) &
-        tokens["possible_mhp"] &
-        tokens["state"].notna() &
-        tokens["mhp_name_tkn"].notna()),
-    right_mask = (
-        tokens["source_system"].isin(["mhp"]) &
-        tokens["state"].notna() &
-        tokens["mhp_name_tkn"].notna()))
+else:
 
-print(f"Match on mhp address: {len(new_matches)}")
+    # Every pair produced by a re-run rule involves a contributor from a changed
+    # system, so retracting the old pairs is simply: delete the re-run rules' rows.
+    # Then upsert the deduplicated matches for every candidate that was touched.
+    rerun_rules = [r.name for r in attribute_rules + spatial_rules]
 
-matches = pd.concat([matches, new_matches])
+    with conn.begin() as tx:
+        stale = pd.read_sql(
+            sa.text("""
+                    DELETE FROM match_contributors
+                    WHERE match_rule IN :rules
+                    RETURNING contributor_sk_y;""")
+                .bindparams(sa.bindparam("rules", expanding=True)),
+            tx, params={"rules": rerun_rules})
 
-#%% ################################
-# Deduplicate matches to PWSID <-> contributor_id pairs.
-####################################
+        helpers.copy_to_table(tx, "match_contributors", matches)
 
-# The left side contains known PWS's and can be deduplicated by crosswalking to the master_key (pwsid)
-# The right side contains unknown (candidate) matches and could stay as an contributor_id
+        affected = (pd
+            .concat([stale["contributor_sk_y"], matches["contributor_sk_y"]])
+            .drop_duplicates()
+            .to_frame("candidate_contributor_sk"))
 
-mk_matches = (matches
-    .rename(columns={"contributor_id_y": "candidate_contributor_id"}) #type:ignore
-    [["master_key", "candidate_contributor_id", "match_rule"]])
+        affected.to_sql("match_delta_candidates", tx, index=False, if_exists="replace")
 
-# Deduplicate
-mk_matches = (mk_matches
-    .groupby(["master_key", "candidate_contributor_id"])["match_rule"]
-    .apply(lambda x: list(pd.Series.unique(x)))
-    .reset_index())
+        # Re-aggregate the touched candidates from all of their (old and new) pairs
+        mk_matches = deduplicate_matches(pd.read_sql("""
+                SELECT mc.*
+                FROM match_contributors mc
+                JOIN match_delta_candidates d ON d.candidate_contributor_sk = mc.contributor_sk_y;""",
+            tx))
 
+        tx.execute("""
+            DELETE FROM matches m
+            USING match_delta_candidates d
+            WHERE m.candidate_contributor_sk = d.candidate_contributor_sk;""")
 
-#%%
+        helpers.copy_to_table(tx, "matches", mk_matches)
 
-# Save the matches back to the database
-conn.execute("DROP TABLE IF EXISTS match_contributors;")
-matches.to_sql("match_contributors", conn, index=False)
+        tx.execute("DROP TABLE match_delta_candidates;")
 
-# Save the matches back to the database
-conn.execute("DROP TABLE IF EXISTS matches;")
-mk_matches.to_sql("matches", conn, index=False)
\ No newline at end of file
+    print(
+        f"Retracted {len(stale)} stale pairs, added {len(matches)} pairs, " +
+        f"and refreshed matches for {len(affected)} candidates.")
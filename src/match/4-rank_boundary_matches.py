@@ -1,12 +1,16 @@
 #%%
 
 import os
-import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from dotenv import load_dotenv
 
+import match.helpers as helpers
+from match.assignment import assign_best_matches
 from match.match_scorer import MatchScorer
+from match.ranking import (
+    CANDIDATE_MATCHES_SQL, DEFAULT_RANKING, add_name_features, rank_match_rules, rank_matches)
+from match.schema import apply_schema
 
 load_dotenv()
 
@@ -18,19 +22,7 @@ PROJ = os.environ["WSB_EPSG_AW"]
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
 #%%
-matches = pd.read_sql("""
-    SELECT
-        m.master_key,
-        m.candidate_contributor_id,
-        m.match_rule,
-        s.name                      AS sdwis_name,
-        s.population_served_count   AS sdwis_pop,
-        c.name                      AS tiger_name,
-        c.population_served_count   AS tiger_pop
-    FROM matches m
-    JOIN pws_contributors c ON m.candidate_contributor_id = c.contributor_id AND c.source_system = 'tiger'
-    JOIN pws_contributors s ON s.master_key = m.master_key AND s.source_system = 'sdwis';
-    """, conn)
+matches = apply_schema(pd.read_sql(CANDIDATE_MATCHES_SQL, conn))
 
 print("Read matches from database.")
 
@@ -66,23 +58,9 @@ scorer = MatchScorer()
 scored_matches = scorer.score_tiger_matches(matches)
 
 #%%
-"""
-Use the "scored" data to determine which rules (and combos of rules)
-are most effective.
-"""
-
-# Assign a "rank" to each match rule and combo of match rules
-match_rule_ranks = (matches
-    .join(scored_matches, on=["master_key", "candidate_contributor_id"])
-    .groupby(["match_rule"])
-    .agg(
-        points = ("score", "sum"),
-        total = ("score", "size")
-    )) #type:ignore
-
-match_rule_ranks["score"] = match_rule_ranks["points"] / match_rule_ranks["total"]
-match_rule_ranks = match_rule_ranks.sort_values("score", ascending=False)
-match_rule_ranks["match_rule_rank"] = np.arange(len(match_rule_ranks))
+# Use the "scored" data to determine which rules (and combos of rules)
+# are most effective.
+match_rule_ranks = rank_match_rules(matches, scored_matches["score"])
 
 print("Identified best match rules based on labeled data.")
 
@@ -94,12 +72,9 @@ print("Identified best match rules based on labeled data.")
 matches_ranked = matches.join(
     match_rule_ranks[["match_rule_rank"]], on="match_rule", how="left")
 
-# Flag any that have name matches
-matches_ranked["name_match"] = matches.apply(lambda x: x["tiger_name"] in x["sdwis_name"], axis=1)
-
-# Flag the best population within each TIGER match set
-# (Note this should be done AFTER removing the best PWS->TIGER, if we're doing that)
-matches_ranked["pop_diff"] = abs(matches["tiger_pop"] - matches["sdwis_pop"])
+# Name match flags and similarity, and the population difference
+# (Note pop_diff should be compared AFTER removing the best PWS->TIGER, if we're doing that)
+matches_ranked = add_name_features(matches_ranked)
 
 # To get PWS<->TIGER to be 1:1, we'll rank on different metrics
 # and then select the top one. We need to do this twice:
@@ -110,35 +85,15 @@ matches_ranked["pop_diff"] = abs(matches["tiger_pop"] - matches["sdwis_pop"])
 # name_match, match_rule_rank, pop_diff
 # and selecting within the candidate_contributor groups first,
 # master_key groups second.
+# (See match/ranking_sweep.py to evaluate alternatives)
 
-# Assign numeric ranks to every match
-matches_ranked = (matches_ranked
-    .sort_values(
-        ["name_match", "match_rule_rank", "pop_diff"],
-        ascending=[False, True, True])
-    # Re-number and bring that index into the df
-    # This gives us a simple column to rank on
-    .reset_index(drop=True)
-    .reset_index(drop=False)
-    .rename(columns={"index": "overall_rank"}))
-
-# I guess this is technically unnecessary, cause it's equivalent to sorting on overall_rank...
-# but maybe it make things a little clearer?
-matches_ranked["master_group_ranking"] = \
-    (matches_ranked
-        .groupby("master_key")
-        ["overall_rank"]
-        .rank("dense")
-        .astype("int"))
+matches_ranked = rank_matches(matches_ranked, DEFAULT_RANKING)
 
 #%%
-# Identify the 1-1 matches using the overall_rank
-best_matches = (matches_ranked
-    .sort_values(["overall_rank"])
-    .drop_duplicates(subset="candidate_contributor_id", keep="first")
-    .drop_duplicates(subset="master_key", keep="first")).index
-
-matches_ranked["best_match"] = matches_ranked.index.isin(best_matches)
+# Identify the 1-1 matches using the overall_rank. Rather than greedily taking
+# the top candidate, solve a min-cost assignment within each connected group of
+# PWS's and TIGER's, so one greedy pick doesn't rule out a better overall pairing.
+matches_ranked["best_match"] = assign_best_matches(matches_ranked)
 
 #%%
 
@@ -156,4 +111,4 @@ score = scored_best_matches["score"].sum() * 100 / len(scored_best_matches)
 print(f"Boundary match score: {score:.2f}")
 
 #%%
-matches_ranked.to_sql("matches_ranked", conn, if_exists="replace", index=False)
+helpers.copy_to_table(conn, "matches_ranked", matches_ranked, truncate=True)
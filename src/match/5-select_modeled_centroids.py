@@ -2,12 +2,18 @@
 This script takes centroids from ECHO, FRS, UCMR, and MHP
 and tries to select the best one to feed into the model
 for each PWSID.
+
+The selection runs in the database, into the best_centroids table declared in
+init_model.sql. It is a table rather than a materialized view, because a
+materialized view can only be refreshed whole, while an incremental run
+(WSB_MATCH_CHANGED_SYSTEMS) replaces only the rows of the affected PWS's.
 """
 
 #%%
 
 import os
-import numpy as np
+from typing import List, Optional
+
 import pandas as pd
 import geopandas as gpd
 import sqlalchemy as sa
@@ -15,6 +21,7 @@ from shapely.geometry import Polygon
 from dotenv import load_dotenv
 
 import match.helpers as helpers
+from match.schema import apply_schema
 
 load_dotenv()
 
@@ -26,60 +33,11 @@ PROJ = os.environ["WSB_EPSG_AW"]
 conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
 
 
-#%%
-# Load up the data sources
-
-print("Pulling in data from database...", end="")
-
-sdwis = gpd.GeoDataFrame.from_postgis("""
-    SELECT *
-    FROM pws_contributors
-    WHERE source_system = 'sdwis';""",
-    conn, geom_col="geometry")
-
-stack = pd.read_sql("""
-
-    -- ECHO, FRS, and UCMR area all already-labeled with PWS
-    SELECT
-        c.contributor_id, c.source_system, c.master_key,
-        c.centroid_lat, c.centroid_lon, c.centroid_quality,
-        1 as master_group_ranking
-    FROM pws_contributors c
-    WHERE source_system IN ('echo', 'frs', 'ucmr')
-    
-    UNION ALL
-
-    -- Since we don't know PWSID's for MHP and TIGER, we need
-    -- to join to matches to sub in their matcheda MK's
-
-    -- Join MHP to matches
-    SELECT
-        c.contributor_id, c.source_system, m.master_key,
-        c.centroid_lat, c.centroid_lon, c.centroid_quality,
-        1 as master_group_ranking
-    FROM pws_contributors c
-    JOIN matches m ON m.candidate_contributor_id = c.contributor_id
-    WHERE source_system = 'mhp'
-
-    UNION ALL
-
-    -- Join Tiger to matches
-    SELECT
-        c.contributor_id, c.source_system, m.master_key,
-        c.centroid_lat, c.centroid_lon, c.centroid_quality,
-        -- This helps us decide the best tiger match
-        m.master_group_ranking
-    FROM pws_contributors c
-    JOIN matches_ranked m ON m.candidate_contributor_id = c.contributor_id
-    WHERE source_system = 'tiger'
-
-    ORDER BY master_key;""",
-    conn)
-
-print("done.")
-
-# Add sourcing notes to the geometries
-stack["centroid_quality"] = stack["source_system"].str.upper() + ": " + stack["centroid_quality"]
+# Incremental mode: set WSB_MATCH_CHANGED_SYSTEMS (the same variable used by
+# 3-matching.py) to the reloaded source systems, and only the PWS's that have
+# (or had) a centroid from those systems are re-selected.
+CHANGED_SYSTEMS = [
+    s.strip() for s in os.environ.get("WSB_MATCH_CHANGED_SYSTEMS", "").split(",") if s.strip()]
 
 
 #%% ###########################
@@ -102,40 +60,149 @@ stack["centroid_quality"] = stack["source_system"].str.upper() + ": " + stack["c
 # Boundary = 5
 # Echo = 6 if state/county centroid 
 
-stack["system_rank"] = stack["source_system"].map({
-    "mhp": 1,
-    "echo": 2,
-    "frs": 3,
-    "ucmr": 4,
-    "tiger": 5
-})
-
-# Change Echo to 6 if state/county centroid
-mask = (
-    (stack["source_system"] == "echo") & 
-    (stack["centroid_quality"].isin(["ECHO: STATE CENTROID", "ECHO: COUNTY CENTROID"])))
-
-stack.loc[mask, "system_rank"] = 6
+CENTROID_CANDIDATES_SQL = """
+    SELECT
+        contributor_id, source_system, master_key,
+        centroid_lat, centroid_lon,
+        -- Add sourcing notes to the geometries
+        upper(source_system) || ': ' || centroid_quality AS centroid_quality,
+        CASE
+            WHEN source_system = 'mhp' THEN 1
+            WHEN source_system = 'echo' AND centroid_quality IN ('STATE CENTROID', 'COUNTY CENTROID') THEN 6
+            WHEN source_system = 'echo' THEN 2
+            WHEN source_system = 'frs' THEN 3
+            WHEN source_system = 'ucmr' THEN 4
+            WHEN source_system = 'tiger' THEN 5
+        END AS system_rank,
+        master_group_ranking
+    FROM (
+
+        -- ECHO, FRS, and UCMR area all already-labeled with PWS
+        SELECT
+            c.contributor_id, c.source_system, c.master_key,
+            c.centroid_lat, c.centroid_lon, c.centroid_quality,
+            1 as master_group_ranking
+        FROM pws_contributors c
+        WHERE source_system IN ('echo', 'frs', 'ucmr')
+
+        UNION ALL
+
+        -- Since we don't know PWSID's for MHP and TIGER, we need
+        -- to join to matches to sub in their matcheda MK's
+
+        -- Join MHP to matches
+        SELECT
+            c.contributor_id, c.source_system, k.master_key,
+            c.centroid_lat, c.centroid_lon, c.centroid_quality,
+            1 as master_group_ranking
+        FROM pws_contributors c
+        JOIN matches m ON m.candidate_contributor_sk = c.contributor_sk
+        JOIN master_keys k ON k.master_sk = m.master_sk
+        WHERE source_system = 'mhp'
+
+        UNION ALL
+
+        -- Join Tiger to matches
+        SELECT
+            c.contributor_id, c.source_system, m.master_key,
+            c.centroid_lat, c.centroid_lon, c.centroid_quality,
+            -- This helps us decide the best tiger match
+            m.master_group_ranking
+        FROM pws_contributors c
+        JOIN matches_ranked m ON m.candidate_contributor_sk = c.contributor_sk
+        WHERE source_system = 'tiger'
+    ) stack
+"""
 
-#%%
 # In case there are multiple matches from the same system,
 # we need tiebreakers.
 # Go by:
 # 1) System Ranking
 # 2) match_rank
-# 3) contributor_id (tiebreaker - to ensure consistency)
-
-# Note that only MHP and Tiger could potentially have multiple matches
-
-# Keep only the first entry in each subset
-best_centroid = (stack
-    .sort_values([
-        "master_key",
-        "system_rank",
-        "master_group_ranking",
-        "contributor_id"])
-    .drop_duplicates(subset="master_key", keep="first")
-    .set_index("master_key"))
+# 3) contributor_id (tiebreaker - to ensure consistency). Compared
+#    byte-wise (COLLATE "C"), so the choice doesn't depend on the
+#    database's collation.
+
+# Note that only MHP and Tiger could potentially have multiple matches.
+# DISTINCT ON keeps only the first row for each master_key, so only the
+# winning centroid ever leaves the database.
+SELECT_BEST_CENTROIDS_SQL = f"""
+    SELECT DISTINCT ON (master_key)
+        master_key, contributor_id, source_system,
+        centroid_lat, centroid_lon, centroid_quality,
+        system_rank, master_group_ranking
+    FROM ({CENTROID_CANDIDATES_SQL}) candidates
+    {{where}}
+    ORDER BY master_key, system_rank, master_group_ranking, contributor_id COLLATE "C"
+"""
+
+
+def refresh_best_centroids(conn, source_systems: Optional[List[str]] = None):
+
+    """
+    Rebuild the best_centroids table. If source_systems is given, only the
+    PWS's with a candidate centroid from those systems, or whose current best
+    centroid came from them, are re-selected.
+    """
+
+    with conn.begin() as tx:
+        if source_systems is None:
+            tx.execute("TRUNCATE best_centroids;")
+            tx.execute(
+                "INSERT INTO best_centroids " +
+                SELECT_BEST_CENTROIDS_SQL.format(where="") + ";")
+            tx.execute("ANALYZE best_centroids;")
+            return
+
+        tx.execute(
+            sa.text(f"""
+                CREATE TEMP TABLE best_centroid_refresh ON COMMIT DROP AS
+                SELECT master_key
+                FROM ({CENTROID_CANDIDATES_SQL}) candidates
+                WHERE source_system IN :systems
+                UNION
+                SELECT master_key
+                FROM best_centroids
+                WHERE source_system IN :systems;""")
+            .bindparams(sa.bindparam("systems", expanding=True)),
+            {"systems": list(source_systems)})
+
+        tx.execute("""
+            DELETE FROM best_centroids b
+            USING best_centroid_refresh r
+            WHERE b.master_key = r.master_key;""")
+
+        tx.execute(
+            "INSERT INTO best_centroids " +
+            SELECT_BEST_CENTROIDS_SQL.format(
+                where="WHERE master_key IN (SELECT master_key FROM best_centroid_refresh)") + ";")
+
+        tx.execute("ANALYZE best_centroids;")
+
+
+#%%
+
+print("Selecting best centroids in the database...", end="")
+refresh_best_centroids(conn, CHANGED_SYSTEMS or None)
+print("done.")
+
+#%%
+# Load up the data sources
+
+print("Pulling in data from database...", end="")
+
+sdwis = apply_schema(gpd.GeoDataFrame.from_postgis("""
+    SELECT *
+    FROM pws_contributors
+    WHERE source_system = 'sdwis';""",
+    conn, geom_col="geometry"))
+
+best_centroid = pd.read_sql("""
+    SELECT master_key, centroid_lat, centroid_lon, centroid_quality
+    FROM best_centroids;""",
+    conn, index_col="master_key")
+
+print("done.")
 
 
 #%% ##########################
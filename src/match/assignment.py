@@ -0,0 +1,143 @@
+"""
+Optimal 1:1 assignment of PWS's to candidate boundaries.
+
+The PWS <-> TIGER candidate graph splits into many small connected components
+(most are a single PWS and a single TIGER). Each component is solved on its own
+with a min-cost bipartite assignment over the ranking, so runtime stays linear
+in the number of candidates. Components are solved in parallel, and any huge
+component falls back to the greedy selection.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.csgraph import connected_components
+
+import match.helpers as helpers
+from match.ranking import select_best_matches
+
+# Components with more nodes than this use the greedy selection instead
+MAX_COMPONENT_SIZE = 2000
+
+# Small components are grouped into batches of roughly this many candidate pairs per task
+BATCH_SIZE = 5000
+
+Problem = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def assign_best_matches(
+        matches_ranked: pd.DataFrame,
+        cost_column: str = "overall_rank",
+        max_component_size: int = MAX_COMPONENT_SIZE,
+        workers: Optional[int] = None
+    ) -> np.ndarray:
+
+    """
+    Select the 1:1 matches that minimize the total ranking cost within each
+    connected component. Returns a boolean mask over the rows of matches_ranked.
+    Set workers=1 to solve in-process.
+    """
+
+    master_codes, masters = pd.factorize(matches_ranked["master_sk"])
+    candidate_codes, candidates = pd.factorize(matches_ranked["candidate_contributor_sk"])
+    costs = matches_ranked[cost_column].to_numpy()
+
+    n_masters = len(masters)
+    n_nodes = n_masters + len(candidates)
+    n_edges = len(matches_ranked)
+
+    # Bipartite graph: masters are nodes [0, n_masters), candidates come after
+    graph = sparse.coo_matrix(
+        (np.ones(n_edges), (master_codes, n_masters + candidate_codes)),
+        shape=(n_nodes, n_nodes))
+
+    n_components, labels = connected_components(graph, directed=False)
+
+    edge_components = labels[master_codes]
+    node_counts = np.bincount(labels, minlength=n_components)
+    edge_counts = np.bincount(edge_components, minlength=n_components)
+
+    selected = np.zeros(n_edges, dtype=bool)
+
+    # Components with a single candidate pair are trivially matched
+    selected[edge_counts[edge_components] == 1] = True
+
+    order = np.argsort(edge_components, kind="stable")
+    groups = np.split(order, np.cumsum(edge_counts)[:-1])
+
+    batches: List[List[Problem]] = [[]]
+    batch_edges = 0
+    huge = []
+
+    for component, edges in enumerate(groups):
+        if len(edges) <= 1:
+            continue
+
+        if node_counts[component] > max_component_size:
+            huge.append(edges)
+            continue
+
+        batches[-1].append((edges, master_codes[edges], candidate_codes[edges], costs[edges]))
+        batch_edges += len(edges)
+
+        if batch_edges >= BATCH_SIZE:
+            batches.append([])
+            batch_edges = 0
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        results = [_solve_batch(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_solve_batch, batches))
+
+    for result in results:
+        selected[result] = True
+
+    for edges in huge:
+        subset = matches_ranked.iloc[edges]
+        selected[edges[select_best_matches(subset)]] = True
+
+    print(
+        f"Assigned 1:1 matches over {n_components} components " +
+        f"({sum(len(b) for b in batches)} solved optimally, {len(huge)} greedy).")
+
+    return selected
+
+
+def _solve_batch(batch: List[Problem]) -> np.ndarray:
+    if not batch:
+        return np.array([], dtype=np.int64)
+
+    return np.concatenate([_solve(*problem) for problem in batch])
+
+
+def _solve(edges: np.ndarray, rows: np.ndarray, cols: np.ndarray, costs: np.ndarray) -> np.ndarray:
+
+    """
+    Min-cost bipartite assignment for one component. The cost of each pair is
+    its rank within the component. Pairs that aren't candidates get a cost larger
+    than any sum of real pairs, so the solver first maximizes the number of
+    matches and then minimizes the total rank.
+    """
+
+    _, rows = np.unique(rows, return_inverse=True)
+    _, cols = np.unique(cols, return_inverse=True)
+
+    n = len(edges)
+    rank = np.argsort(np.argsort(costs, kind="stable"), kind="stable")
+    not_a_candidate = float(n) * n + 1
+
+    matrix = np.full((rows.max() + 1, cols.max() + 1), not_a_candidate)
+    matrix[rows, cols] = rank
+
+    edge_at = np.full(matrix.shape, -1)
+    edge_at[rows, cols] = np.arange(n)
+
+    row_ind, col_ind = linear_sum_assignment(matrix)
+    assigned = matrix[row_ind, col_ind] < not_a_candidate
+
+    return edges[edge_at[row_ind[assigned], col_ind[assigned]]]
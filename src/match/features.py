@@ -0,0 +1,261 @@
+"""
+The contributor feature table: tokenized names, MHP flags, normalized address
+and projected geometry, computed once per contributor and cached as Parquet
+in the staging folder (keyed by contributor_id). Matching, ranking, scoring
+and the match reports all read from it.
+
+Each refresh hashes the relevant pws_contributors columns in the database and
+only recomputes the contributors whose inputs changed.
+"""
+
+import os
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import geopandas as gpd
+import sqlalchemy as sa
+from dotenv import load_dotenv
+
+from match.schema import apply_schema
+
+load_dotenv()
+
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+EPSG = os.environ["WSB_EPSG"]
+PROJ = os.environ["WSB_EPSG_AW"]
+
+FEATURES_PATH = os.path.join(STAGING_PATH, "contributor_features.parquet")
+
+# Words that usually (likely) or often (possible) indicate a mobile home park
+MHP_WORDS = {
+    **{w: "likely" for w in ["MOBILE", "TRAILER", "MHP", "TP", "CAMPGROUND", "RV"]},
+    **{w: "possible" for w in ["VILLAGE", "MANOR", "ACRES", "ESTATES"]}
+}
+
+ADDRESS_ABBREVIATIONS = {
+    "STREET": "ST", "AVENUE": "AVE", "ROAD": "RD", "DRIVE": "DR", "LANE": "LN",
+    "BOULEVARD": "BLVD", "HIGHWAY": "HWY", "COURT": "CT", "CIRCLE": "CIR",
+    "PLACE": "PL", "PARKWAY": "PKWY", "TRAIL": "TRL", "ROUTE": "RT",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W"
+}
+
+# Hash of every input the features depend on. Any change to these columns
+# (or the geometry) causes the contributor's features to be recomputed.
+INPUT_HASH_SQL = """
+    md5(concat_ws('|',
+        source_system, master_key, coalesce(pwsid, ''), coalesce(name, ''),
+        coalesce(address_line_1, ''), coalesce(city, ''), coalesce(state, ''),
+        coalesce(md5(ST_AsEWKB(geometry)), '')))
+"""
+
+
+# We'll use this for name matching
+def tokenize_ws_name(series) -> pd.Series:
+    replace = (
+        r"(CITY|TOWN|VILLAGE)( OF)?|WSD|HOA|WATERING POINT|LLC|PWD|PWS|SUBDIVISION" +
+        r"|MUNICIPAL UTILITIES|WATERWORKS|MUTUAL|WSC|PSD|MUD" +
+        r"|(PUBLIC |RURAL )?WATER( DISTRICT| COMPANY| SYSTEM| WORKS| DEPARTMENT| DEPT| UTILITY)?"
+    )
+
+    return (series
+        .str.upper() # Standardize to upper-case
+        .str.replace(fr"\b({replace})\b", "", regex=True)   # Remove water and utility words
+        .str.replace(r"[^\w ]", " ", regex=True)            # Replace non-word characters
+        .str.replace(r"\s\s+", " ", regex=True)             # Normalize spaces
+        .str.strip()                                        # Remove leading and trailing spaces
+        .replace({"": pd.NA}))                              # If left with nothing, null it out
+
+
+def tokenize_mhp_name(series) -> pd.Series:
+
+    # NOTE: It might be better to do standardizations instead of replacing with empty
+    replace = (
+        r"MOBILE (HOME|TRAILER)( PARK| PK)?|MOBILE (ESTATE(S?)|VILLAGE|MANOR|COURT|VILLA|HAVEN|RANCH|LODGE|RESORT)|" +
+        r"MOBILE(HOME|LODGE)|MOBILE( PARK| PK| COM(MUNITY)?)|MHP"
+    )
+
+    return (series
+        .str.upper() # Standardize to upper-case
+        .str.replace(fr"\b({replace})\b", "", regex=True)   # Remove MHP words
+        .str.replace(r"[^\w ]", " ", regex=True)            # Replace non-word characters
+        .str.replace(r"\s\s+", " ", regex=True)             # Normalize spaces
+        .str.strip()
+        .replace({"": pd.NA}))                              # If left with nothing, null it out
+
+
+def normalize_address(series) -> pd.Series:
+    abbreviations = "|".join(ADDRESS_ABBREVIATIONS)
+
+    return (series
+        .str.upper()
+        .str.replace(r"[^\w ]", " ", regex=True)
+        .str.replace(r"\s\s+", " ", regex=True)
+        .str.strip()
+        .str.replace(fr"\b({abbreviations})\b", lambda m: ADDRESS_ABBREVIATIONS[m.group(0)], regex=True)
+        .replace({"": pd.NA}))
+
+
+def flag_mhp_names(names: pd.Series) -> pd.DataFrame:
+
+    """
+    Flag names containing likely and possible MHP words, using a single regex pass.
+    """
+
+    words = "|".join(MHP_WORDS)
+
+    hits = (names
+        .fillna("")
+        .str.extractall(fr"\b({words})\b")[0]
+        .map(MHP_WORDS)
+        .droplevel("match"))
+
+    return pd.DataFrame({
+        "name_likely_mhp": (hits == "likely").groupby(level=0).any(),
+        "name_possible_mhp": hits.notna().groupby(level=0).any()
+    }).reindex(names.index, fill_value=False)
+
+
+def compute_row_features(rows: gpd.GeoDataFrame) -> pd.DataFrame:
+
+    """
+    Features that depend only on the contributor's own row.
+    """
+
+    features = rows[["contributor_id", "source_system", "master_key", "pwsid", "input_hash"]].copy()
+
+    features["name_tkn"] = tokenize_ws_name(rows["name"])
+    features["mhp_name_tkn"] = tokenize_mhp_name(rows["name"])
+    features["address_norm"] = normalize_address(rows["address_line_1"])
+    features = features.join(flag_mhp_names(rows["name"]))
+
+    features["geometry_proj"] = rows["geometry"].to_crs(PROJ).to_wkb()
+
+    return features
+
+
+def add_group_features(features: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    MHP flags that depend on the other contributors sharing the same PWSID.
+    If ANY of the anchor systems with the same PWSID has a name that indicates
+    a likely MHP, then the whole set is marked as likely MHP.
+    """
+
+    is_mhp = features["source_system"] == "mhp"
+    is_anchor = features["source_system"].isin(["echo", "sdwis", "frs"])
+
+    likely_pwsids = features.loc[is_anchor & features["name_likely_mhp"], "pwsid"]
+    possible_pwsids = features.loc[is_anchor & features["name_possible_mhp"], "pwsid"]
+
+    features["likely_mhp"] = is_mhp | features["pwsid"].isin(likely_pwsids)
+    features["possible_mhp"] = (
+        is_mhp |
+        features["likely_mhp"] |
+        features["pwsid"].isin(possible_pwsids))
+
+    return features
+
+
+def refresh_features(conn, source_systems: Optional[List[str]] = None) -> pd.DataFrame:
+
+    """
+    Bring the cached feature table up to date with pws_contributors and return it.
+    If source_systems is given, only those systems are checked for changes.
+    """
+
+    cached = load_features() if os.path.exists(FEATURES_PATH) else None
+
+    system_filter = "" if source_systems is None else "WHERE source_system IN :systems"
+    params = {} if source_systems is None else {"systems": list(source_systems)}
+
+    query = sa.text(f"""
+        SELECT contributor_id, {INPUT_HASH_SQL} AS input_hash
+        FROM pws_contributors
+        {system_filter};""")
+
+    if source_systems is not None:
+        query = query.bindparams(sa.bindparam("systems", expanding=True))
+
+    hashes = pd.read_sql(query, conn, params=params)
+
+    changed, removed = diff_features(cached, hashes, source_systems)
+
+    if len(changed) == 0 and len(removed) == 0:
+        print("Feature table is up to date.")
+        return cached
+
+    parts = [cached.loc[~cached["contributor_id"].isin(pd.concat([changed, removed]))]] if cached is not None else []
+
+    # A refresh can have only removals
+    if len(changed) > 0:
+        print(f"Computing features for {len(changed)} changed contributors...", end="")
+
+        rows = gpd.GeoDataFrame.from_postgis(sa.text(f"""
+                SELECT
+                    c.contributor_id, c.source_system, c.master_key, c.pwsid,
+                    c.name, c.address_line_1, c.geometry,
+                    {INPUT_HASH_SQL} AS input_hash
+                FROM pws_contributors c
+                WHERE c.contributor_id = ANY(CAST(:ids AS TEXT[]));"""),
+            conn, geom_col="geometry", params={"ids": changed.tolist()})
+
+        parts.append(compute_row_features(rows))
+
+        print("done.")
+
+    features = pd.concat(parts, ignore_index=True)
+
+    features = add_group_features(apply_schema(features))
+
+    features.to_parquet(FEATURES_PATH, index=False)
+    print(f"Saved feature table ({len(features)} contributors, {len(removed)} removed).")
+
+    return features
+
+
+def diff_features(
+        cached: Optional[pd.DataFrame],
+        hashes: pd.DataFrame,
+        source_systems: Optional[List[str]] = None
+    ) -> Tuple[pd.Series, pd.Series]:
+
+    """
+    Compare the current input hashes (contributor_id, input_hash) to the cached
+    features. Returns the contributor_id's that are new or changed, and those
+    that are cached but no longer exist. If source_systems is given, the hashes
+    only cover those systems, so only their cached rows can be removed.
+    """
+
+    if cached is None:
+        in_scope = pd.DataFrame(columns=["contributor_id", "input_hash"])
+    elif source_systems is None:
+        in_scope = cached
+    else:
+        in_scope = cached[cached["source_system"].isin(source_systems)]
+
+    compare = hashes.merge(
+        in_scope[["contributor_id", "input_hash"]],
+        on="contributor_id", how="left", suffixes=("", "_cached"))
+
+    changed = compare.loc[compare["input_hash"] != compare["input_hash_cached"], "contributor_id"]
+    removed = in_scope.loc[~in_scope["contributor_id"].isin(hashes["contributor_id"]), "contributor_id"]
+
+    return changed, removed
+
+
+def load_features(
+        columns: Optional[List[str]] = None,
+        source_systems: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+
+    """
+    Read the cached feature table, optionally only some columns and systems.
+    """
+
+    filters = None if source_systems is None else [("source_system", "in", list(source_systems))]
+
+    return pd.read_parquet(FEATURES_PATH, columns=columns, filters=filters)
+
+
+def projected_geometry(features: pd.DataFrame) -> gpd.GeoSeries:
+    return gpd.GeoSeries.from_wkb(features["geometry_proj"], index=features.index, crs=PROJ)
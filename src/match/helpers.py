@@ -1,29 +1,217 @@
+import csv
+import io
 import os
-from typing import Optional
+import time
+import multiprocessing
+from typing import Optional, Sequence
 
 import sqlalchemy as sa
+import numpy as np
 import pandas as pd
+import geopandas as gpd
+import shapely
 from dotenv import load_dotenv
 
+import sql_profiling
+
 load_dotenv()
 
 DATA_PATH = os.environ["WSB_STAGING_PATH"]
 
+# The deduplicated matches, with the string IDs looked up from their surrogate keys
+MATCHES_SQL = """
+    SELECT
+        m.master_sk,
+        m.candidate_contributor_sk,
+        mk.master_key,
+        ck.contributor_id AS candidate_contributor_id,
+        m.match_rule,
+        m.match_rule_label
+    FROM matches m
+    JOIN master_keys mk ON mk.master_sk = m.master_sk
+    JOIN contributor_keys ck ON ck.contributor_sk = m.candidate_contributor_sk;
+"""
+
+
+def load_to_postgis(source_system: str, df: pd.DataFrame, replace_ids: Optional[Sequence[str]] = None):
 
-def load_to_postgis(source_system: str, df: pd.DataFrame):
+    """
+    Replace the source system's rows in pws_contributors with df. If replace_ids
+    is given, only the rows with those contributor_id's are removed first, so
+    df can be a partial update.
+    """
 
     conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
     TARGET_TABLE = "pws_contributors"
 
     print(f"Removing existing {source_system} data from database...", end="")
-    conn.execute(f"DELETE FROM {TARGET_TABLE} WHERE source_system = '{source_system}';")
+    if replace_ids is None:
+        conn.execute(f"DELETE FROM {TARGET_TABLE} WHERE source_system = '{source_system}';")
+    else:
+        conn.execute(
+            sa.text(f"""
+                DELETE FROM {TARGET_TABLE}
+                WHERE
+                    source_system = :source_system AND
+                    contributor_id = ANY(CAST(:ids AS TEXT[]));"""),
+            {"source_system": source_system, "ids": list(replace_ids)})
     print("done")
 
+    if len(df) == 0:
+        return
+
+    df = assign_surrogate_keys(conn, df)
+
     print(f"Loading {source_system} to database...", end="")
     df.to_postgis(TARGET_TABLE, conn, if_exists="append")
     print("done.")
 
 
+def assign_surrogate_keys(conn, df: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    Add the int64 contributor_sk and master_sk columns, allocating new keys in
+    the contributor_keys and master_keys lookup tables for any unseen ID's.
+    A key never changes once it has been assigned.
+    """
+
+    return df.assign(
+        contributor_sk  = _surrogate_keys(conn, "contributor_keys", "contributor_id", "contributor_sk", df["contributor_id"]),
+        master_sk       = _surrogate_keys(conn, "master_keys", "master_key", "master_sk", df["master_key"]))
+
+
+def _surrogate_keys(conn, table: str, id_column: str, key_column: str, ids: pd.Series) -> pd.Series:
+    unique_ids = ids.dropna().astype(str).unique().tolist()
+
+    with conn.begin() as tx:
+        tx.execute(
+            sa.text(f"""
+                INSERT INTO {table} ({id_column})
+                SELECT unnest(CAST(:ids AS TEXT[]))
+                ON CONFLICT ({id_column}) DO NOTHING;"""),
+            {"ids": unique_ids})
+
+        keys = pd.read_sql(
+            sa.text(f"""
+                SELECT {id_column}, {key_column}
+                FROM {table}
+                WHERE {id_column} = ANY(CAST(:ids AS TEXT[]));"""),
+            tx, params={"ids": unique_ids})
+
+    return ids.map(keys.set_index(id_column)[key_column]).astype("int64")
+
+
+def copy_to_table(conn, table: str, df: pd.DataFrame, truncate: bool = False):
+
+    """
+    Bulk load df into one of the tables declared in init_model.sql using COPY,
+    then ANALYZE it so the planner sees the new row counts. The columns of df
+    must all exist in the table. conn can be an engine, or a connection inside
+    a transaction (the load then commits or rolls back with it).
+    """
+
+    if isinstance(conn, sa.engine.Engine):
+        with conn.begin() as tx:
+            return copy_to_table(tx, table, df, truncate)
+
+    if truncate:
+        conn.execute(f"TRUNCATE {table};")
+
+    # Encode while writing, so the payload is only held once and its size is known
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+    _to_copy_format(df).to_csv(text, index=False, header=False)
+    text.flush()
+    text.detach()
+
+    bytes_sent = buffer.tell()
+    buffer.seek(0)
+
+    statement = f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv);"
+    start_time = time.perf_counter()
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(statement, buffer)
+
+    sql_profiling.record(statement, time.perf_counter() - start_time, rows=len(df), bytes_sent=bytes_sent)
+
+    conn.execute(f"ANALYZE {table};")
+    print(f"Loaded {len(df)} rows into {table}.")
+
+
+def stream_to_file(conn, sql: str, path: str, params: Optional[dict] = None, chunk_size: int = 10000) -> int:
+
+    """
+    Run a query with a server-side cursor and write its rows to a CSV or (for
+    .xlsx paths) a write-only Excel workbook, chunk by chunk, so memory stays
+    flat however many rows there are. Returns the number of rows written.
+    """
+
+    rows_written = 0
+
+    with conn.connect() as connection:
+        result = (connection
+            .execution_options(stream_results=True)
+            .execute(sa.text(sql), params or {}))
+
+        if path.lower().endswith(".xlsx"):
+            from openpyxl import Workbook
+
+            # One row is the header
+            max_rows = 1048576 - 1
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(list(result.keys()))
+
+            for chunk in result.partitions(chunk_size):
+                for row in chunk[:max_rows - rows_written]:
+                    sheet.append(list(row))
+                rows_written += min(len(chunk), max_rows - rows_written)
+
+                if rows_written == max_rows:
+                    print(f"Warning: {path} is truncated at Excel's row limit. Write a CSV for the full report.")
+                    break
+
+            workbook.save(path)
+
+        else:
+            with open(path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(result.keys())
+
+                for chunk in result.partitions(chunk_size):
+                    writer.writerows(chunk)
+                    rows_written += len(chunk)
+
+    print(f"Wrote {rows_written} rows to {path}.")
+
+    return rows_written
+
+
+def _to_copy_format(df: pd.DataFrame) -> pd.DataFrame:
+    out = pd.DataFrame(df).copy()
+
+    for col in df.columns:
+        values = df[col]
+
+        # Geometries as hex EWKB, which PostGIS parses directly
+        if isinstance(values.dtype, gpd.array.GeometryDtype):
+            geoms = values.to_numpy()
+            if values.crs is not None:
+                geoms = shapely.set_srid(geoms, values.crs.to_epsg())
+            out[col] = shapely.to_wkb(geoms, hex=True, include_srid=True)
+
+        # Integers that picked up NULLs were upcast to float. Write them back as
+        # integers, otherwise "12.0" can't be loaded into an INT column.
+        elif values.dtype.kind == "f":
+            present = values.dropna().to_numpy()
+            if len(present) and np.isfinite(present).all() and (present == np.round(present)).all():
+                out[col] = values.astype("Int64")
+
+    return out
+
+
 def get_pwsids_of_interest():
 
     sdwis = pd.read_csv(
@@ -38,3 +226,12 @@ def get_pwsids_of_interest():
             (sdwis["pws_activity_code"].isin(["A"])) &
             (sdwis["pws_type_code"] == "CWS")
         ]["pwsid"]
+
+
+def can_use_process_pool() -> bool:
+    """
+    Pipeline scripts are run by importing them from run_pipeline.py, which has no
+    __main__ guard. Process pools that spawn their workers (rather than fork them)
+    would re-run the pipeline in every worker, so only use them when workers fork.
+    """
+    return multiprocessing.get_start_method() == "fork"
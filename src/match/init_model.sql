@@ -1,10 +1,25 @@
+-- Stable int64 surrogate keys for the string contributor_id's and master_key's.
+-- Internal joins and the derived match tables use these keys; the string IDs
+-- are kept for output. The lookups survive a re-init so the keys never change.
+CREATE TABLE IF NOT EXISTS contributor_keys (
+    contributor_sk      BIGSERIAL PRIMARY KEY,
+    contributor_id      TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS master_keys (
+    master_sk           BIGSERIAL PRIMARY KEY,
+    master_key          TEXT NOT NULL UNIQUE
+);
+
 DROP TABLE IF EXISTS pws_contributors;
 
 CREATE TABLE pws_contributors (
     contributor_id      TEXT NOT NULL PRIMARY KEY,
+    contributor_sk      BIGINT NOT NULL UNIQUE,
     source_system       TEXT NOT NULL,
     source_system_id    TEXT NOT NULL,
     master_key          TEXT NOT NULL,
+    master_sk           BIGINT NOT NULL,
     tier                INT,
     pwsid               TEXT,
     name                TEXT,
@@ -33,4 +48,121 @@ CREATE TABLE pws_contributors (
 
 CREATE INDEX ix__pws_contributors__source_system ON pws_contributors (source_system);
 CREATE INDEX ix__pws_contributors__source_system_id ON pws_contributors (source_system_id);
-CREATE INDEX ix__pws_contributors__master_key ON pws_contributors (master_key);
\ No newline at end of file
+CREATE INDEX ix__pws_contributors__master_key ON pws_contributors (master_key);
+CREATE INDEX ix__pws_contributors__master_sk ON pws_contributors (master_sk);
+
+
+-- The best centroid for each PWS, selected by 5-select_modeled_centroids.py
+DROP TABLE IF EXISTS best_centroids;
+
+CREATE TABLE best_centroids (
+    master_key          TEXT NOT NULL PRIMARY KEY,
+    contributor_id      TEXT NOT NULL,
+    source_system       TEXT NOT NULL,
+    centroid_lat        DECIMAL(10, 8),
+    centroid_lon        DECIMAL(11, 8),
+    centroid_quality    TEXT,
+    system_rank         INT NOT NULL,
+    master_group_ranking INT
+);
+
+CREATE INDEX ix__best_centroids__source_system ON best_centroids (source_system);
+
+
+-- Derived tables. These are bulk loaded by the pipeline (helpers.copy_to_table)
+-- rather than re-created from DataFrames, so they keep their keys and indexes.
+
+-- Contributors with their matching tokens, written by 3-matching.py
+DROP TABLE IF EXISTS tokens;
+
+CREATE TABLE tokens (
+    contributor_id      TEXT NOT NULL PRIMARY KEY,
+    contributor_sk      BIGINT NOT NULL UNIQUE,
+    source_system       TEXT NOT NULL,
+    master_key          TEXT NOT NULL,
+    master_sk           BIGINT NOT NULL,
+    state               CHAR(2),
+    name                TEXT,
+    city_served         TEXT,
+    address_line_1      TEXT,
+    city                TEXT,
+    zip                 CHAR(5),
+    county              TEXT,
+    centroid_quality    TEXT,
+    name_tkn            TEXT,
+    mhp_name_tkn        TEXT,
+    address_norm        TEXT,
+    likely_mhp          BOOLEAN,
+    possible_mhp        BOOLEAN
+);
+
+CREATE INDEX ix__tokens__source_system ON tokens (source_system);
+CREATE INDEX ix__tokens__master_sk ON tokens (master_sk);
+
+-- Every pair produced by every match rule, written by 3-matching.py
+DROP TABLE IF EXISTS match_contributors;
+
+CREATE TABLE match_contributors (
+    master_sk           BIGINT NOT NULL,
+    contributor_sk_x    BIGINT NOT NULL,
+    contributor_sk_y    BIGINT NOT NULL,
+    match_rule          TEXT NOT NULL,
+    PRIMARY KEY (contributor_sk_x, contributor_sk_y, match_rule)
+);
+
+CREATE INDEX ix__match_contributors__contributor_sk_y ON match_contributors (contributor_sk_y);
+CREATE INDEX ix__match_contributors__match_rule ON match_contributors (match_rule);
+
+-- Matches deduplicated to PWS <-> candidate pairs, written by 3-matching.py
+DROP TABLE IF EXISTS matches;
+
+CREATE TABLE matches (
+    master_sk                   BIGINT NOT NULL,
+    candidate_contributor_sk    BIGINT NOT NULL,
+    match_rule                  SMALLINT NOT NULL,
+    match_rule_label            TEXT NOT NULL,
+    PRIMARY KEY (master_sk, candidate_contributor_sk)
+);
+
+CREATE INDEX ix__matches__candidate_contributor_sk ON matches (candidate_contributor_sk);
+
+-- Ranked PWS <-> TIGER matches, written by 4-rank_boundary_matches.py
+DROP TABLE IF EXISTS matches_ranked;
+
+CREATE TABLE matches_ranked (
+    overall_rank                INT NOT NULL,
+    master_sk                   BIGINT NOT NULL,
+    candidate_contributor_sk    BIGINT NOT NULL,
+    master_key                  TEXT NOT NULL,
+    candidate_contributor_id    TEXT NOT NULL,
+    match_rule                  SMALLINT NOT NULL,
+    match_rule_label            TEXT NOT NULL,
+    sdwis_name                  TEXT,
+    sdwis_pop                   INT,
+    tiger_name                  TEXT,
+    tiger_pop                   INT,
+    match_rule_rank             INT,
+    name_match                  BOOLEAN,
+    name_jaccard                DOUBLE PRECISION,
+    name_similarity             DOUBLE PRECISION,
+    pop_diff                    INT,
+    master_group_ranking        INT NOT NULL,
+    best_match                  BOOLEAN NOT NULL,
+    PRIMARY KEY (master_sk, candidate_contributor_sk)
+);
+
+CREATE INDEX ix__matches_ranked__candidate_contributor_sk ON matches_ranked (candidate_contributor_sk);
+
+-- Tier 2 only reads the best matches
+CREATE INDEX ix__matches_ranked__best_match ON matches_ranked (candidate_contributor_sk) WHERE best_match;
+
+-- ECHO/FRS contributors located far outside their state, written by 2-cleansing.py
+DROP TABLE IF EXISTS impostors;
+
+CREATE TABLE impostors (
+    contributor_id      TEXT NOT NULL PRIMARY KEY,
+    source_system       TEXT NOT NULL,
+    state               CHAR(2),
+    primacy_agency_code TEXT,
+    geometry            GEOMETRY(GEOMETRY, 4326)
+);
@@ -6,6 +6,7 @@ import pandas as pd
 import geopandas as gpd
 from dotenv import load_dotenv
 import match.helpers as helpers
+from match.name_search import NameSearchIndex
 
 load_dotenv()
 
@@ -136,4 +137,8 @@ df = gpd.GeoDataFrame().assign(
 df = df.set_crs(epsg=EPSG, allow_override=True)
 
 #%%
-helpers.load_to_postgis("sdwis", df)
\ No newline at end of file
+helpers.load_to_postgis("sdwis", df)
+
+#%%
+# Rebuild the name search index (python -m match.name_search) if SDWIS changed
+NameSearchIndex.load_or_build(df[["pwsid", "state", "name", "city_served"]])
@@ -0,0 +1,137 @@
+"""
+Declarations for the match rules run in 3-matching.py.
+
+Each rule joins systems with known PWS ID's (on the left) to candidate
+systems without PWS ID's (on the right). Rules that share a right-side
+filter and key columns share a single hash index in the rule engine.
+Spatial rules all query the same TIGER boundary index.
+"""
+
+from typing import Iterable, List, Tuple
+
+import pandas as pd
+
+from match.rule_engine import MatchRule, RuleFilter, SpatialRule
+
+ANCHOR_SYSTEMS = ("sdwis", "echo", "frs")
+
+# Each rule owns one bit. The deduplicated matches store the OR of the bits
+# of every rule that produced the pair. These values are persisted in the
+# database, so never renumber them; new rules take the next free bit.
+RULE_BITS = {
+    "state+name_tiger":     1 << 0,
+    "state+name_mhp":       1 << 1,
+    "spatial":              1 << 2,
+    "state+city_served":    1 << 3,
+    "ucmr_spatial":         1 << 4,
+    "state+mhp_name":       1 << 5,
+    "mhp state+address":    1 << 6,
+}
+
+# Candidate sides. These are shared across rules, which lets the engine
+# reuse the same hash index (e.g. TIGER on state + name_tkn)
+TIGER_BY_NAME = RuleFilter(("tiger",), notna=("state", "name_tkn"))
+MHP_BY_NAME = RuleFilter(("mhp",), notna=("state", "name_tkn"))
+MHP_BY_MHP_NAME = RuleFilter(("mhp",), notna=("state", "mhp_name_tkn"))
+
+POSSIBLE_MHP_ANCHORS = RuleFilter(
+    ANCHOR_SYSTEMS,
+    notna=("state", "mhp_name_tkn"),
+    flags_true=("possible_mhp",))
+
+
+ATTRIBUTE_RULES = [
+
+    # Match on state + name to SDWIS/ECHO/FRS -> TIGER
+    # 23,286 matches
+    MatchRule(
+        "state+name_tiger",
+        left=RuleFilter(ANCHOR_SYSTEMS, notna=("state", "name_tkn"), flags_false=("likely_mhp",)),
+        right=TIGER_BY_NAME,
+        left_on=("state", "name_tkn")),
+
+    # Match on state + name to MHP
+    # 1,875 matches
+    MatchRule(
+        "state+name_mhp",
+        left=RuleFilter(ANCHOR_SYSTEMS, notna=("state", "name_tkn")),
+        right=MHP_BY_NAME,
+        left_on=("state", "name_tkn")),
+
+    # Match state+city_served to state+name
+    # 16,265 matches
+    MatchRule(
+        "state+city_served",
+        left=RuleFilter(("sdwis",), notna=("state", "city_served"), flags_false=("likely_mhp",)),
+        right=TIGER_BY_NAME,
+        left_on=("state", "city_served"),
+        right_on=("state", "name_tkn")),
+
+    # Match MHP's by tokenized name
+    # 20897 matches. Not great, but then again, not all MHP's will have water systems.
+
+    # We get a few hundred more matches if we exclude the county, and it *seems* like
+    # MHP names should be relatively unique within the state...but I spot checked
+    # some and wasn't 100% convinced. So I'm being conservative and requiring county.
+    MatchRule(
+        "state+mhp_name",
+        left=POSSIBLE_MHP_ANCHORS,
+        right=MHP_BY_MHP_NAME,
+        left_on=("state", "mhp_name_tkn", "county")),
+
+    # Match MHP's by state + city + address
+    # Unfortunately, half of the "MHP" system has no names, so we try this rule.
+    # 228 matches
+    MatchRule(
+        "mhp state+address",
+        left=POSSIBLE_MHP_ANCHORS,
+        right=MHP_BY_MHP_NAME,
+        left_on=("state", "city", "address_line_1")),
+]
+
+
+SPATIAL_RULES = [
+
+    # ECHO/FRS point inside TIGER geometry, in the same state
+    # 11,941 matches between echo/frs and tiger
+    # (Down from 22,200 before excluding state, county, and zip centroids)
+    SpatialRule(
+        "spatial",
+        left=RuleFilter(("echo", "frs"), flags_false=("likely_mhp",)),
+        same_state=True,
+        excluded_centroid_quality=("STATE CENTROID", "COUNTY CENTROID", "ZIP CODE CENTROID")),
+
+    # UCMR to TIGER Spatial matches
+    # 2,999 matches
+    SpatialRule(
+        "ucmr_spatial",
+        left=RuleFilter(("ucmr",))),
+]
+
+
+def rules_involving(source_systems: Iterable[str]) -> Tuple[List[MatchRule], List[SpatialRule]]:
+
+    """
+    Select only the rules that read from any of the given source systems.
+    When a single system is reloaded, these are the only rules whose results can change.
+    """
+
+    source_systems = set(source_systems)
+
+    return (
+        [r for r in ATTRIBUTE_RULES if source_systems & set(r.source_systems)],
+        [r for r in SPATIAL_RULES if source_systems & set(r.source_systems)])
+
+
+def rule_labels(rule_masks: pd.Series) -> pd.Series:
+
+    """
+    Generate a readable label (e.g. "state+name_tiger,spatial") for each rule bitmask.
+    There are only a handful of distinct combinations, so labels are built once per combination.
+    """
+
+    labels = {
+        mask: ",".join(name for name, bit in RULE_BITS.items() if mask & bit)
+        for mask in pd.unique(rule_masks)}
+
+    return rule_masks.map(labels)
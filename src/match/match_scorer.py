@@ -1,31 +1,49 @@
 #%%
 
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import sqlalchemy as sa
+import shapely
 from dotenv import load_dotenv
 
+from match.features import load_features, projected_geometry
+
 load_dotenv()
 
 STAGING_PATH = os.environ["WSB_STAGING_PATH"]
 EPSG = os.environ["WSB_EPSG"]
 PROJ = os.environ["WSB_EPSG_AW"]
 
-# Connect to local PostGIS instance
-conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
+PAIR_INDEX = ["pwsid", "candidate_contributor_id"]
 
 class MatchScorer:
 
     def __init__(self):
-        self.boundary_df = (self.get_data("tiger", ["contributor_id", "geometry"])
-            .set_index("contributor_id"))
 
-        self.labeled_df = self.get_data("labeled", ["pwsid", "master_key", "geometry"])
+        # Geometries come pre-projected from the feature table. Keep them as
+        # prepared geometry arrays so repeated scoring doesn't rebuild anything.
+        boundary_df = self.get_data("tiger", ["contributor_id"])
+        labeled_df = self.get_data("labeled", ["pwsid", "master_key"])
+
+        self.boundary_geometries = pd.Series(
+            boundary_df["geometry"].to_numpy(), index=boundary_df["contributor_id"])
+        self.labeled_geometries = labeled_geometries(labeled_df)
+
+        shapely.prepare(self.boundary_geometries.to_numpy())
+        shapely.prepare(self.labeled_geometries.to_numpy())
+
+        # Memoized results per (pwsid, candidate_contributor_id) pair
+        self._scores: Dict[int, pd.Series] = {}
+        self._distances = pd.Series(dtype="float64", index=_empty_pair_index())
 
-    def score_tiger_matches(self, matches: pd.DataFrame, proximity_buffer: int = 1000) -> pd.DataFrame:
+    def score_tiger_matches(
+            self,
+            matches: pd.DataFrame,
+            proximity_buffer: int = 1000,
+            with_distance: bool = False
+        ) -> pd.DataFrame:
 
         """
         Given a set of matches to boundary data, compare it to known geometries
@@ -33,66 +51,121 @@ class MatchScorer:
         be used to evaluate the effectiveness of our matching.
 
         The match DF should have columns: master_key, candidate_contributor_id
+
+        Returns a DF with one row per unique (pwsid, candidate_contributor_id)
+        pair, indexed by the pair, with a "score" column. The exact "distance"
+        column is only computed if with_distance is set; there is no geometry
+        column. A PWS with several labeled geometries is scored against their
+        union.
         """
 
-        # Extract a series of "known geometries" from the labeled geometry data
-        known_geometries = gpd.GeoSeries(
-            self.labeled_df[["pwsid", "geometry"]]
-            .merge(matches[["master_key", "candidate_contributor_id"]], left_on="pwsid", right_on="master_key")
-            .set_index(["pwsid", "candidate_contributor_id"])
-            ["geometry"])
-
-        # Extract a series of "potential geometries" from the matched boundary data
-        candidate_matches = gpd.GeoDataFrame(matches
-            .join(self.boundary_df["geometry"], on="candidate_contributor_id")
-            .rename(columns={"master_key": "pwsid"})
-            .set_index(["pwsid", "candidate_contributor_id"])
-            [["geometry"]])
-
-        # Filter to only the PWS's that appear in both series
+        # Filter to only the pairs where we have both a labeled and a candidate geometry
         # 7,423 match
-        known_geometries = (known_geometries
-            .loc[known_geometries.index.isin(candidate_matches.index)]
-            .sort_index())
+        pairs = (pd.MultiIndex
+            .from_frame(matches[["master_key", "candidate_contributor_id"]], names=PAIR_INDEX)
+            .unique())
+
+        pairs = pairs[
+            pairs.get_level_values("pwsid").isin(self.labeled_geometries.index) &
+            pairs.get_level_values("candidate_contributor_id").isin(self.boundary_geometries.index)]
 
-        candidate_matches = (candidate_matches
-            .loc[candidate_matches.index.isin(known_geometries.index)]
-            .sort_index())
+        # A few empty labeled geometries can't be scored
+        known, candidate = self._geometries(pairs)
+        valid = ~(
+            shapely.is_missing(known) | shapely.is_empty(known) |
+            shapely.is_missing(candidate) | shapely.is_empty(candidate))
+        pairs = pairs[valid]
 
         print("Retrieved and aligned data.")
 
-        # Switch to a projected CRS
-        known_geometries = known_geometries.to_crs(PROJ)
-        candidate_matches = candidate_matches.to_crs(PROJ)
+        scores = self._scores.get(proximity_buffer, pd.Series(dtype="bool", index=_empty_pair_index()))
+        new_pairs = pairs[~pairs.isin(scores.index)]
 
-        print("Converted to a projected CRS.")
+        if len(new_pairs):
+            scores = pd.concat([scores, pd.Series(
+                dwithin(*self._geometries(new_pairs), proximity_buffer), index=new_pairs)])
+            self._scores[proximity_buffer] = scores
 
-        distances = known_geometries.distance(candidate_matches, align=True)
-        print("Calculated distances.")
+        print(f"Assigned scores ({len(new_pairs)} new, {len(pairs) - len(new_pairs)} cached).")
 
-        # A few empty labeled geometries cause NA distances. Filter only non-NA
-        distances = distances[distances.notna()]
-        distances.name = "distance"
+        # Assign a score - 1 if a good match, 0 if not a good match
+        scored = scores.reindex(pairs).rename("score").to_frame()
 
-        # re-join to the match table
-        candidate_matches = candidate_matches.join(distances, on=["pwsid", "candidate_contributor_id"], how="inner")
+        if with_distance:
+            scored["distance"] = self.distances(pairs)
 
-        # Assign a score - 1 if a good match, 0 if not a good match
-        candidate_matches["score"] = candidate_matches["distance"] <= proximity_buffer
+        return scored
 
-        print("Assigned scores.")
+    def distances(self, pairs: pd.MultiIndex) -> pd.Series:
 
-        return candidate_matches
+        """
+        Exact distances (in projected units) for the given pairs. Only computed on request.
+        """
+
+        new_pairs = pairs[~pairs.isin(self._distances.index)]
+
+        if len(new_pairs):
+            self._distances = pd.concat([self._distances, pd.Series(
+                shapely.distance(*self._geometries(new_pairs)), index=new_pairs)])
 
-    def get_data(self, system: str, columns: List[str] = ["*"]) -> pd.DataFrame:
-        print(f"Pulling {system} data from database...", end="")
+        return self._distances.reindex(pairs).rename("distance")
 
-        df = gpd.GeoDataFrame.from_postgis(f"""
-                SELECT {", ".join(columns)}
-                FROM pws_contributors
-                WHERE source_system = '{system}';""",
-            conn, geom_col="geometry")
+    def _geometries(self, pairs: pd.MultiIndex) -> Tuple[np.ndarray, np.ndarray]:
+        return (
+            self.labeled_geometries.reindex(pairs.get_level_values("pwsid")).to_numpy(),
+            self.boundary_geometries.reindex(pairs.get_level_values("candidate_contributor_id")).to_numpy())
+
+    def get_data(self, system: str, columns: List[str]) -> gpd.GeoDataFrame:
+        print(f"Pulling {system} data from the feature table...", end="")
+
+        df = load_features(columns + ["geometry_proj"], source_systems=[system])
+        df = gpd.GeoDataFrame(
+            df.drop(columns="geometry_proj"),
+            geometry=projected_geometry(df))
 
         print("done.")
 
-        return df
\ No newline at end of file
+        return df
+
+
+def labeled_geometries(labeled_df: gpd.GeoDataFrame) -> pd.Series:
+
+    """
+    One geometry per pwsid: the union of its labeled geometries.
+    """
+
+    dissolved = labeled_df[["pwsid", "geometry"]].dissolve(by="pwsid")
+
+    return pd.Series(dissolved.geometry.to_numpy(), index=dissolved.index)
+
+
+def _empty_pair_index() -> pd.MultiIndex:
+    return pd.MultiIndex.from_arrays([[], []], names=PAIR_INDEX)
+
+
+def dwithin(a: np.ndarray, b: np.ndarray, distance: float) -> np.ndarray:
+
+    """
+    Element-wise test of whether a[k] is within the distance of b[k].
+    Bounding boxes settle most pairs: boxes further apart than the distance
+    can't be within it, and overlapping boxes are first checked with a
+    (prepared) intersects. Only the remaining pairs need an exact distance.
+    """
+
+    bounds_a = shapely.bounds(a)
+    bounds_b = shapely.bounds(b)
+
+    gap_x = np.maximum(0, np.maximum(bounds_a[:, 0] - bounds_b[:, 2], bounds_b[:, 0] - bounds_a[:, 2]))
+    gap_y = np.maximum(0, np.maximum(bounds_a[:, 1] - bounds_b[:, 3], bounds_b[:, 1] - bounds_a[:, 3]))
+
+    result = np.zeros(len(a), dtype=bool)
+
+    candidates = np.flatnonzero(np.hypot(gap_x, gap_y) <= distance)
+
+    overlapping = candidates[(gap_x[candidates] == 0) & (gap_y[candidates] == 0)]
+    result[overlapping] = shapely.intersects(a[overlapping], b[overlapping])
+
+    remaining = candidates[~result[candidates]]
+    result[remaining] = shapely.distance(a[remaining], b[remaining]) <= distance
+
+    return result
@@ -0,0 +1,292 @@
+"""
+Prefix and typo-tolerant search over SDWIS water system names.
+
+Every system contributes a few search terms: its name, its tokenized name
+(tokenize_ws_name, so "CITY OF AUSTIN" is also found as "AUSTIN"), the city
+served, and each word of those. The terms are kept in a sorted array, so a
+prefix search is a binary search. Typo-tolerant search goes through a trigram
+inverted index to a short list of candidates, which are then scored by edit
+distance.
+
+The index is rebuilt by map_sdwis.py whenever SDWIS is reloaded, and persisted
+to the staging folder. Usage:
+
+    python -m match.name_search "spring val" --state TX
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from match.features import tokenize_ws_name
+from match.string_features import prefix_levenshtein
+
+load_dotenv()
+
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+
+INDEX_PATH = os.path.join(STAGING_PATH, "sdwis_name_index.pkl")
+
+# Fuzzy matches need at least this share of the query's trigrams...
+MIN_TRIGRAM_SHARE = 0.4
+
+# ...and only the best this-many candidates by trigram count are scored
+MAX_FUZZY_CANDIDATES = 500
+
+# Term fields, in order of preference when a system matches on several
+FIELDS = ("name", "name_tkn", "city_served", "word")
+
+
+class NameSearchIndex:
+    """
+    A search index over SDWIS systems (pwsid, state, name, city_served).
+    """
+
+    def __init__(self, systems: pd.DataFrame):
+        self.fingerprint = fingerprint(systems)
+
+        systems = systems.reset_index(drop=True)
+
+        self.pwsids = systems["pwsid"].astype(str).to_numpy()
+        self.names = systems["name"].astype(object).fillna("").to_numpy()
+        self.states = systems["state"].astype(object).fillna("").astype(str).to_numpy()
+        self.cities = systems["city_served"].astype(object).fillna("").to_numpy()
+
+        terms = _search_terms(systems)
+
+        # Sorted terms, for prefix search
+        order = np.lexsort((terms["field"].to_numpy(), terms["term"].to_numpy()))
+        self.terms = terms["term"].to_numpy(dtype=str)[order]
+        self.term_rows = terms["row"].to_numpy(dtype=np.int64)[order]
+        self.term_fields = terms["field"].to_numpy(dtype=np.int8)[order]
+
+        # Trigram -> term postings, as a CSR structure
+        grams = (pd.Series(self.terms)
+            .map(_trigrams)
+            .explode()
+            .dropna()
+            .rename_axis("term_id")
+            .reset_index(name="trigram")
+            .drop_duplicates()
+            .sort_values(["trigram", "term_id"]))
+
+        self.trigrams, counts = np.unique(grams["trigram"].to_numpy(dtype=str), return_counts=True)
+        self.postings = grams["term_id"].to_numpy(dtype=np.int64)
+        self.offsets = np.r_[0, np.cumsum(counts)]
+
+    def search(
+            self,
+            query: str,
+            state: Optional[str] = None,
+            limit: int = 20,
+            fuzzy: bool = True,
+            min_similarity: float = 0.75
+        ) -> pd.DataFrame:
+
+        """
+        Find systems with a term starting with the query. If there are fewer
+        than limit of those and fuzzy is set, fill up with terms within
+        min_similarity (1 - edit distance / length) of the query.
+
+        Returns pwsid, state, name, city_served, the matching term and field,
+        and a score (1.0 for prefix matches), best first.
+        """
+
+        query = _normalize_query(query)
+        if not query:
+            return self._results(np.array([], dtype=np.int64), np.array([]), limit)
+
+        # Prefix matches: one contiguous range of the sorted terms
+        start = np.searchsorted(self.terms, query, side="left")
+        stop = np.searchsorted(self.terms, query + "\U0010FFFF", side="left")
+
+        term_ids = np.arange(start, stop)
+        term_ids = term_ids[self._in_state(term_ids, state)]
+
+        # Shorter terms are the closer matches
+        term_ids = term_ids[np.lexsort((self.term_fields[term_ids], np.char.str_len(self.terms[term_ids])))]
+        scores = np.ones(len(term_ids))
+
+        if fuzzy and len(np.unique(self.term_rows[term_ids])) < limit:
+            fuzzy_ids, fuzzy_scores = self._fuzzy(query, state, min_similarity)
+            term_ids = np.r_[term_ids, fuzzy_ids]
+            scores = np.r_[scores, fuzzy_scores]
+
+        return self._results(term_ids, scores, limit)
+
+    def _fuzzy(self, query: str, state: Optional[str], min_similarity: float):
+        grams = _trigrams(query)
+        if not grams:
+            return np.array([], dtype=np.int64), np.array([])
+
+        gram_ids = np.searchsorted(self.trigrams, grams)
+        gram_ids = gram_ids[(gram_ids < len(self.trigrams)) & (self.trigrams[np.minimum(gram_ids, len(self.trigrams) - 1)] == grams)]
+
+        if len(gram_ids) == 0:
+            return np.array([], dtype=np.int64), np.array([])
+
+        hits = np.concatenate([self.postings[self.offsets[g]:self.offsets[g + 1]] for g in gram_ids])
+        candidates, counts = np.unique(hits, return_counts=True)
+
+        keep = (counts >= max(1, int(np.ceil(MIN_TRIGRAM_SHARE * len(grams))))) & self._in_state(candidates, state)
+        candidates, counts = candidates[keep], counts[keep]
+
+        best = np.argsort(-counts, kind="stable")[:MAX_FUZZY_CANDIDATES]
+        candidates = candidates[best]
+
+        # Score by the edit distance to the closest prefix of each term, so the
+        # query can still be a partial name. Prefixes longer than the query plus
+        # the allowed edits can't score high enough, so terms are cut there.
+        max_edits = int((1 - min_similarity) * len(query))
+        prefixes = self.terms[candidates].astype(f"U{len(query) + max_edits}")
+        distance = prefix_levenshtein(np.full(len(candidates), query), prefixes)
+        scores = 1 - distance / len(query)
+
+        keep = scores >= min_similarity
+        order = np.argsort(-scores[keep], kind="stable")
+
+        return candidates[keep][order], scores[keep][order]
+
+    def _in_state(self, term_ids: np.ndarray, state: Optional[str]) -> np.ndarray:
+        if state is None:
+            return np.ones(len(term_ids), dtype=bool)
+
+        return self.states[self.term_rows[term_ids]] == state.upper()
+
+    def _results(self, term_ids: np.ndarray, scores: np.ndarray, limit: int) -> pd.DataFrame:
+        rows = self.term_rows[term_ids]
+
+        # Best match per system, keeping the ranked order
+        _, first = np.unique(rows, return_index=True)
+        first = np.sort(first)[:limit]
+
+        rows = rows[first]
+        term_ids = term_ids[first]
+
+        return pd.DataFrame({
+            "pwsid":        self.pwsids[rows],
+            "state":        self.states[rows],
+            "name":         self.names[rows],
+            "city_served":  self.cities[rows],
+            "term":         self.terms[term_ids],
+            "field":        np.array(FIELDS, dtype=object)[self.term_fields[term_ids]],
+            "score":        scores[first]
+        })
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str = INDEX_PATH) -> Optional["NameSearchIndex"]:
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    @staticmethod
+    def load_or_build(systems: pd.DataFrame, path: str = INDEX_PATH) -> "NameSearchIndex":
+
+        """
+        Reuse the persisted index if it was built from exactly these systems,
+        otherwise build a new one and persist it.
+        """
+
+        index = NameSearchIndex.load(path)
+
+        if index is not None and index.fingerprint == fingerprint(systems):
+            print("Loaded name search index from disk.")
+            return index
+
+        index = NameSearchIndex(systems)
+        index.save(path)
+        print(f"Built and saved name search index ({len(index.terms)} terms).")
+
+        return index
+
+
+def fingerprint(systems: pd.DataFrame) -> str:
+    digest = hashlib.sha1()
+
+    values = systems[["pwsid", "state", "name", "city_served"]].astype(object).fillna("").astype(str)
+    for value in values["pwsid"].str.cat(values[["state", "name", "city_served"]], sep="|"):
+        digest.update(value.encode())
+
+    return digest.hexdigest()
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s\s+", " ", re.sub(r"[^\w ]", " ", query.upper())).strip()
+
+
+def _normalize(series: pd.Series) -> pd.Series:
+
+    """
+    Upper-case, replace non-word characters and normalize spaces.
+    """
+
+    return (series
+        .astype(object)
+        .fillna("")
+        .str.upper()
+        .str.replace(r"[^\w ]", " ", regex=True)
+        .str.replace(r"\s\s+", " ", regex=True)
+        .str.strip())
+
+
+def _search_terms(systems: pd.DataFrame) -> pd.DataFrame:
+    fields = pd.DataFrame({
+        "name":         _normalize(systems["name"]),
+        "name_tkn":     _normalize(tokenize_ws_name(systems["name"])),
+        "city_served":  _normalize(systems["city_served"])
+    })
+
+    terms = (fields
+        .rename_axis("row")
+        .reset_index()
+        .melt(id_vars="row", var_name="field", value_name="term"))
+
+    words = (terms
+        .assign(term=terms["term"].str.split())
+        .explode("term")
+        .assign(field="word"))
+
+    terms = pd.concat([terms, words], ignore_index=True)
+    terms = terms.loc[terms["term"].notna() & (terms["term"] != "")]
+    terms["field"] = terms["field"].map({f: i for i, f in enumerate(FIELDS)})
+
+    # A word that's also the whole name only needs the more specific field
+    return terms.sort_values("field").drop_duplicates(["row", "term"])
+
+
+def _trigrams(term: str) -> list:
+    padded = f"  {term} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search SDWIS water systems by name.")
+    parser.add_argument("query")
+    parser.add_argument("--state", default=None, help="Two-letter state code.")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--exact", action="store_true", help="Prefix matches only, no typo tolerance.")
+    args = parser.parse_args()
+
+    index = NameSearchIndex.load()
+    if index is None:
+        parser.error(f"No index at {INDEX_PATH}. Run map_sdwis.py first.")
+
+    results = index.search(args.query, args.state, args.limit, fuzzy=not args.exact)
+    print(results.to_markdown(index=False) if len(results) else "No matches.")
+
+
+if __name__ == "__main__":
+    main()
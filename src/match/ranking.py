@@ -0,0 +1,131 @@
+"""
+Ranking and selection of PWS <-> TIGER candidate matches. Used by
+4-rank_boundary_matches.py and by the ranking parameter sweep.
+"""
+
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from match.string_features import pairwise_name_features
+
+# Sort direction of every column we can rank on (True = smaller is better)
+KEY_ASCENDING = {
+    "name_match":       False,
+    "name_jaccard":     False,
+    "name_similarity":  False,
+    "match_rule_rank":  True,
+    "pop_diff":         True,
+}
+
+# Through experimentation, this seemed to be the best ranking:
+# name_match, match_rule_rank, pop_diff
+# and selecting within the candidate_contributor groups first,
+# master_key groups second.
+DEFAULT_RANKING = ("name_match", "match_rule_rank", "pop_diff")
+
+# PWS <-> TIGER candidate matches, with the attributes we rank on
+CANDIDATE_MATCHES_SQL = """
+    SELECT
+        m.master_sk,
+        m.candidate_contributor_sk,
+        s.master_key,
+        c.contributor_id            AS candidate_contributor_id,
+        m.match_rule,
+        m.match_rule_label,
+        s.name                      AS sdwis_name,
+        s.population_served_count   AS sdwis_pop,
+        c.name                      AS tiger_name,
+        c.population_served_count   AS tiger_pop
+    FROM matches m
+    JOIN pws_contributors c ON m.candidate_contributor_sk = c.contributor_sk AND c.source_system = 'tiger'
+    JOIN pws_contributors s ON s.master_sk = m.master_sk AND s.source_system = 'sdwis';
+"""
+
+
+def rank_match_rules(matches: pd.DataFrame, scores: pd.Series) -> pd.DataFrame:
+
+    """
+    Use the "scored" data to determine which rules (and combos of rules)
+    are most effective. The scores should be indexed by (pwsid, candidate_contributor_id).
+    """
+
+    # Assign a "rank" to each match rule and combo of match rules
+    # (match_rule is a bitmask of the rules, so each combo is a single integer)
+    match_rule_ranks = (matches
+        .join(scores.rename("score"), on=["master_key", "candidate_contributor_id"])
+        .groupby(["match_rule"])
+        .agg(
+            points = ("score", "sum"),
+            total = ("score", "size")
+        )) #type:ignore
+
+    match_rule_ranks["score"] = match_rule_ranks["points"] / match_rule_ranks["total"]
+    match_rule_ranks = match_rule_ranks.sort_values("score", ascending=False)
+    match_rule_ranks["match_rule_rank"] = np.arange(len(match_rule_ranks))
+
+    return match_rule_ranks
+
+
+def add_name_features(matches: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    Flag any that have name matches, and grade the partial ones
+    (computed in batch, once per distinct pair of names). Also add the population
+    difference between the PWS and the TIGER place.
+    """
+
+    name_features = pairwise_name_features(matches["tiger_name"], matches["sdwis_name"])
+
+    return matches.assign(
+        name_match      = name_features["contained"],
+        name_jaccard    = name_features["token_jaccard"],
+        name_similarity = name_features["similarity"],
+        pop_diff        = (matches["tiger_pop"] - matches["sdwis_pop"]).abs())
+
+
+def rank_matches(matches: pd.DataFrame, keys: Sequence[str] = DEFAULT_RANKING) -> pd.DataFrame:
+
+    """
+    Assign numeric ranks to every match by sorting on the given keys.
+    """
+
+    matches_ranked = (matches
+        .sort_values(list(keys), ascending=[KEY_ASCENDING[k] for k in keys])
+        # Re-number and bring that index into the df
+        # This gives us a simple column to rank on
+        .reset_index(drop=True)
+        .reset_index(drop=False)
+        .rename(columns={"index": "overall_rank"}))
+
+    # I guess this is technically unnecessary, cause it's equivalent to sorting on overall_rank...
+    # but maybe it make things a little clearer?
+    matches_ranked["master_group_ranking"] = \
+        (matches_ranked
+            .groupby("master_sk")
+            ["overall_rank"]
+            .rank("dense")
+            .astype("int"))
+
+    return matches_ranked
+
+
+def select_best_matches(matches_ranked: pd.DataFrame, candidate_first: bool = True) -> np.ndarray:
+
+    """
+    Identify the 1-1 matches using the overall_rank. Returns a boolean mask.
+    By default we select within the candidate_contributor groups first and
+    the master_key groups second.
+    """
+
+    groups = ["candidate_contributor_sk", "master_sk"]
+    if not candidate_first:
+        groups.reverse()
+
+    best_matches = (matches_ranked
+        .sort_values(["overall_rank"])
+        .drop_duplicates(subset=groups[0], keep="first")
+        .drop_duplicates(subset=groups[1], keep="first")).index
+
+    return matches_ranked.index.isin(best_matches)
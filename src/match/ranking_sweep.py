@@ -0,0 +1,159 @@
+"""
+Parallel parameter sweep over the boundary match ranking in
+4-rank_boundary_matches.py. Every combination of ranking keys, group
+selection order, assignment method and proximity_buffer is evaluated
+against the labeled data, and a leaderboard of 1:1 match scores is written to WSB_OUTPUT_PATH.
+
+The candidate features and the scorer distances are computed once and
+cached in the staging folder, so each variant is just a sort and a couple
+of drop_duplicates. Run from /src after 4-rank_boundary_matches.py:
+
+    python -m match.ranking_sweep [--refresh] [--workers N]
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+import pandas as pd
+import sqlalchemy as sa
+from dotenv import load_dotenv
+
+from match.assignment import assign_best_matches
+from match.match_scorer import MatchScorer
+from match.ranking import (
+    CANDIDATE_MATCHES_SQL, DEFAULT_RANKING, add_name_features, rank_match_rules,
+    rank_matches, select_best_matches)
+from match.schema import apply_schema
+
+load_dotenv()
+
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+OUTPUT_PATH = os.environ["WSB_OUTPUT_PATH"]
+
+CACHE_PATH = os.path.join(STAGING_PATH, "ranking_sweep_candidates.parquet")
+
+GRID = {
+    "keys": [
+        DEFAULT_RANKING,
+        ("match_rule_rank", "name_match", "pop_diff"),
+        ("name_match", "name_similarity", "match_rule_rank", "pop_diff"),
+        ("name_match", "match_rule_rank", "name_similarity", "pop_diff"),
+        ("name_similarity", "match_rule_rank", "pop_diff"),
+        ("name_jaccard", "match_rule_rank", "pop_diff"),
+    ],
+    "candidate_first": [True, False],
+    "assignment": ["greedy", "optimal"],
+    "proximity_buffer": [250, 500, 1000, 2000],
+}
+
+# Set in each worker process by the pool initializer
+_candidates: Optional[pd.DataFrame] = None
+
+
+def build_candidates(conn) -> pd.DataFrame:
+
+    """
+    Candidate matches with their ranking features and, where the PWS has a
+    labeled boundary, the exact distance between the labeled and the candidate
+    geometry.
+    """
+
+    candidates = add_name_features(apply_schema(pd.read_sql(CANDIDATE_MATCHES_SQL, conn)))
+
+    distances = (MatchScorer()
+        .score_tiger_matches(candidates, with_distance=True)
+        ["distance"])
+
+    return candidates.join(distances, on=["master_key", "candidate_contributor_id"])
+
+
+def load_candidates(refresh: bool = False) -> pd.DataFrame:
+    if os.path.exists(CACHE_PATH) and not refresh:
+        print("Loaded cached candidate features and distances.")
+        return pd.read_parquet(CACHE_PATH)
+
+    conn = sa.create_engine(os.environ["POSTGIS_CONN_STR"])
+    candidates = build_candidates(conn)
+    candidates.to_parquet(CACHE_PATH, index=False)
+    print("Built and cached candidate features and distances.")
+
+    return candidates
+
+
+def _init_worker(candidates: pd.DataFrame):
+    global _candidates
+    _candidates = candidates
+
+
+def evaluate(keys: Sequence[str], candidate_first: bool, assignment: str, proximity_buffer: int) -> dict:
+    start_time = time.perf_counter()
+
+    candidates = _candidates
+
+    scores = (candidates
+        .set_index(["master_key", "candidate_contributor_id"])
+        ["distance"]
+        .dropna()) <= proximity_buffer
+
+    match_rule_ranks = rank_match_rules(candidates, scores)
+
+    matches_ranked = rank_matches(
+        candidates.join(match_rule_ranks[["match_rule_rank"]], on="match_rule", how="left"),
+        keys)
+
+    if assignment == "optimal":
+        best = matches_ranked[assign_best_matches(matches_ranked, workers=1)]
+    else:
+        best = matches_ranked[select_best_matches(matches_ranked, candidate_first)]
+    best_scores = best["distance"].dropna() <= proximity_buffer
+
+    return {
+        "keys":             ", ".join(keys),
+        "candidate_first":  candidate_first,
+        "assignment":       assignment,
+        "proximity_buffer": proximity_buffer,
+        "best_matches":     len(best),
+        "scored_matches":   len(best_scores),
+        "score":            best_scores.mean() * 100,
+        "runtime_s":        time.perf_counter() - start_time
+    }
+
+
+def run_sweep(candidates: pd.DataFrame, workers: Optional[int] = None) -> pd.DataFrame:
+    variants = list(itertools.product(
+        GRID["keys"], GRID["candidate_first"], GRID["assignment"], GRID["proximity_buffer"]))
+
+    # Group selection order only matters for the greedy assignment
+    variants = [v for v in variants if v[2] == "greedy" or v[1]]
+
+    print(f"Evaluating {len(variants)} ranking variants...")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(candidates,)) as executor:
+        results = list(executor.map(evaluate, *zip(*variants)))
+
+    return (pd.DataFrame(results)
+        .sort_values(["score", "runtime_s"], ascending=[False, True])
+        .reset_index(drop=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate boundary match ranking variants.")
+    parser.add_argument("--refresh", action="store_true", help="Rebuild the cached candidate features and distances.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    leaderboard = run_sweep(load_candidates(args.refresh), args.workers)
+
+    path = os.path.join(OUTPUT_PATH, "ranking_sweep_leaderboard.csv")
+    leaderboard.to_csv(path, index=False)
+
+    print(leaderboard.head(20).to_markdown(index=False))
+    print(f"\nWrote leaderboard to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from match.spatial_index import BoundaryIndex
+
+
+@dataclass(frozen=True)
+class RuleFilter:
+    """
+    Declares which rows of the token table may participate on one side of a
+    match rule. Rows must come from one of the source systems, have non-null
+    values in every "notna" column, and satisfy the boolean flag columns.
+    """
+
+    source_systems: Tuple[str, ...]
+    notna: Tuple[str, ...] = ()
+    flags_true: Tuple[str, ...] = ()
+    flags_false: Tuple[str, ...] = ()
+
+    def mask(self, tokens: pd.DataFrame) -> pd.Series:
+        mask = tokens["source_system"].isin(self.source_systems)
+
+        for col in self.notna:
+            mask &= tokens[col].notna()
+
+        for col in self.flags_true:
+            mask &= tokens[col]
+
+        for col in self.flags_false:
+            mask &= ~tokens[col]
+
+        return mask
+
+
+@dataclass(frozen=True)
+class MatchRule:
+    """
+    A match rule is an equi-join between the rows selected by the left filter
+    (systems with known PWS ID's) and the rows selected by the right filter
+    (candidate systems), on the given key columns.
+    """
+
+    name: str
+    left: RuleFilter
+    right: RuleFilter
+    left_on: Tuple[str, ...]
+    right_on: Optional[Tuple[str, ...]] = None
+
+    @property
+    def right_keys(self) -> Tuple[str, ...]:
+        return self.left_on if self.right_on is None else self.right_on
+
+    @property
+    def source_systems(self) -> Tuple[str, ...]:
+        return self.left.source_systems + self.right.source_systems
+
+
+@dataclass(frozen=True)
+class SpatialRule:
+    """
+    A match rule that pairs the rows selected by the left filter with every
+    boundary (TIGER) polygon they fall inside. Optionally the states must agree
+    and low-quality centroids are skipped.
+    """
+
+    name: str
+    left: RuleFilter
+    same_state: bool = False
+    excluded_centroid_quality: Tuple[str, ...] = ()
+
+    @property
+    def source_systems(self) -> Tuple[str, ...]:
+        return self.left.source_systems + ("tiger",)
+
+
+class HashIndex:
+    """
+    A hash index over the key columns of one filtered side of the token table.
+    It is built once and can then be probed by any number of rules that join
+    against the same rows on the same keys.
+    """
+
+    def __init__(self, rows: pd.DataFrame, keys: Tuple[str, ...], id_column: str = "contributor_id"):
+
+        # Null keys never match (same as SQL join semantics)
+        rows = rows.loc[rows[list(keys)].notna().all(axis=1)]
+
+        self.contributor_ids = rows[id_column].to_numpy()
+
+        codes, self.uniques = _to_index(rows, keys).factorize()
+
+        # Bucket the rows by key: rows for key k are order[starts[k]:starts[k] + counts[k]]
+        self.order = np.argsort(codes, kind="stable")
+        self.counts = np.bincount(codes, minlength=len(self.uniques))
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def probe(self, rows: pd.DataFrame, keys: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up each row's keys. Returns positional indexes into "rows" and the
+        matching contributor_id's, one entry per matched pair.
+        """
+
+        key_ids = self.uniques.get_indexer(_to_index(rows, keys))
+
+        left_pos = np.flatnonzero(key_ids >= 0)
+        key_ids = key_ids[left_pos]
+
+        counts = self.counts[key_ids]
+        offsets = (
+            np.repeat(self.starts[key_ids] - (np.cumsum(counts) - counts), counts) +
+            np.arange(counts.sum()))
+
+        return np.repeat(left_pos, counts), self.contributor_ids[self.order[offsets]]
+
+
+def _to_index(rows: pd.DataFrame, keys: Tuple[str, ...]) -> pd.Index:
+    if len(keys) == 1:
+        return pd.Index(rows[keys[0]])
+
+    return pd.MultiIndex.from_frame(rows[list(keys)])
+
+
+class MatchRuleEngine:
+    """
+    Runs a set of declarative match rules against the token table. Each distinct
+    (right filter, right keys) combination gets one hash index, shared by every
+    rule that uses it, and the rules themselves are probed concurrently.
+
+    Matched pairs are reported with the id_column and master_column of the token
+    table (e.g. the integer surrogate keys), as master_column, {id_column}_x
+    and {id_column}_y.
+    """
+
+    def __init__(
+            self,
+            tokens: pd.DataFrame,
+            max_workers: Optional[int] = None,
+            id_column: str = "contributor_id",
+            master_column: str = "master_key"
+        ):
+
+        self.tokens = tokens
+        self.max_workers = max_workers
+        self.id_column = id_column
+        self.master_column = master_column
+
+        self._subsets: Dict[RuleFilter, pd.DataFrame] = {}
+        self._indexes: Dict[Tuple[RuleFilter, Tuple[str, ...]], HashIndex] = {}
+
+    def run(self, rules: List[MatchRule]) -> pd.DataFrame:
+
+        # Build all the shared structures up front, so the concurrent probes only read them
+        for rule in rules:
+            self._get_subset(rule.left)
+            self._get_index(rule.right, rule.right_keys)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self.run_rule, rules))
+
+        for rule, result in zip(rules, results):
+            print(f"Rule '{rule.name}': {len(result)} matches")
+
+        return pd.concat(results, ignore_index=True)
+
+    def run_rule(self, rule: MatchRule) -> pd.DataFrame:
+        left = self._get_subset(rule.left)
+        index = self._get_index(rule.right, rule.right_keys)
+
+        left_pos, candidate_ids = index.probe(left, rule.left_on)
+
+        return pd.DataFrame({
+            self.master_column:         left[self.master_column].to_numpy()[left_pos],
+            f"{self.id_column}_x":      left[self.id_column].to_numpy()[left_pos],
+            f"{self.id_column}_y":      candidate_ids,
+            "match_rule":               rule.name
+        })
+
+    def run_spatial(self, rules: List[SpatialRule], index: BoundaryIndex) -> pd.DataFrame:
+        results = []
+
+        for rule in rules:
+            left = self._get_subset(rule.left)
+
+            pairs = index.query(
+                left,
+                same_state=rule.same_state,
+                excluded_centroid_quality=rule.excluded_centroid_quality)
+
+            results.append(pd.DataFrame({
+                self.master_column:     left[self.master_column].to_numpy()[pairs["point_pos"]],
+                f"{self.id_column}_x":  left[self.id_column].to_numpy()[pairs["point_pos"]],
+                f"{self.id_column}_y":  pairs["boundary_id"].to_numpy(),
+                "match_rule":           rule.name
+            }))
+
+            print(f"Rule '{rule.name}': {len(results[-1])} matches")
+
+        return pd.concat(results, ignore_index=True)
+
+    def _get_subset(self, rule_filter: RuleFilter) -> pd.DataFrame:
+        if rule_filter not in self._subsets:
+            self._subsets[rule_filter] = self.tokens.loc[rule_filter.mask(self.tokens)]
+
+        return self._subsets[rule_filter]
+
+    def _get_index(self, rule_filter: RuleFilter, keys: Tuple[str, ...]) -> HashIndex:
+        if (rule_filter, keys) not in self._indexes:
+            self._indexes[(rule_filter, keys)] = HashIndex(self._get_subset(rule_filter), keys, self.id_column)
+
+        return self._indexes[(rule_filter, keys)]
@@ -0,0 +1,86 @@
+"""
+Compact dtypes for the low-cardinality columns that travel through matching,
+ranking, centroid selection and combine_tiers.
+
+Each categorical column has a fixed dictionary, so the codes are the same in
+every DataFrame and masks like isin / == compare small integers instead of
+strings. Values outside a dictionary (e.g. a new source system) are appended
+after the fixed categories rather than dropped.
+"""
+
+from typing import Iterable, Optional, Sequence
+
+import pandas as pd
+
+SOURCE_SYSTEMS = (
+    "sdwis", "echo", "frs", "ucmr", "mhp", "tiger",
+    "labeled", "contributed", "modeled", "master")
+
+STATES = (
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI", "ID",
+    "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO",
+    "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA",
+    "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY",
+    "AS", "GU", "MP", "PR", "VI")
+
+# States, plus EPA regions and the Navajo Nation for tribal systems
+PRIMACY_AGENCY_CODES = STATES + tuple(f"{r:02d}" for r in range(1, 11)) + ("NN",)
+
+OWNER_TYPE_CODES = ("F", "L", "M", "N", "P", "S")
+
+# Column -> fixed categories, None for categories taken from the data,
+# or a numpy dtype name
+SCHEMA = {
+    "source_system":        SOURCE_SYSTEMS,
+    "state":                STATES,
+    "primacy_agency_code":  PRIMACY_AGENCY_CODES,
+    "owner_type_code":      OWNER_TYPE_CODES,
+    "centroid_quality":     None,
+    "match_rule_label":     None,
+    # Bitmask of the match rules (see match_rules.RULE_BITS)
+    "match_rule":           "int16",
+}
+
+
+def categorical_dtype(values: pd.Series, categories: Optional[Sequence[str]] = None) -> pd.CategoricalDtype:
+
+    """
+    A CategoricalDtype with the given categories first, followed by any other
+    values found in the data (sorted).
+    """
+
+    observed = set(values.dropna().astype(str).unique())
+    fixed = list(categories or [])
+
+    return pd.CategoricalDtype(fixed + sorted(observed - set(fixed)))
+
+
+def apply_schema(df: pd.DataFrame, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+
+    """
+    Convert the schema columns present in df (or only the given ones) to their
+    compact dtypes. Returns a new DataFrame.
+    """
+
+    dtypes = {}
+
+    for col in (SCHEMA if columns is None else columns):
+        if col not in df.columns:
+            continue
+
+        spec = SCHEMA[col]
+        dtypes[col] = spec if isinstance(spec, str) else categorical_dtype(df[col], spec)
+
+    return df.astype(dtypes)
+
+
+def release_schema(df: pd.DataFrame) -> pd.DataFrame:
+
+    """
+    Convert categorical columns back to plain strings, for writers
+    (e.g. the GeoPackage driver) that don't understand them.
+    """
+
+    categoricals = df.select_dtypes("category").columns
+
+    return df.astype({col: object for col in categoricals})
@@ -0,0 +1,97 @@
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+class BoundaryIndex:
+    """
+    A reusable point-in-polygon index over boundary geometries (TIGER places).
+    The STRtree and the prepared polygons are built once and shared across
+    rules. It can be pickled: the geometries are saved as WKB, and the tree is
+    rebuilt on load.
+    """
+
+    def __init__(self, boundaries: gpd.GeoDataFrame, id_column: str = "contributor_id"):
+
+        """
+        The boundaries DF should have columns: state, geometry, and the ID column
+        (contributor_id, or its surrogate key) that is reported for each match.
+        """
+
+        self.boundary_ids = boundaries[id_column].to_numpy()
+        self.states = boundaries["state"].astype(object).fillna("").astype(str).to_numpy()
+        self.geometries = boundaries["geometry"].to_numpy()
+
+        self._index_geometries()
+
+    def _index_geometries(self):
+        self.tree = shapely.STRtree(self.geometries)
+        shapely.prepare(self.geometries)
+
+    def __getstate__(self) -> dict:
+        # Only the arrays are saved; the tree is rebuilt on load
+        return {
+            "boundary_ids": self.boundary_ids,
+            "states": self.states,
+            "geometries": shapely.to_wkb(self.geometries)}
+
+    def __setstate__(self, state: dict):
+        self.boundary_ids = state["boundary_ids"]
+        self.states = state["states"]
+        self.geometries = shapely.from_wkb(state["geometries"])
+        self._index_geometries()
+
+    def query(
+            self,
+            points: gpd.GeoDataFrame,
+            same_state: bool = False,
+            excluded_centroid_quality: Sequence[str] = ()
+        ) -> pd.DataFrame:
+
+        """
+        Find every boundary intersecting each of the given geometries. The state
+        and centroid quality filters are applied to the candidate pairs before
+        the (more expensive) exact geometry test.
+
+        Returns positional indexes into "points" and the matching boundary ID's.
+        """
+
+        geoms = points["geometry"].to_numpy()
+
+        keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+
+        if excluded_centroid_quality:
+            keep &= ~points["centroid_quality"].isin(excluded_centroid_quality).to_numpy()
+
+        point_pos = np.flatnonzero(keep)
+
+        # Bounding-box candidates from the tree
+        input_idx, tree_idx = self.tree.query(geoms[point_pos])
+        input_idx = point_pos[input_idx]
+
+        if same_state:
+            left_states = points["state"].astype(object).fillna("").astype(str).to_numpy()[input_idx]
+            mask = (left_states != "") & (left_states == self.states[tree_idx])
+            input_idx, tree_idx = input_idx[mask], tree_idx[mask]
+
+        # Exact test. Points get the vectorized xy predicate; anything else goes
+        # through the general (prepared) intersects predicate.
+        candidates = geoms[input_idx]
+        is_point = shapely.get_type_id(candidates) == 0
+
+        hit = np.zeros(len(input_idx), dtype=bool)
+        hit[is_point] = shapely.intersects_xy(
+            self.geometries[tree_idx[is_point]],
+            shapely.get_x(candidates[is_point]),
+            shapely.get_y(candidates[is_point]))
+        hit[~is_point] = shapely.intersects(
+            self.geometries[tree_idx[~is_point]],
+            candidates[~is_point])
+
+        return pd.DataFrame({
+            "point_pos": input_idx[hit],
+            "boundary_id": self.boundary_ids[tree_idx[hit]]
+        })
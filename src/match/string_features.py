@@ -0,0 +1,175 @@
+"""
+Vectorized pairwise string features for candidate match pairs.
+
+Candidate pairs repeat the same names many times over (the same TIGER place
+matched to several PWS's, and vice versa), so every feature is computed once
+per distinct (left, right) pair and then broadcast back to the rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Pairs are processed in chunks sorted by length to keep padding small
+CHUNK_SIZE = 4096
+
+
+def pairwise_name_features(left: pd.Series, right: pd.Series) -> pd.DataFrame:
+
+    """
+    For each row, compare the left and right names. Nulls never match.
+
+    Returns columns:
+        contained       - True if the left name appears within the right name
+        token_jaccard   - |common words| / |all words|
+        similarity      - 1 - (Levenshtein distance / length of the longer name)
+    """
+
+    codes, uniques = pd.MultiIndex.from_arrays([left.fillna(""), right.fillna("")]).factorize()
+
+    a = np.array(uniques.get_level_values(0), dtype=str)
+    b = np.array(uniques.get_level_values(1), dtype=str)
+
+    both_present = (np.char.str_len(a) > 0) & (np.char.str_len(b) > 0)
+
+    features = pd.DataFrame({
+        "contained":        (np.char.find(b, a) >= 0) & both_present,
+        "token_jaccard":    np.where(both_present, token_jaccard(a, b), 0.0),
+        "similarity":       np.where(both_present, levenshtein_similarity(a, b), 0.0)
+    })
+
+    return features.iloc[codes].set_index(left.index)
+
+
+def token_jaccard(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    def _tokens(strings):
+        return (pd.Series(strings)
+            .str.split()
+            .explode()
+            .dropna()
+            .rename_axis("pair")
+            .reset_index(name="token")
+            .drop_duplicates())
+
+    left = _tokens(a)
+    right = _tokens(b)
+
+    common = left.merge(right, on=["pair", "token"]).groupby("pair").size()
+    n_left = left.groupby("pair").size()
+    n_right = right.groupby("pair").size()
+
+    index = pd.RangeIndex(len(a))
+    common = common.reindex(index, fill_value=0)
+    union = n_left.reindex(index, fill_value=0) + n_right.reindex(index, fill_value=0) - common
+
+    return (common / union.where(union > 0)).fillna(0.0).to_numpy()
+
+
+def levenshtein_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    len_a = np.char.str_len(a)
+    len_b = np.char.str_len(b)
+
+    distance = np.zeros(len(a), dtype=np.int64)
+
+    # Sort by length so each chunk is padded to roughly its own length
+    order = np.lexsort((len_b, len_a))
+
+    for start in range(0, len(order), CHUNK_SIZE):
+        chunk = order[start:start + CHUNK_SIZE]
+        distance[chunk] = levenshtein(a[chunk], b[chunk])
+
+    longest = np.maximum(len_a, len_b)
+
+    return np.where(longest > 0, 1 - distance / np.maximum(longest, 1), 1.0)
+
+
+def levenshtein(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+
+    """
+    Edit distance between a[k] and b[k] for every k. The dynamic-programming
+    table is filled one cell at a time, but each cell is computed for all pairs
+    at once.
+    """
+
+    n = len(a)
+    len_a = np.char.str_len(a)
+    len_b = np.char.str_len(b)
+
+    # Fixed-width unicode arrays viewed as code points, zero padded
+    chars_a = _code_points(a)
+    chars_b = _code_points(b)
+
+    rows = np.arange(n)
+
+    prev = np.tile(np.arange(chars_b.shape[1] + 1), (n, 1))
+
+    # Empty left strings: the distance is the length of the right string
+    distance = len_b.astype(np.int64).copy()
+
+    for i in range(chars_a.shape[1]):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i + 1
+
+        for j in range(chars_b.shape[1]):
+            cost = chars_a[:, i] != chars_b[:, j]
+            cur[:, j + 1] = np.minimum(
+                np.minimum(prev[:, j + 1], cur[:, j]) + 1,
+                prev[:, j] + cost)
+
+        prev = cur
+
+        # Cells only depend on the prefixes, so padding never affects the answer
+        done = len_a == i + 1
+        distance[done] = prev[rows[done], len_b[done]]
+
+    return distance
+
+
+def prefix_levenshtein(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+
+    """
+    Edit distance between a[k] and the closest prefix of b[k], for every k
+    (i.e. how far a[k] is from being a prefix of b[k]). Same table as
+    levenshtein, but the answer is the minimum over the last row.
+    """
+
+    n = len(a)
+    len_a = np.char.str_len(a)
+    len_b = np.char.str_len(b)
+
+    chars_a = _code_points(a)
+    chars_b = _code_points(b)
+
+    rows = np.arange(n)
+
+    prev = np.tile(np.arange(chars_b.shape[1] + 1), (n, 1))
+
+    # Cells past the end of b aren't prefixes of it
+    beyond_b = np.arange(chars_b.shape[1] + 1)[None, :] > len_b[:, None]
+
+    # Empty left strings are a prefix of anything
+    distance = np.zeros(n, dtype=np.int64)
+
+    for i in range(chars_a.shape[1]):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i + 1
+
+        for j in range(chars_b.shape[1]):
+            cost = chars_a[:, i] != chars_b[:, j]
+            cur[:, j + 1] = np.minimum(
+                np.minimum(prev[:, j + 1], cur[:, j]) + 1,
+                prev[:, j] + cost)
+
+        prev = cur
+
+        done = len_a == i + 1
+        distance[done] = np.where(beyond_b[done], np.iinfo(np.int64).max, prev[rows[done]]).min(axis=1)
+
+    return distance
+
+
+def _code_points(strings: np.ndarray) -> np.ndarray:
+    width = max(int(np.char.str_len(strings).max(initial=0)), 1)
+
+    return (np.asarray(strings, dtype=f"U{width}")
+        .view(np.uint32)
+        .reshape(len(strings), width))
@@ -0,0 +1,214 @@
+"""
+Clip the Tier 3 circles to land, so they don't extend into the ocean or the
+Great Lakes.
+
+The Natural Earth ocean (and lakes) polygons are huge, so they are diced with
+a quadtree into small pieces of at most a few hundred vertices. The dicing is the
+expensive part, so the pieces are persisted to the staging folder (keyed by
+the size and modification time of the source files) and the STRtree over them
+is rebuilt when they are loaded. Only the circles whose bounding box touches a
+piece are clipped, and only against the pieces they actually intersect, in
+parallel chunks.
+"""
+
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from pyproj import CRS
+from dotenv import load_dotenv
+
+import match.helpers as helpers
+
+load_dotenv()
+
+DATA_PATH = os.environ["WSB_DATA_PATH"]
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+EPSG = os.environ["WSB_EPSG"]
+
+# Written by download_tigris_ne.R. The lakes file is optional.
+WATER_PATHS = [
+    os.path.join(DATA_PATH, "ne/ocean/ne-ocean-10m/ne_10m_ocean.shp"),
+    os.path.join(DATA_PATH, "ne/lakes/ne-lakes-10m/ne_10m_lakes.shp")]
+
+INDEX_PATH = os.path.join(STAGING_PATH, "water_index.pkl")
+
+# Pieces are split until they have at most this many vertices
+MAX_PIECE_VERTICES = 256
+
+# Circles per task
+CHUNK_SIZE = 1000
+
+
+class WaterIndex:
+    """
+    An STRtree over small pieces of the water polygons.
+    """
+
+    def __init__(self, paths: Sequence[str] = WATER_PATHS, crs=f"epsg:{EPSG}"):
+        paths = [p for p in paths if os.path.exists(p)]
+        self.fingerprint = fingerprint(paths, crs)
+
+        water = np.concatenate([
+            shapely.make_valid(gpd.read_file(path, engine="pyogrio").to_crs(crs).geometry.to_numpy())
+            for path in paths])
+
+        water = _polygons(water)
+
+        self.pieces = np.array(
+            [piece for polygon in water for piece in _dice(polygon)], dtype=object)
+
+        self._index_pieces()
+
+    def _index_pieces(self):
+        self.tree = shapely.STRtree(self.pieces)
+        shapely.prepare(self.pieces)
+
+    def __getstate__(self) -> dict:
+        # Only the pieces are saved; the tree is rebuilt on load
+        return {"fingerprint": self.fingerprint, "pieces": shapely.to_wkb(self.pieces)}
+
+    def __setstate__(self, state: dict):
+        self.fingerprint = state["fingerprint"]
+        self.pieces = shapely.from_wkb(state["pieces"])
+        self._index_pieces()
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load_or_build(paths: Sequence[str] = WATER_PATHS, crs=f"epsg:{EPSG}", path: str = INDEX_PATH) -> "WaterIndex":
+
+        """
+        Reuse the persisted index if it was built from the same files,
+        otherwise build a new one and persist it.
+        """
+
+        expected = fingerprint([p for p in paths if os.path.exists(p)], crs)
+
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                index = pickle.load(file)
+
+            if index.fingerprint == expected:
+                print("Loaded water index from disk.")
+                return index
+
+        index = WaterIndex(paths, crs)
+        index.save(path)
+        print(f"Built and saved water index ({len(index.pieces)} pieces).")
+
+        return index
+
+
+def fingerprint(paths: Sequence[str], crs) -> str:
+    digest = hashlib.sha1(f"{CRS.from_user_input(crs).to_string()}|{MAX_PIECE_VERTICES}".encode())
+
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+
+    return digest.hexdigest()
+
+
+def clip_to_land(
+        geoms: gpd.GeoSeries,
+        index: Optional[WaterIndex] = None,
+        workers: Optional[int] = None
+    ) -> gpd.GeoSeries:
+
+    """
+    Remove the water from each geometry. Geometries that would be left empty
+    (entirely over water) are returned unchanged.
+    """
+
+    if index is None:
+        index = WaterIndex.load_or_build(crs=geoms.crs or f"epsg:{EPSG}")
+
+    values = geoms.to_numpy()
+
+    # Candidate pairs from the tree, then the exact (prepared) test
+    geom_idx, piece_idx = index.tree.query(values, predicate="intersects")
+
+    order = np.argsort(geom_idx, kind="stable")
+    geom_idx, piece_idx = geom_idx[order], piece_idx[order]
+
+    targets, starts = np.unique(geom_idx, return_index=True)
+    piece_groups = np.split(piece_idx, starts[1:])
+
+    tasks = [
+        (values[targets[i:i + CHUNK_SIZE]],
+         [index.pieces[p] for p in piece_groups[i:i + CHUNK_SIZE]])
+        for i in range(0, len(targets), CHUNK_SIZE)]
+
+    if workers == 1 or not helpers.can_use_process_pool():
+        results = [_clip_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_clip_chunk, tasks))
+
+    clipped = values.copy()
+    if results:
+        clipped[targets] = np.concatenate(results)
+
+    print(f"Clipped {len(targets)} of {len(values)} geometries to land.")
+
+    return gpd.GeoSeries(clipped, index=geoms.index, crs=geoms.crs)
+
+
+def _clip_chunk(task: Tuple[np.ndarray, List[np.ndarray]]) -> np.ndarray:
+    geoms, piece_groups = task
+
+    water = np.array([shapely.union_all(pieces) for pieces in piece_groups], dtype=object)
+    land = shapely.difference(geoms, water)
+
+    return np.where(shapely.is_empty(land), geoms, land)
+
+
+def _dice(polygon, max_vertices: int = MAX_PIECE_VERTICES) -> List:
+
+    """
+    Split a polygon into quadrants until every piece has at most max_vertices.
+    """
+
+    xmin, ymin, xmax, ymax = polygon.bounds
+
+    if shapely.get_num_coordinates(polygon) <= max_vertices or max(xmax - xmin, ymax - ymin) < 1e-9:
+        return [polygon]
+
+    xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+
+    quadrants = shapely.box(
+        [xmin, xmid, xmin, xmid],
+        [ymin, ymin, ymid, ymid],
+        [xmid, xmax, xmid, xmax],
+        [ymid, ymid, ymax, ymax])
+
+    pieces = []
+
+    for part in _polygons(shapely.intersection(polygon, quadrants)):
+        pieces.extend(_dice(part, max_vertices))
+
+    return pieces
+
+
+def _polygons(geoms: np.ndarray) -> np.ndarray:
+
+    """
+    The non-empty polygons in geoms. Multi-part geometries are exploded,
+    including the ones nested in a GeometryCollection (e.g. from make_valid).
+    """
+
+    geoms = shapely.get_parts(geoms)
+
+    # Multi-part geometries and collections
+    while np.isin(shapely.get_type_id(geoms), [4, 5, 6, 7]).any():
+        geoms = shapely.get_parts(geoms)
+
+    return geoms[(shapely.get_type_id(geoms) == 3) & ~shapely.is_empty(geoms)]
@@ -0,0 +1,71 @@
+"""
+Tier 3 boundaries are circles around the best centroid, with the radius
+predicted by 02_linear.R. The model writes only the centroids and radii
+(tier3_radii.csv); the polygons are generated here, vectorized, when they
+are actually needed.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STAGING_PATH = os.environ["WSB_STAGING_PATH"]
+EPSG = os.environ["WSB_EPSG"]
+
+TIER3_PATH = os.path.join(STAGING_PATH, "tier3_radii.csv")
+
+# Radii are in meters, so buffer in a projected metric CRS
+# (California Albers, the same CRS the model used for its buffers)
+BUFFER_CRS = "EPSG:3310"
+
+# Segments per quarter circle. 30 matches the R (sf) default.
+QUAD_SEGS = 30
+
+RADIUS_COLUMNS = ("pred_05", "pred_50", "pred_95")
+
+
+def read_tier3(path: str = TIER3_PATH) -> pd.DataFrame:
+
+    """
+    Read the Tier 3 centroid + radius table.
+    """
+
+    return pd.read_csv(path, dtype={
+        "pwsid": "string",
+        "centroid_quality": "string",
+        "geometry_source_detail": "string"})
+
+
+def tier3_circles(
+        t3: pd.DataFrame,
+        radius_column: str = "pred_50",
+        quad_segs: int = QUAD_SEGS
+    ) -> gpd.GeoSeries:
+
+    """
+    Generate the circle for each row of t3, from centroid_lat / centroid_lon
+    and the radius (in meters) in radius_column. Rows without a centroid or
+    radius get an empty polygon. Returned in WSB_EPSG, aligned to t3's index.
+    """
+
+    centers = gpd.GeoSeries(
+        gpd.points_from_xy(t3["centroid_lon"], t3["centroid_lat"]),
+        index=t3.index, crs=f"epsg:{EPSG}").to_crs(BUFFER_CRS)
+
+    radii = t3[radius_column].to_numpy(dtype=float)
+
+    valid = (
+        np.isfinite(t3["centroid_lon"].to_numpy(dtype=float)) &
+        np.isfinite(t3["centroid_lat"].to_numpy(dtype=float)) &
+        np.isfinite(radii))
+
+    circles = np.full(len(t3), shapely.Polygon(), dtype=object)
+    circles[valid] = shapely.buffer(centers.to_numpy()[valid], radii[valid], quad_segs=quad_segs)
+
+    return gpd.GeoSeries(circles, index=t3.index, crs=BUFFER_CRS).to_crs(f"epsg:{EPSG}")
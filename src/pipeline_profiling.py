@@ -0,0 +1,197 @@
+"""
+Memory profiling of the pipeline's Python stages, one #%% cell at a time.
+
+The script is run as a module (like run_pipeline.py's __import__), but cell by
+cell. Around each cell, a tracemalloc snapshot diff attributes the net
+allocations to the statements (and call stacks) that made them, and the deep
+memory usage of every DataFrame in the module is recorded.
+
+For each stage, this writes to WSB_OUTPUT_PATH/memory_profile/:
+    <stage>_cells.csv       - per cell: time, net allocated and peak memory
+    <stage>_allocations.csv - per cell: the statements that allocated the most
+    <stage>_dataframes.csv  - per cell: the deep size of each DataFrame variable
+    <stage>.folded          - collapsed stacks (bytes) for flamegraph.pl / speedscope
+"""
+
+import importlib.util
+import linecache
+import os
+import re
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OUTPUT_PATH = os.environ["WSB_OUTPUT_PATH"]
+
+PROFILE_PATH = os.path.join(OUTPUT_PATH, "memory_profile")
+
+# Frames kept per allocation
+N_FRAMES = 30
+
+# Statements reported per cell
+TOP_N = 15
+
+MB = 1024 ** 2
+
+
+def split_cells(source: str) -> List[Tuple[int, str, str]]:
+
+    """
+    Split a script into its #%% cells. Returns (first line number, title, code)
+    for each, where the title is the first comment in the cell.
+    """
+
+    lines = source.splitlines(keepends=True)
+    starts = [i for i, line in enumerate(lines) if line.startswith("#%%")]
+
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+
+    cells = []
+
+    for start, stop in zip(starts, starts[1:] + [len(lines)]):
+        code = "".join(lines[start:stop])
+        title = next(
+            (m.group(1).strip() for m in re.finditer(r"^#+(?:%%)?[ \t]*([^#\n]*\w[^\n]*)$", code, re.M)),
+            "")
+        cells.append((start + 1, title[:80], code))
+
+    return cells
+
+
+def stage_name(script: str) -> str:
+
+    """
+    A file name for a pipeline script, e.g. "match/3-matching.py" -> "match_3_matching".
+    """
+
+    return re.sub(r"\W+", "_", os.path.splitext(script.lower())[0]).strip("_")
+
+
+def run_profiled(task_name: str, script: str):
+
+    """
+    Run a pipeline script (a path relative to src, e.g. "match/3-matching.py")
+    cell by cell under tracemalloc, and write its memory reports.
+    """
+
+    module_name = script.lower().replace(".py", "").replace("/", ".")
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    stage = stage_name(script)
+
+    with open(path) as file:
+        cells = split_cells(file.read())
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+
+    cell_rows, allocation_rows, dataframe_rows, folded = [], [], [], {}
+
+    started = tracemalloc.is_tracing()
+    if not started:
+        tracemalloc.start(N_FRAMES)
+
+    try:
+        for i, (line, title, code) in enumerate(cells):
+            # Pad with newlines so tracebacks and allocations have the file's line numbers
+            compiled = compile("\n" * (line - 1) + code, path, "exec")
+
+            before = _snapshot()
+            tracemalloc.reset_peak()
+            start_time = time.perf_counter()
+
+            exec(compiled, module.__dict__)
+
+            seconds = time.perf_counter() - start_time
+            current, peak = tracemalloc.get_traced_memory()
+            diff = _snapshot().compare_to(before, "traceback")
+
+            cell = f"cell {i} (line {line})"
+
+            cell_rows.append({
+                "stage": task_name, "cell": i, "line": line, "title": title,
+                "seconds": round(seconds, 3),
+                "allocated_mb": round(sum(d.size_diff for d in diff) / MB, 2),
+                "current_mb": round(current / MB, 2),
+                "peak_mb": round(peak / MB, 2)
+            })
+
+            # Attribute each allocation to the script's statement that led to it
+            statements = {}
+            for stat in diff:
+                frames = _script_frames(stat.traceback, path)
+                lineno = frames[0].lineno if frames[0].filename == path else None
+                size, count = statements.get(lineno, (0, 0))
+                statements[lineno] = (size + stat.size_diff, count + stat.count_diff)
+
+                if stat.size_diff > 0:
+                    stack = ";".join([stage, f"{cell} {title}".replace(";", ",")] + [
+                        f"{os.path.basename(f.filename)}:{f.lineno}" for f in frames])
+                    folded[stack] = folded.get(stack, 0) + stat.size_diff
+
+            top = sorted(statements.items(), key=lambda item: -item[1][0])[:TOP_N]
+            for rank, (lineno, (size, count)) in enumerate(top):
+                allocation_rows.append({
+                    "cell": i, "rank": rank, "line": lineno,
+                    "statement": linecache.getline(path, lineno).strip() if lineno else "(outside the script)",
+                    "size_mb": round(size / MB, 3), "count": count
+                })
+
+            for name, value in list(module.__dict__.items()):
+                if isinstance(value, pd.DataFrame) and not name.startswith("_"):
+                    dataframe_rows.append({
+                        "cell": i, "variable": name, "rows": len(value),
+                        "memory_mb": round(value.memory_usage(deep=True).sum() / MB, 2)
+                    })
+
+            print(f"[memory] {cell}: {cell_rows[-1]['allocated_mb']:+.2f} MB, peak {cell_rows[-1]['peak_mb']:.2f} MB {title}")
+
+    finally:
+        if not started:
+            tracemalloc.stop()
+
+        _write_reports(stage, cell_rows, allocation_rows, dataframe_rows, folded)
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+
+    # Leave out the snapshots themselves
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__, all_frames=True),
+        tracemalloc.Filter(False, "<unknown>")])
+
+
+def _script_frames(traceback: tracemalloc.Traceback, path: str) -> list:
+
+    """
+    The frames of an allocation's traceback (oldest first), starting from the
+    script's outermost statement. Tracebacks cut short by N_FRAMES are kept whole.
+    """
+
+    frames = list(traceback)
+    start = next((j for j, f in enumerate(frames) if f.filename == path), 0)
+
+    return frames[start:]
+
+
+def _write_reports(stage: str, cell_rows: list, allocation_rows: list, dataframe_rows: list, folded: dict):
+    path = os.path.join(PROFILE_PATH, stage)
+
+    pd.DataFrame(cell_rows).to_csv(path + "_cells.csv", index=False)
+    pd.DataFrame(allocation_rows).convert_dtypes().to_csv(path + "_allocations.csv", index=False)
+    pd.DataFrame(dataframe_rows).to_csv(path + "_dataframes.csv", index=False)
+
+    with open(path + ".folded", "w") as file:
+        for stack, size in sorted(folded.items()):
+            file.write(f"{stack} {size}\n")
+
+    print(f"[memory] Wrote memory profile of {stage} to {PROFILE_PATH}")
@@ -4,8 +4,25 @@ This script calls all other scripts in order. You can step through it as needed.
 
 #%%
 import os
+import json
 import datetime
 import subprocess
+from dotenv import load_dotenv
+
+import sql_profiling
+from pipeline_profiling import run_profiled, stage_name
+
+load_dotenv()
+
+# Set WSB_PROFILE_MEMORY=1 to profile the memory of the Python stages (see pipeline_profiling.py)
+PROFILE_MEMORY = os.environ.get("WSB_PROFILE_MEMORY", "0") == "1"
+
+# One line per task: its timing, status and SQL totals
+LEDGER_PATH = os.path.join(os.environ["WSB_OUTPUT_PATH"], "run_ledger.jsonl")
+
+RUN_ID = datetime.datetime.now().isoformat(timespec="seconds")
+
+sql_profiling.install()
 
 def run_task(task_name: str, script: str):
 
@@ -15,6 +32,34 @@ def run_task(task_name: str, script: str):
     print(task_name)
     print("--------------------------------------\n")
 
+    sql_profiling.start_stage(stage_name(script))
+    status = "failed"
+
+    try:
+        _run_script(task_name, script)
+        status = "succeeded"
+
+    finally:
+        sql = sql_profiling.end_stage()
+        elapsed = (datetime.datetime.now() - start_time).total_seconds()
+
+        with open(LEDGER_PATH, "a") as file:
+            file.write(json.dumps({
+                "run_id":           RUN_ID,
+                "task":             task_name,
+                "script":           script,
+                "started_at":       start_time.isoformat(timespec="seconds"),
+                "elapsed_seconds":  round(elapsed, 1),
+                "status":           status,
+                "sql":              sql
+            }) + "\n")
+
+    print(f"SQL time: {sql['seconds'] / 60:.2f} minutes in {sql['statements']} statements")
+    print(f"Elapsed time: {elapsed / 60:.2f} minutes")
+
+
+def _run_script(task_name: str, script: str):
+
     if script.lower().endswith(".r"):
 
         output = subprocess.check_output(
@@ -24,6 +69,10 @@ def run_task(task_name: str, script: str):
 
         print(output.decode("UTF-8"))
 
+    elif script.lower().endswith(".py") and PROFILE_MEMORY:
+
+        run_profiled(task_name, script)
+
     elif script.lower().endswith(".py"):
 
         # Replace / with . because we're importing them as modules
@@ -32,8 +81,6 @@ def run_task(task_name: str, script: str):
     else:
         raise Exception("Unrecognized script format.")
 
-    print(f"Elapsed time: {(datetime.datetime.now() - start_time).total_seconds() / 60:.2f} minutes")
-
 
 #%% #####################################
 # Downloaders
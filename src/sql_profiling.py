@@ -0,0 +1,231 @@
+"""
+SQL instrumentation of the pipeline stages.
+
+install() adds SQLAlchemy event listeners to every engine, so the stages don't
+need to change how they connect. Between start_stage() and end_stage(), each
+statement's text, duration, rows and bytes sent are recorded for the stage.
+COPY loads, which bypass SQLAlchemy, are recorded with record().
+
+Writes to WSB_OUTPUT_PATH/sql_profile/:
+    <stage>.csv         - per distinct statement: calls, seconds, rows, bytes
+    slow_queries.jsonl  - every statement slower than WSB_SLOW_QUERY_SECONDS,
+                          with its EXPLAIN ANALYZE plan if it took longer than
+                          WSB_EXPLAIN_ANALYZE_SECONDS (not captured by default)
+"""
+
+import datetime
+import json
+import os
+import re
+import time
+from typing import Optional
+
+import pandas as pd
+import sqlalchemy as sa
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OUTPUT_PATH = os.environ["WSB_OUTPUT_PATH"]
+
+PROFILE_PATH = os.path.join(OUTPUT_PATH, "sql_profile")
+
+SLOW_QUERY_SECONDS = float(os.environ.get("WSB_SLOW_QUERY_SECONDS", "10"))
+
+# EXPLAIN ANALYZE runs each slow statement a second time, writes included
+# (rolled back to a savepoint), so it's opt-in: it doubles the cost of those
+# statements and holds their locks longer
+EXPLAIN_ANALYZE_SECONDS = (
+    float(os.environ["WSB_EXPLAIN_ANALYZE_SECONDS"])
+    if os.environ.get("WSB_EXPLAIN_ANALYZE_SECONDS") else None)
+
+# Statements are truncated to this many characters in the reports
+MAX_STATEMENT_LENGTH = 2000
+
+_installed = False
+_stage = None
+_records = []
+
+
+def install():
+
+    """
+    Listen to the statements of every SQLAlchemy engine. Safe to call twice.
+    """
+
+    global _installed
+
+    if not _installed:
+        sa.event.listen(sa.engine.Engine, "before_cursor_execute", _before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, "after_cursor_execute", _after_cursor_execute)
+        sa.event.listen(sa.engine.Engine, "handle_error", _handle_error)
+        _installed = True
+
+
+def start_stage(stage: str):
+    global _stage, _records
+
+    _stage = stage
+    _records = []
+
+
+def end_stage() -> dict:
+
+    """
+    Stop recording, write the stage's statement report, and return its totals
+    (for the run ledger).
+    """
+
+    global _stage, _records
+
+    stage, records = _stage, _records
+    _stage, _records = None, []
+
+    report = (pd.DataFrame(records, columns=["statement", "seconds", "rows", "bytes_sent"])
+        .astype({"seconds": float, "rows": "Int64", "bytes_sent": "int64"}))
+
+    if stage is not None and len(report) > 0:
+        os.makedirs(PROFILE_PATH, exist_ok=True)
+
+        (report
+            .groupby("statement")
+            .agg(
+                calls=("seconds", "size"),
+                seconds=("seconds", "sum"),
+                max_seconds=("seconds", "max"),
+                rows=("rows", "sum"),
+                bytes_sent=("bytes_sent", "sum"))
+            .sort_values("seconds", ascending=False)
+            .reset_index()
+            .to_csv(os.path.join(PROFILE_PATH, f"{stage}.csv"), index=False))
+
+    return {
+        "statements":   len(report),
+        "seconds":      round(float(report["seconds"].sum()), 3),
+        "rows":         int(report["rows"].sum()),
+        "bytes_sent":   int(report["bytes_sent"].sum()),
+        "slow":         int((report["seconds"] >= SLOW_QUERY_SECONDS).sum())
+    }
+
+
+def record(statement: str, seconds: float, rows: Optional[int] = None, bytes_sent: int = 0):
+
+    """
+    Record a statement that didn't go through SQLAlchemy (e.g. a COPY).
+    """
+
+    if _stage is None:
+        return
+
+    statement = _normalize(statement)
+
+    _records.append({
+        "statement": statement, "seconds": seconds, "rows": rows, "bytes_sent": bytes_sent})
+
+    if seconds >= SLOW_QUERY_SECONDS:
+        _log_slow_query(statement, seconds, rows, None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start_time"].pop()
+
+    if _stage is None:
+        return
+
+    rows = cursor.rowcount if cursor.rowcount >= 0 else None
+    bytes_sent = len(statement.encode()) + _parameter_bytes(parameters)
+
+    plan = None
+    if EXPLAIN_ANALYZE_SECONDS is not None and seconds >= EXPLAIN_ANALYZE_SECONDS and not executemany:
+        plan = _explain_analyze(conn, statement, parameters)
+
+    _records.append({
+        "statement": _normalize(statement), "seconds": seconds, "rows": rows, "bytes_sent": bytes_sent})
+
+    if seconds >= SLOW_QUERY_SECONDS or plan is not None:
+        _log_slow_query(_normalize(statement), seconds, rows, plan)
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("query_start_time") if context.connection is not None else None
+
+    if starts:
+        starts.pop()
+
+
+def _explain_analyze(conn, statement, parameters) -> Optional[str]:
+
+    """
+    EXPLAIN ANALYZE the statement inside a savepoint that is rolled back, so
+    writes aren't applied twice. The statement really runs again, so this
+    doubles its cost and holds its locks longer (its transaction can't end
+    until the second run has finished). Returns None if it can't be
+    explained (e.g. DDL, or an autocommit connection).
+    """
+
+    if conn.dialect.name != "postgresql" or getattr(conn.connection, "autocommit", False):
+        return None
+
+    cursor = conn.connection.cursor()
+
+    try:
+        cursor.execute("SAVEPOINT wsb_explain;")
+    except Exception:
+        cursor.close()
+        return None
+
+    try:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    except Exception:
+        plan = None
+
+    try:
+        cursor.execute("ROLLBACK TO SAVEPOINT wsb_explain;")
+        cursor.execute("RELEASE SAVEPOINT wsb_explain;")
+    finally:
+        cursor.close()
+
+    return plan
+
+
+def _log_slow_query(statement: str, seconds: float, rows: Optional[int], plan: Optional[str]):
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+
+    with open(os.path.join(PROFILE_PATH, "slow_queries.jsonl"), "a") as file:
+        file.write(json.dumps({
+            "logged_at":    datetime.datetime.now().isoformat(timespec="seconds"),
+            "stage":        _stage,
+            "seconds":      round(seconds, 3),
+            "rows":         rows,
+            "statement":    statement,
+            "plan":         plan
+        }) + "\n")
+
+    print(f"[sql] Slow query ({seconds:.1f} s) in {_stage}: {statement[:100]}")
+
+
+def _normalize(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()[:MAX_STATEMENT_LENGTH]
+
+
+def _parameter_bytes(parameters) -> int:
+
+    """
+    Approximate size of the bound parameters, as UTF-8 text.
+    """
+
+    if parameters is None:
+        return 0
+    if isinstance(parameters, dict):
+        return sum(len(str(v).encode()) for v in parameters.values())
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return sum(_parameter_bytes(p) for p in parameters)
+    if isinstance(parameters, (list, tuple)):
+        return sum(len(str(v).encode()) for v in parameters)
+
+    return len(str(parameters).encode())
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from match.assignment import _solve, assign_best_matches
+
+
+# The best pair (m1, c1) blocks m2: greedy makes one match, the optimum two
+MATCHES = pd.DataFrame({
+    "master_sk":                [1, 1, 2, 3],
+    "candidate_contributor_sk": [1, 2, 1, 3],
+    "overall_rank":             [1, 2, 3, 1]})
+
+
+def test_solve_maximizes_the_number_of_matches():
+    edges = np.array([10, 11, 12])
+
+    selected = _solve(edges, np.array([0, 0, 1]), np.array([0, 1, 0]), np.array([1.0, 2.0, 3.0]))
+
+    assert sorted(selected.tolist()) == [11, 12]
+
+
+def test_solve_minimizes_the_total_rank():
+    edges = np.array([0, 1, 2, 3])
+
+    # Pairs (row, col): (0, 0), (0, 1), (1, 0), (1, 1)
+    selected = _solve(edges, np.array([0, 0, 1, 1]), np.array([0, 1, 0, 1]), np.array([1.0, 2.0, 4.0, 3.0]))
+
+    assert sorted(selected.tolist()) == [0, 3]
+
+
+def test_solve_with_sparse_codes():
+    edges = np.array([0, 1])
+
+    selected = _solve(edges, np.array([7, 7]), np.array([40, 3]), np.array([5.0, 2.0]))
+
+    assert selected.tolist() == [1]
+
+
+def test_assign_best_matches():
+    selected = assign_best_matches(MATCHES, workers=1)
+
+    assert selected.tolist() == [False, True, True, True]
+
+
+def test_huge_components_fall_back_to_greedy():
+    selected = assign_best_matches(MATCHES, max_component_size=3, workers=1)
+
+    assert selected.tolist() == [True, False, False, True]
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from export.change_sets import diff_inputs
+
+
+def test_diff_inputs():
+    previous = pd.DataFrame({
+        "pwsid":        ["A", "B", "C"],
+        "input_hash":   ["1", "2", "3"]})
+
+    current = pd.DataFrame({
+        "pwsid":        ["B", "C", "D"],
+        "input_hash":   ["2", "30", "4"]})
+
+    changes = diff_inputs(previous, current).sort_values("pwsid")
+
+    assert changes["pwsid"].tolist() == ["A", "C", "D"]
+    assert changes["change"].tolist() == ["removed", "changed", "added"]
+
+
+def test_no_changes():
+    hashes = pd.DataFrame({"pwsid": ["A", "B"], "input_hash": ["1", "2"]})
+
+    assert len(diff_inputs(hashes, hashes.copy())) == 0
+
+
+def test_without_previous_hashes_everything_is_added():
+    current = pd.DataFrame({"pwsid": ["A", "B"], "input_hash": ["1", "2"]})
+
+    changes = diff_inputs(None, current)
+
+    assert changes["pwsid"].tolist() == ["A", "B"]
+    assert (changes["change"] == "added").all()
@@ -0,0 +1,53 @@
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from model.coastline import WaterIndex, _polygons, clip_to_land
+
+
+def _water_index(tmp_path, water) -> WaterIndex:
+    path = str(tmp_path / "water.gpkg")
+    gpd.GeoDataFrame(geometry=water, crs="EPSG:4326").to_file(path, engine="pyogrio")
+
+    return WaterIndex([path], crs="EPSG:4326")
+
+
+def test_polygons_explodes_nested_collections():
+    nested = shapely.GeometryCollection([
+        shapely.MultiPolygon([shapely.box(0, 0, 1, 1), shapely.box(2, 2, 3, 3)]),
+        shapely.LineString([(0, 0), (1, 1)])])
+
+    polygons = _polygons(np.array([nested, shapely.box(5, 5, 6, 6), shapely.Polygon()], dtype=object))
+
+    assert [p.bounds for p in polygons] == [(0, 0, 1, 1), (2, 2, 3, 3), (5, 5, 6, 6)]
+
+
+def test_clip_to_land(tmp_path):
+    # Water east of x = 1, with a detailed shore so it gets diced
+    shore = [(1, y / 100) for y in range(0, 1001)]
+    index = _water_index(tmp_path, [shapely.Polygon(shore + [(10, 10), (10, 0)])])
+
+    assert len(index.pieces) > 1
+
+    circles = gpd.GeoSeries([
+        shapely.box(0, 0, 2, 2),        # half over water
+        shapely.box(-2, 0, -1, 1),      # on land
+        shapely.box(3, 3, 4, 4)         # all water: kept whole
+    ], crs="EPSG:4326")
+
+    clipped = clip_to_land(circles, index, workers=1)
+
+    assert clipped.iloc[0].equals(shapely.box(0, 0, 1, 2))
+    assert clipped.iloc[1].equals(circles.iloc[1])
+    assert clipped.iloc[2].equals(circles.iloc[2])
+
+
+def test_pickle_rebuilds_the_tree(tmp_path):
+    index = _water_index(tmp_path, [shapely.box(1, 0, 10, 10)])
+
+    loaded = pickle.loads(pickle.dumps(index))
+
+    assert loaded.fingerprint == index.fingerprint
+    assert loaded.tree.query(shapely.box(0, 0, 2, 2), predicate="intersects").tolist() == [0]
@@ -0,0 +1,87 @@
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+import match.features as features
+from match.features import diff_features, refresh_features
+
+
+CACHED = pd.DataFrame({
+    "contributor_id":   ["sdwis.A", "sdwis.B", "sdwis.C", "tiger.1"],
+    "source_system":    ["sdwis", "sdwis", "sdwis", "tiger"],
+    "input_hash":       ["a", "b", "c", "t"]})
+
+
+def test_diff_features():
+    hashes = pd.DataFrame({
+        "contributor_id":   ["sdwis.A", "sdwis.B", "sdwis.D", "tiger.1"],
+        "input_hash":       ["a", "b2", "d", "t"]})
+
+    changed, removed = diff_features(CACHED, hashes)
+
+    assert sorted(changed) == ["sdwis.B", "sdwis.D"]
+    assert removed.tolist() == ["sdwis.C"]
+
+
+def test_diff_features_of_some_systems():
+    # Only SDWIS was checked, so the cached TIGER rows aren't removed
+    hashes = pd.DataFrame({"contributor_id": ["sdwis.A", "sdwis.B"], "input_hash": ["a", "b"]})
+
+    changed, removed = diff_features(CACHED, hashes, ["sdwis"])
+
+    assert len(changed) == 0
+    assert removed.tolist() == ["sdwis.C"]
+
+
+def test_diff_features_without_a_cache():
+    changed, removed = diff_features(None, CACHED[["contributor_id", "input_hash"]])
+
+    assert changed.tolist() == CACHED["contributor_id"].tolist()
+    assert len(removed) == 0
+
+
+def _contributors(ids: list) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({
+        "contributor_id":   ids,
+        "source_system":    "sdwis",
+        "master_key":       [i.split(".")[1] for i in ids],
+        "pwsid":            [i.split(".")[1] for i in ids],
+        "name":             "CITY OF AUSTIN",
+        "address_line_1":   "1 MAIN STREET",
+        "input_hash":       [i + "#1" for i in ids],
+        "geometry":         shapely.points([[-97.7, 30.3]] * len(ids))
+    }, crs="EPSG:4326")
+
+
+def test_refresh_features(tmp_path, monkeypatch):
+    monkeypatch.setattr(features, "FEATURES_PATH", str(tmp_path / "contributor_features.parquet"))
+
+    contributors = _contributors(["sdwis.A", "sdwis.B"])
+    fetched = []
+
+    def read_sql(query, conn, params=None):
+        return pd.DataFrame(contributors[["contributor_id", "input_hash"]])
+
+    def from_postgis(query, conn, geom_col=None, params=None):
+        fetched.append(sorted(params["ids"]))
+        return contributors.loc[contributors["contributor_id"].isin(params["ids"])]
+
+    monkeypatch.setattr(pd, "read_sql", read_sql)
+    monkeypatch.setattr(gpd.GeoDataFrame, "from_postgis", staticmethod(from_postgis))
+
+    # First run: everything is computed
+    result = refresh_features(None)
+    assert sorted(result["contributor_id"]) == ["sdwis.A", "sdwis.B"]
+    assert result["name_tkn"].tolist() == ["AUSTIN", "AUSTIN"]
+
+    # One changed: only that one is fetched
+    contributors.loc[1, "input_hash"] = "changed"
+    result = refresh_features(None)
+    assert fetched[-1] == ["sdwis.B"]
+    assert result.set_index("contributor_id").loc["sdwis.B", "input_hash"] == "changed"
+
+    # One removed: nothing is fetched
+    contributors = contributors.iloc[[0]]
+    result = refresh_features(None)
+    assert len(fetched) == 2
+    assert result["contributor_id"].tolist() == ["sdwis.A"]
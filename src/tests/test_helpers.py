@@ -0,0 +1,80 @@
+import io
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import sqlalchemy as sa
+from openpyxl import load_workbook
+
+from match.helpers import _to_copy_format, stream_to_file
+
+
+def test_to_copy_format_integers_with_nulls():
+    df = pd.DataFrame({
+        "population":   [10.0, np.nan, 3.0],
+        "share":        [0.5, np.nan, 1.0],
+        "name":         ["a", None, "c"]})
+
+    out = _to_copy_format(df)
+
+    assert out["population"].dtype == "Int64"
+    assert out["share"].dtype == "float64"
+
+    buffer = io.StringIO()
+    out.to_csv(buffer, index=False, header=False)
+    assert buffer.getvalue().splitlines() == ["10,0.5,a", ",,", "3,1.0,c"]
+
+
+def test_to_copy_format_geometry_as_ewkb():
+    gdf = gpd.GeoDataFrame({"id": [1]}, geometry=[shapely.Point(1, 2)], crs="EPSG:4326")
+
+    out = _to_copy_format(gdf)
+
+    geom = shapely.from_wkb(out["geometry"].iloc[0])
+    assert geom.equals(shapely.Point(1, 2))
+    assert shapely.get_srid(geom) == 4326
+
+    # The input keeps its geometry
+    assert isinstance(gdf["geometry"].dtype, gpd.array.GeometryDtype)
+
+
+def _report_engine(n: int):
+    engine = sa.create_engine("sqlite://")
+
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE matches (pwsid TEXT, n_matches INTEGER)"))
+        conn.execute(
+            sa.text("INSERT INTO matches VALUES (:pwsid, :n)"),
+            [{"pwsid": f"TX{i:05}", "n": i} for i in range(n)])
+
+    return engine
+
+
+def test_stream_to_file_csv(tmp_path):
+    engine = _report_engine(25)
+    path = str(tmp_path / "report.csv")
+
+    rows = stream_to_file(
+        engine, "SELECT pwsid, n_matches FROM matches WHERE n_matches >= :min ORDER BY pwsid",
+        path, params={"min": 5}, chunk_size=7)
+
+    df = pd.read_csv(path, dtype={"pwsid": str})
+
+    assert rows == 20
+    assert df.columns.tolist() == ["pwsid", "n_matches"]
+    assert df["pwsid"].tolist() == [f"TX{i:05}" for i in range(5, 25)]
+
+
+def test_stream_to_file_xlsx(tmp_path):
+    engine = _report_engine(12)
+    path = str(tmp_path / "report.xlsx")
+
+    rows = stream_to_file(engine, "SELECT pwsid, n_matches FROM matches ORDER BY pwsid", path, chunk_size=5)
+
+    sheet = load_workbook(path, read_only=True).active
+    values = [list(row) for row in sheet.iter_rows(values_only=True)]
+
+    assert rows == 12
+    assert values[0] == ["pwsid", "n_matches"]
+    assert values[1:] == [[f"TX{i:05}", i] for i in range(12)]
@@ -0,0 +1,55 @@
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from export.lookup import ServiceAreaLookup
+from export.writers import write_geoparquet
+
+
+# A Tier 3 circle over a Tier 1 boundary, and a small Tier 2 boundary inside a big Tier 2 one
+LAYER = gpd.GeoDataFrame({
+    "pwsid":        ["T3", "T1", "T2_BIG", "T2_SMALL", "NONE"],
+    "tier":         pd.array([3, 1, 2, 2, None], dtype="Int64"),
+    "state_code":   ["TX", "TX", "NM", "NM", "TX"],
+    "geometry":     [
+        shapely.box(0, 0, 2, 2), shapely.box(1, 1, 3, 3),
+        shapely.box(10, 10, 14, 14), shapely.box(11, 11, 12, 12),
+        shapely.Polygon()]
+}, crs="EPSG:4326")
+
+
+def test_lowest_tier_first():
+    matches = ServiceAreaLookup(LAYER).lookup([1.5, 0.5], [1.5, 0.5], all_matches=True)
+
+    assert matches[["point_pos", "pwsid", "match_rank"]].values.tolist() == [
+        [0, "T1", 0], [0, "T3", 1], [1, "T3", 0]]
+
+
+def test_smallest_area_within_a_tier():
+    matches = ServiceAreaLookup(LAYER).lookup([11.5, 13], [11.5, 13])
+
+    assert matches[["point_pos", "pwsid", "tier"]].values.tolist() == [[0, "T2_SMALL", 2], [1, "T2_BIG", 2]]
+
+
+def test_unmatched_points_are_left_out():
+    matches = ServiceAreaLookup(LAYER).lookup([50, 1.5], [50, 1.5])
+
+    assert matches["point_pos"].tolist() == [1]
+
+
+def test_load_or_build_reuses_the_saved_index(tmp_path, capsys):
+    layer_path = str(tmp_path / "temm.parquet")
+    index_path = str(tmp_path / "temm_lookup_index.pkl")
+
+    write_geoparquet(LAYER, layer_path)
+    ServiceAreaLookup.load_or_build(layer_path, index_path)
+
+    loaded = ServiceAreaLookup.load_or_build(layer_path, index_path)
+
+    assert "Loaded lookup index from disk." in capsys.readouterr().out
+    assert loaded.lookup([1.5], [1.5])["pwsid"].tolist() == ["T1"]
+
+    # A new layer is indexed again
+    write_geoparquet(LAYER.iloc[:1], layer_path)
+
+    assert ServiceAreaLookup.load_or_build(layer_path, index_path).lookup([1.5], [1.5])["pwsid"].tolist() == ["T3"]
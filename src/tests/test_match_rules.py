@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from match.match_rules import ATTRIBUTE_RULES, RULE_BITS, SPATIAL_RULES, rule_labels, rules_involving
+from match.schema import SCHEMA
+
+
+def _names(rules) -> list:
+    attribute_rules, spatial_rules = rules
+    return sorted(r.name for r in attribute_rules + spatial_rules)
+
+
+def test_rules_involving_one_system():
+    assert _names(rules_involving(["ucmr"])) == ["ucmr_spatial"]
+
+    assert _names(rules_involving(["mhp"])) == ["mhp state+address", "state+mhp_name", "state+name_mhp"]
+
+
+def test_rules_involving_the_candidates():
+    # Every TIGER rule, attribute and spatial
+    assert _names(rules_involving(["tiger"])) == [
+        "spatial", "state+city_served", "state+name_tiger", "ucmr_spatial"]
+
+
+def test_rules_involving_every_system():
+    systems = {s for r in ATTRIBUTE_RULES + SPATIAL_RULES for s in r.source_systems}
+
+    attribute_rules, spatial_rules = rules_involving(systems)
+
+    assert attribute_rules == ATTRIBUTE_RULES and spatial_rules == SPATIAL_RULES
+    assert rules_involving(["labeled"]) == ([], [])
+
+
+def test_every_rule_has_its_own_bit():
+    assert {r.name for r in ATTRIBUTE_RULES + SPATIAL_RULES} <= set(RULE_BITS)
+
+    bits = list(RULE_BITS.values())
+    assert all(b > 0 and b & (b - 1) == 0 for b in bits)
+    assert len(set(bits)) == len(bits)
+
+    # The OR of every bit fits the stored dtype
+    assert sum(bits) <= np.iinfo(SCHEMA["match_rule"]).max
+
+
+def test_rule_labels():
+    masks = pd.Series([
+        RULE_BITS["state+name_tiger"] | RULE_BITS["spatial"],
+        RULE_BITS["ucmr_spatial"],
+        RULE_BITS["state+name_tiger"] | RULE_BITS["spatial"],
+        0])
+
+    assert rule_labels(masks).tolist() == ["state+name_tiger,spatial", "ucmr_spatial", "state+name_tiger,spatial", ""]
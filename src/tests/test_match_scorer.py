@@ -0,0 +1,27 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from match.match_scorer import dwithin, labeled_geometries
+
+
+def test_labeled_geometries_are_unioned_per_pwsid():
+    labeled = gpd.GeoDataFrame({
+        "pwsid":    ["A", "B", "A"],
+        "geometry": [shapely.box(0, 0, 1, 1), shapely.box(5, 5, 6, 6), shapely.box(10, 0, 11, 1)]})
+
+    geoms = labeled_geometries(labeled)
+
+    assert geoms.index.tolist() == ["A", "B"]
+    assert geoms["A"].equals(shapely.union(shapely.box(0, 0, 1, 1), shapely.box(10, 0, 11, 1)))
+
+
+def test_dwithin_matches_the_exact_distance():
+    rng = np.random.default_rng(0)
+
+    a = shapely.buffer(shapely.points(rng.uniform(0, 100, (500, 2))), rng.uniform(0, 5, 500))
+    x = np.sort(rng.uniform(0, 100, (2, 500)), axis=0)
+    y = np.sort(rng.uniform(0, 100, (2, 500)), axis=0)
+    b = shapely.box(x[0], y[0], x[1], y[1])
+
+    assert (dwithin(a, b, 10) == (shapely.distance(a, b) <= 10)).all()
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from match.name_search import NameSearchIndex
+
+
+SYSTEMS = pd.DataFrame({
+    "pwsid":        ["TX0000001", "TX0000002", "TX0000003", "NM0000001", "TX0000004"],
+    "state":        ["TX", "TX", "TX", "NM", "TX"],
+    "name":         ["CITY OF AUSTIN", "AUSTINTOWN WSC", "SPRING VALLEY MUD", "AUSTIN MUTUAL", "SPRINGTOWN WATER"],
+    "city_served":  ["AUSTIN", None, "HOUSTON", "AUSTIN", "SPRINGTOWN"]})
+
+
+def test_prefix_matches_shortest_term_first():
+    results = NameSearchIndex(SYSTEMS).search("AUST", fuzzy=False)
+
+    # The exact "AUSTIN" terms come before "AUSTINTOWN"
+    assert results["pwsid"].tolist() == ["TX0000001", "NM0000001", "TX0000002"]
+    assert (results["score"] == 1.0).all()
+
+
+def test_prefix_search_by_state():
+    results = NameSearchIndex(SYSTEMS).search("austin", state="nm", fuzzy=False)
+
+    assert results["pwsid"].tolist() == ["NM0000001"]
+
+
+def test_fuzzy_matches_come_after_prefix_matches():
+    results = NameSearchIndex(SYSTEMS).search("SPRING VALEY", min_similarity=0.5)
+
+    # No prefix match; the one-typo name scores best
+    assert results["pwsid"].iloc[0] == "TX0000003"
+    assert results["score"].iloc[0] == 1 - 1 / len("SPRING VALEY")
+    assert results["score"].is_monotonic_decreasing
+
+
+def test_prefix_matches_then_fuzzy_matches():
+    results = NameSearchIndex(SYSTEMS).search("AUSTINT", min_similarity=0.8)
+
+    assert results["pwsid"].tolist() == ["TX0000002", "TX0000001", "NM0000001"]
+    assert results["score"].tolist() == [1.0, 1 - 1 / 7, 1 - 1 / 7]
+
+
+def test_typo():
+    results = NameSearchIndex(SYSTEMS).search("SPRINGTOWM", min_similarity=0.8)
+
+    assert results["pwsid"].tolist() == ["TX0000004"]
+    assert results["score"].iloc[0] == 0.9
+
+
+def test_empty_query():
+    assert len(NameSearchIndex(SYSTEMS).search("  ")) == 0
@@ -0,0 +1,53 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from export.optimize import _optimize, optimize_geometries, parse_tolerances
+
+
+# A square with an almost collinear extra vertex on its bottom edge
+SQUARE = shapely.Polygon([(0, 0), (0.5, 0.0000001), (1, 0), (1, 1), (0, 1)])
+
+# Smaller than the precision grid
+TINY = shapely.box(0.3, 0.3, 0.3000001, 0.3000001)
+
+
+def test_simplifies_and_snaps():
+    result = _optimize((np.array([SQUARE], dtype=object), np.array([0.001]), 0.01))
+
+    assert result[0].equals(shapely.box(0, 0, 1, 1))
+
+
+def test_zero_tolerance_is_not_simplified():
+    result = _optimize((np.array([SQUARE], dtype=object), np.array([0.0]), 0.0))
+
+    assert result[0] is SQUARE
+
+
+def test_collapsed_geometries_are_kept():
+    geoms = np.array([TINY, SQUARE], dtype=object)
+
+    result = _optimize((geoms, np.array([0.0, 0.0]), 0.001))
+
+    assert result[0].equals(TINY)
+    assert result[1].equals(shapely.Polygon([(0, 0), (0.5, 0), (1, 0), (1, 1), (0, 1)]))
+
+
+def test_optimize_geometries_report():
+    gdf = gpd.GeoDataFrame({
+        "tier":         [1, 3, None],
+        "state_code":   ["TX", "TX", "NM"],
+        "geometry":     [SQUARE, TINY, SQUARE]
+    }, crs="EPSG:4326")
+
+    optimized, report = optimize_geometries(gdf, tolerances={1: 0.001}, grid_size=0.01, workers=1)
+
+    assert optimized.geometry.iloc[0].equals(shapely.box(0, 0, 1, 1))
+    assert optimized.geometry.iloc[1].equals(TINY)
+    assert report["vertices_before"].sum() == 6 + 5 + 6
+    # The untiered square is snapped but not simplified
+    assert report["vertices_after"].sum() == 5 + 5 + 6
+
+
+def test_parse_tolerances():
+    assert parse_tolerances("1:0.00001, 3:0.0001,") == {1: 0.00001, 3: 0.0001}
@@ -0,0 +1,88 @@
+import geopandas as gpd
+import shapely
+
+import pandas as pd
+
+from export.overlaps import find_overlaps, trim_neighbors, trim_overlaps
+
+
+def _layer(tiers, boxes) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({
+        "pwsid":        [f"TX{i}" for i in range(len(tiers))],
+        "tier":         tiers,
+        "state_code":   "TX",
+        "geometry":     [shapely.box(*b) for b in boxes]
+    }, crs="EPSG:4326")
+
+
+# Two 0.01 degree squares overlapping by half, the Tier 3 one listed first
+SQUARES = _layer([3, 1], [(-99.995, 30, -99.985, 30.01), (-100, 30, -99.99, 30.01)])
+
+
+def test_find_overlaps_orders_pairs_by_tier():
+    overlaps = find_overlaps(SQUARES, workers=1)
+
+    assert len(overlaps) == 1
+
+    pair = overlaps.iloc[0]
+    assert (pair["pwsid_a"], pair["tier_a"], pair["pwsid_b"], pair["tier_b"]) == ("TX1", 1, "TX0", 3)
+    assert abs(pair["share_a"] - 0.5) < 0.01 and abs(pair["share_b"] - 0.5) < 0.01
+
+    # About 480 m x 1.1 km
+    assert 4e5 < pair["overlap_area"] < 6e5
+
+
+def test_find_overlaps_ignores_shared_borders():
+    touching = _layer([1, 3], [(-100, 30, -99.99, 30.01), (-99.99, 30, -99.98, 30.01)])
+
+    assert len(find_overlaps(touching, workers=1)) == 0
+
+
+def test_trim_overlaps_cuts_the_lower_tier():
+    trimmed = trim_overlaps(SQUARES, find_overlaps(SQUARES, workers=1), workers=1)
+
+    assert trimmed.geometry.iloc[0].equals(shapely.box(-99.99, 30, -99.985, 30.01))
+    assert trimmed.geometry.iloc[1].equals(SQUARES.geometry.iloc[1])
+
+
+def test_trim_overlaps_keeps_covered_geometries_whole():
+    inside = _layer([1, 3], [(-100, 30, -99.99, 30.01), (-99.998, 30.002, -99.992, 30.008)])
+
+    trimmed = trim_overlaps(inside, find_overlaps(inside, workers=1), workers=1)
+
+    assert trimmed.geometry.iloc[1].equals(inside.geometry.iloc[1])
+
+
+def test_trim_overlaps_leaves_same_tier_overlaps():
+    same_tier = SQUARES.assign(tier=[1, 1])
+
+    trimmed = trim_overlaps(same_tier, find_overlaps(same_tier, workers=1), workers=1)
+
+    assert trimmed.geometry.equals(same_tier.geometry)
+
+
+def test_trim_neighbors_of_a_changed_system():
+    changes = pd.DataFrame({"pwsid": ["TX1"], "change": ["changed"]})
+
+    neighbors = trim_neighbors(SQUARES, find_overlaps(SQUARES, workers=1), changes, None)
+
+    assert neighbors.tolist() == ["TX0"]
+
+
+def test_trim_neighbors_of_a_removed_system():
+    # TX1 used to overlap TX0, and is now gone
+    current = SQUARES.iloc[[0]]
+    changes = pd.DataFrame({"pwsid": ["TX1"], "change": ["removed"]})
+
+    neighbors = trim_neighbors(current, find_overlaps(current, workers=1), changes, SQUARES)
+
+    assert neighbors.tolist() == ["TX0"]
+
+
+def test_trim_neighbors_ignores_higher_tiers():
+    # A changed Tier 3 system doesn't re-trim the Tier 1 system it overlaps
+    changes = pd.DataFrame({"pwsid": ["TX0"], "change": ["changed"]})
+
+    neighbors = trim_neighbors(SQUARES, find_overlaps(SQUARES, workers=1), changes, SQUARES)
+
+    assert len(neighbors) == 0
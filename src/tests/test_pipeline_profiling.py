@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import pipeline_profiling
+from pipeline_profiling import run_profiled, split_cells, stage_name
+
+
+SCRIPT = """\
+import pandas as pd
+
+#%%
+# Load the systems
+df = pd.DataFrame({"pwsid": ["TX1"] * 1000})
+
+#%% Write the output
+#
+n = len(df)
+"""
+
+
+def test_split_cells():
+    cells = split_cells(SCRIPT)
+
+    assert [(line, title) for line, title, _ in cells] == [
+        (1, ""), (3, "Load the systems"), (7, "Write the output")]
+    assert "".join(code for _, _, code in cells) == SCRIPT
+
+
+def test_split_cells_starting_with_a_cell():
+    assert [line for line, _, _ in split_cells("#%%\nx = 1\n")] == [1]
+
+
+def test_stage_name():
+    assert stage_name("match/3-matching.py") == "match_3_matching"
+    assert stage_name("combine_tiers.py") == "combine_tiers"
+
+
+@pytest.fixture(autouse=True)
+def profile_path(tmp_path, monkeypatch):
+    # Shallow tracebacks keep the snapshot filtering fast
+    monkeypatch.setattr(pipeline_profiling, "N_FRAMES", 5)
+    monkeypatch.setattr(pipeline_profiling, "PROFILE_PATH", str(tmp_path / "memory_profile"))
+
+
+def test_run_profiled(tmp_path):
+
+    script = tmp_path / "stage.py"
+    script.write_text(SCRIPT)
+
+    run_profiled("stage", str(script))
+
+    stage = stage_name(str(script))
+    cells = pd.read_csv(tmp_path / "memory_profile" / f"{stage}_cells.csv")
+    dataframes = pd.read_csv(tmp_path / "memory_profile" / f"{stage}_dataframes.csv")
+
+    assert cells["line"].tolist() == [1, 3, 7]
+    assert dataframes[["cell", "variable", "rows"]].values.tolist() == [[1, "df", 1000], [2, "df", 1000]]
+
+
+def test_run_profiled_writes_reports_on_failure(tmp_path):
+
+    script = tmp_path / "failing.py"
+    script.write_text("x = 1\n#%%\nraise ValueError('bad input')\n")
+
+    with pytest.raises(ValueError):
+        run_profiled("failing", str(script))
+
+    cells = pd.read_csv(tmp_path / "memory_profile" / f"{stage_name(str(script))}_cells.csv")
+    assert cells["line"].tolist() == [1]
@@ -0,0 +1,48 @@
+import pandas as pd
+
+from match.ranking import rank_match_rules, rank_matches, select_best_matches
+
+
+def test_rank_match_rules_by_share_of_good_matches():
+    matches = pd.DataFrame({
+        "master_key":               ["A", "A", "B", "C"],
+        "candidate_contributor_id": ["t1", "t2", "t1", "t3"],
+        "match_rule":               [1, 2, 1, 3]})
+
+    scores = pd.Series(
+        [True, False, False, True],
+        index=pd.MultiIndex.from_tuples([("A", "t1"), ("A", "t2"), ("B", "t1"), ("C", "t3")]))
+
+    ranks = rank_match_rules(matches, scores)
+
+    assert ranks.index.tolist() == [3, 1, 2]
+    assert ranks["score"].tolist() == [1.0, 0.5, 0.0]
+    assert ranks["match_rule_rank"].tolist() == [0, 1, 2]
+
+
+def test_rank_matches():
+    matches = pd.DataFrame({
+        "master_sk":        [1, 1, 2, 2],
+        "name_match":       [False, True, True, True],
+        "match_rule_rank":  [0, 1, 2, 0],
+        "pop_diff":         [0, 50, 10, 10]})
+
+    ranked = rank_matches(matches)
+
+    # name_match first (True is better), then the lowest match_rule_rank
+    assert ranked[["master_sk", "match_rule_rank"]].values.tolist() == [[2, 0], [1, 1], [2, 2], [1, 0]]
+    assert ranked["overall_rank"].tolist() == [0, 1, 2, 3]
+    assert ranked["master_group_ranking"].tolist() == [1, 1, 2, 2]
+
+
+def test_select_best_matches():
+    # Both PWS's best candidate is 1, and it goes to the better-ranked PWS 1.
+    # Selecting within candidates first leaves PWS 2 its second choice;
+    # selecting within PWS's first leaves it nothing.
+    matches = pd.DataFrame({
+        "master_sk":                [1, 2, 2],
+        "candidate_contributor_sk": [1, 1, 2],
+        "overall_rank":             [0, 1, 2]})
+
+    assert select_best_matches(matches).tolist() == [True, False, True]
+    assert select_best_matches(matches, candidate_first=False).tolist() == [True, False, False]
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from match.rule_engine import HashIndex, MatchRule, MatchRuleEngine, RuleFilter
+
+
+def _pairs(left: pd.DataFrame, left_pos: np.ndarray, ids: np.ndarray) -> list:
+    return sorted(zip(left["name"].to_numpy()[left_pos], ids))
+
+
+def test_probe_returns_every_row_in_the_bucket():
+    right = pd.DataFrame({
+        "contributor_id":   ["r1", "r2", "r3", "r4"],
+        "state":            ["TX", "TX", "NM", "TX"]})
+
+    left = pd.DataFrame({
+        "name":             ["a", "b", "c"],
+        "state":            ["NM", "CA", "TX"]})
+
+    left_pos, ids = HashIndex(right, ("state",)).probe(left, ("state",))
+
+    assert _pairs(left, left_pos, ids) == [("a", "r3"), ("c", "r1"), ("c", "r2"), ("c", "r4")]
+
+
+def test_probe_on_several_keys():
+    right = pd.DataFrame({
+        "contributor_id":   ["r1", "r2", "r3"],
+        "state":            ["TX", "TX", "NM"],
+        "name_tkn":         ["AUSTIN", "DALLAS", "AUSTIN"]})
+
+    left = pd.DataFrame({
+        "name":             ["a", "b"],
+        "state":            ["TX", "NM"],
+        "name_tkn":         ["AUSTIN", "DALLAS"]})
+
+    left_pos, ids = HashIndex(right, ("state", "name_tkn")).probe(left, ("state", "name_tkn"))
+
+    assert _pairs(left, left_pos, ids) == [("a", "r1")]
+
+
+def test_null_keys_never_match():
+    right = pd.DataFrame({
+        "contributor_id":   ["r1", "r2"],
+        "state":            ["TX", None]})
+
+    left = pd.DataFrame({
+        "name":             ["a", "b"],
+        "state":            [None, "TX"]})
+
+    left_pos, ids = HashIndex(right, ("state",)).probe(left, ("state",))
+
+    assert _pairs(left, left_pos, ids) == [("b", "r1")]
+
+
+def test_probe_without_matches():
+    right = pd.DataFrame({"contributor_id": ["r1"], "state": ["TX"]})
+    left = pd.DataFrame({"name": ["a"], "state": ["CA"]})
+
+    left_pos, ids = HashIndex(right, ("state",)).probe(left, ("state",))
+
+    assert len(left_pos) == 0 and len(ids) == 0
+
+
+def test_engine_reports_surrogate_keys():
+    tokens = pd.DataFrame({
+        "contributor_sk":   [1, 2, 3, 4],
+        "master_sk":        [10, 20, 30, 40],
+        "source_system":    ["sdwis", "echo", "tiger", "tiger"],
+        "state":            ["TX", "TX", "TX", "NM"],
+        "name_tkn":         ["AUSTIN", "AUSTIN", "AUSTIN", "AUSTIN"]})
+
+    rule = MatchRule(
+        "state+name_tiger",
+        left=RuleFilter(("sdwis", "echo"), notna=("state", "name_tkn")),
+        right=RuleFilter(("tiger",), notna=("state", "name_tkn")),
+        left_on=("state", "name_tkn"))
+
+    matches = MatchRuleEngine(tokens, max_workers=1, id_column="contributor_sk", master_column="master_sk").run([rule])
+
+    assert matches.columns.tolist() == ["master_sk", "contributor_sk_x", "contributor_sk_y", "match_rule"]
+    assert sorted(matches[["master_sk", "contributor_sk_x", "contributor_sk_y"]].values.tolist()) == [
+        [10, 1, 3], [20, 2, 3]]
+    assert matches["contributor_sk_y"].dtype == np.int64
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from match.schema import SOURCE_SYSTEMS, apply_schema, release_schema
+
+
+DF = pd.DataFrame({
+    "source_system":    ["tiger", "sdwis", "newsystem", None],
+    "state":            ["TX", None, "NM", "TX"],
+    "centroid_quality": ["GOOD", "ZIP", None, "GOOD"],
+    "match_rule":       [1, 5, 0, 64],
+    "name":             ["a", "b", "c", "d"]})
+
+
+def test_apply_schema():
+    applied = apply_schema(DF)
+
+    assert isinstance(applied["source_system"].dtype, pd.CategoricalDtype)
+    assert applied["match_rule"].dtype == "int16"
+    assert applied["name"].dtype == DF["name"].dtype
+
+    # Fixed categories come first, unknown values are appended rather than dropped
+    categories = applied["source_system"].cat.categories.tolist()
+    assert categories == list(SOURCE_SYSTEMS) + ["newsystem"]
+    assert applied["source_system"].tolist()[:3] == ["tiger", "sdwis", "newsystem"]
+
+    # The codes of the fixed categories don't depend on the data
+    assert applied["state"].cat.codes.tolist()[0] == apply_schema(DF.iloc[[0]])["state"].cat.codes.tolist()[0]
+
+    # The input is left alone
+    assert not isinstance(DF["source_system"].dtype, pd.CategoricalDtype)
+
+
+def test_apply_schema_to_some_columns():
+    applied = apply_schema(DF, columns=["state", "not_a_column"])
+
+    assert isinstance(applied["state"].dtype, pd.CategoricalDtype)
+    assert not isinstance(applied["source_system"].dtype, pd.CategoricalDtype)
+
+
+def test_round_trip():
+    released = release_schema(apply_schema(DF))
+
+    assert not any(isinstance(dtype, pd.CategoricalDtype) for dtype in released.dtypes)
+
+    for col in ["source_system", "state", "centroid_quality", "name"]:
+        assert released[col].isna().tolist() == DF[col].isna().tolist()
+        assert released[col].dropna().tolist() == DF[col].dropna().tolist()
+
+    assert released["match_rule"].tolist() == DF["match_rule"].tolist()
@@ -0,0 +1,60 @@
+import pickle
+
+import geopandas as gpd
+import shapely
+
+from match.spatial_index import BoundaryIndex
+
+
+BOUNDARIES = gpd.GeoDataFrame({
+    "contributor_id":   ["tiger.1", "tiger.2", "tiger.3"],
+    "state":            ["TX", "NM", None],
+    "geometry":         [shapely.box(0, 0, 2, 2), shapely.box(1, 1, 3, 3), shapely.box(10, 10, 11, 11)]})
+
+POINTS = gpd.GeoDataFrame({
+    "state":            ["TX", "NM", "TX", "TX", None],
+    "centroid_quality": ["GOOD", "GOOD", "ZIP CODE-CENTROID", "GOOD", "GOOD"],
+    "geometry":         [
+        shapely.Point(1.5, 1.5),                # in both 1 and 2
+        shapely.Point(1.5, 1.5),
+        shapely.Point(0.5, 0.5),                # in 1
+        shapely.box(10.5, 10.5, 12, 12),        # a polygon overlapping 3
+        shapely.Point(10.5, 10.5)]})            # in 3, no state
+
+
+def _pairs(hits) -> list:
+    return sorted(zip(hits["point_pos"], hits["boundary_id"]))
+
+
+def test_query():
+    hits = BoundaryIndex(BOUNDARIES).query(POINTS)
+
+    assert _pairs(hits) == [
+        (0, "tiger.1"), (0, "tiger.2"), (1, "tiger.1"), (1, "tiger.2"),
+        (2, "tiger.1"), (3, "tiger.3"), (4, "tiger.3")]
+
+
+def test_query_same_state():
+    hits = BoundaryIndex(BOUNDARIES).query(POINTS, same_state=True)
+
+    # Missing states never match
+    assert _pairs(hits) == [(0, "tiger.1"), (1, "tiger.2"), (2, "tiger.1")]
+
+
+def test_query_excluded_centroid_quality():
+    hits = BoundaryIndex(BOUNDARIES).query(POINTS, excluded_centroid_quality=["ZIP CODE-CENTROID"])
+
+    assert 2 not in hits["point_pos"].tolist()
+    assert len(hits) == 6
+
+
+def test_query_skips_missing_and_empty_geometries():
+    points = gpd.GeoDataFrame({"state": ["TX", "TX"], "geometry": [None, shapely.Point()]})
+
+    assert len(BoundaryIndex(BOUNDARIES).query(points)) == 0
+
+
+def test_pickle_rebuilds_the_tree():
+    index = pickle.loads(pickle.dumps(BoundaryIndex(BOUNDARIES)))
+
+    assert _pairs(index.query(POINTS, same_state=True)) == [(0, "tiger.1"), (1, "tiger.2"), (2, "tiger.1")]
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+import sql_profiling
+
+
+@pytest.fixture(autouse=True)
+def profile_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_profiling, "PROFILE_PATH", str(tmp_path))
+    yield tmp_path
+    sql_profiling._stage, sql_profiling._records = None, []
+
+
+def test_end_stage_totals(profile_path):
+    sql_profiling.start_stage("match_3_matching")
+
+    sql_profiling.record("COPY utility_xref\n  FROM STDIN", 2.0, rows=100, bytes_sent=5000)
+    sql_profiling.record("COPY utility_xref FROM STDIN", 1.5, rows=50, bytes_sent=2500)
+    sql_profiling.record("COPY match FROM STDIN", sql_profiling.SLOW_QUERY_SECONDS, bytes_sent=10)
+
+    totals = sql_profiling.end_stage()
+
+    assert totals == {
+        "statements": 3,
+        "seconds":    round(3.5 + sql_profiling.SLOW_QUERY_SECONDS, 3),
+        "rows":       150,
+        "bytes_sent": 7510,
+        "slow":       1
+    }
+
+    # Whitespace is normalized, so both xref COPYs are one statement
+    report = pd.read_csv(profile_path / "match_3_matching.csv")
+    xref = report.set_index("statement").loc["COPY utility_xref FROM STDIN"]
+
+    assert len(report) == 2
+    assert (xref["calls"], xref["seconds"], xref["max_seconds"], xref["rows"], xref["bytes_sent"]) == (2, 3.5, 2.0, 150, 7500)
+    assert (profile_path / "slow_queries.jsonl").exists()
+
+
+def test_record_outside_a_stage_is_ignored(profile_path):
+    sql_profiling.record("COPY match FROM STDIN", 1.0, rows=1)
+
+    assert sql_profiling.end_stage() == {"statements": 0, "seconds": 0.0, "rows": 0, "bytes_sent": 0, "slow": 0}
+    assert list(profile_path.iterdir()) == []
+
+
+def test_engine_statements_are_recorded():
+    sql_profiling.install()
+    sql_profiling.install()
+
+    engine = sa.create_engine("sqlite://")
+
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE t (name TEXT)"))
+        sql_profiling.start_stage("combine_tiers")
+        conn.execute(sa.text("INSERT INTO t VALUES (:name)"), {"name": "é"})
+        conn.execute(sa.text("INSERT INTO t VALUES (:name)"), [{"name": "a"}, {"name": "b"}])
+
+    totals = sql_profiling.end_stage()
+
+    # Installing twice doesn't double the listeners
+    assert totals["statements"] == 2
+    assert totals["rows"] == 3
+    assert totals["bytes_sent"] == 2 * len(b"INSERT INTO t VALUES (?)") + 2 + 2
+
+
+def test_parameter_bytes():
+    assert sql_profiling._parameter_bytes(None) == 0
+    assert sql_profiling._parameter_bytes({"a": "é", "b": 12}) == 4
+    assert sql_profiling._parameter_bytes(("é", 12)) == 4
+    assert sql_profiling._parameter_bytes([{"a": "x"}, {"a": "yy"}]) == 3
@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+
+from match.string_features import levenshtein, levenshtein_similarity, prefix_levenshtein
+
+
+def _reference(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+
+    return prev[-1]
+
+
+def _prefix_reference(a: str, b: str) -> int:
+    return min(_reference(a, b[:j]) for j in range(len(b) + 1))
+
+
+def _random_pairs(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = lambda: "".join(rng.choice("ABC É") for _ in range(rng.randint(0, 8)))
+
+    return [words() for _ in range(n)], [words() for _ in range(n)]
+
+
+def test_levenshtein_matches_the_reference():
+    a, b = _random_pairs(500)
+
+    expected = [_reference(x, y) for x, y in zip(a, b)]
+
+    assert levenshtein(np.array(a), np.array(b)).tolist() == expected
+
+
+def test_levenshtein_known_distances():
+    a = np.array(["KITTEN", "", "FLAW", "SAME", "ABC"])
+    b = np.array(["SITTING", "ABC", "LAWN", "SAME", ""])
+
+    assert levenshtein(a, b).tolist() == [3, 3, 2, 0, 3]
+
+
+def test_levenshtein_similarity():
+    a = np.array(["KITTEN", "", "ABCD"])
+    b = np.array(["SITTING", "", "ABCE"])
+
+    assert np.allclose(levenshtein_similarity(a, b), [1 - 3 / 7, 1.0, 0.75])
+
+
+def test_prefix_levenshtein_matches_the_reference():
+    a, b = _random_pairs(500, seed=1)
+
+    expected = [_prefix_reference(x, y) for x, y in zip(a, b)]
+
+    assert prefix_levenshtein(np.array(a), np.array(b)).tolist() == expected
+
+
+def test_prefix_levenshtein_known_distances():
+    a = np.array(["SPRING", "SPRNG", "", "AUSTIN", "ABC"])
+    b = np.array(["SPRING VALLEY", "SPRING VALLEY", "ANYTHING", "AUS", ""])
+
+    assert prefix_levenshtein(a, b).tolist() == [0, 1, 0, 3, 3]
@@ -0,0 +1,42 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from model.tier3 import read_tier3, tier3_circles
+
+
+T3 = pd.DataFrame({
+    "pwsid":        ["A", "B", "C"],
+    "centroid_lat": [30.3, np.nan, 34.0],
+    "centroid_lon": [-97.7, -100.0, -118.2],
+    "pred_50":      [1000.0, 500.0, np.nan]
+}, index=[7, 8, 9])
+
+
+def test_tier3_circles():
+    circles = tier3_circles(T3)
+
+    assert circles.index.tolist() == [7, 8, 9]
+    assert circles.crs.to_epsg() == 4326
+
+    # Rows without a centroid or radius get an empty polygon
+    assert circles.is_empty.tolist() == [False, True, True]
+
+    # Centered on the centroid, with the area of a 1 km circle
+    center = circles.iloc[0].centroid
+    assert abs(center.x + 97.7) < 1e-6 and abs(center.y - 30.3) < 1e-6
+
+    area = circles.iloc[[0]].to_crs("ESRI:102003").area.iloc[0]
+    assert abs(area / (math.pi * 1000 ** 2) - 1) < 0.01
+
+
+def test_read_tier3(tmp_path):
+    path = str(tmp_path / "tier3_radii.csv")
+    T3.assign(pwsid=["001", "002", "003"], centroid_quality="ZIP", geometry_source_detail=None).to_csv(path, index=False)
+
+    t3 = read_tier3(path)
+
+    # IDs keep their leading zeros
+    assert t3["pwsid"].tolist() == ["001", "002", "003"]
+    assert t3["pred_50"].isna().tolist() == [False, False, True]
@@ -0,0 +1,59 @@
+import sqlite3
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from export.vector_tiles import MERCATOR_HALF, build_mbtiles, covering_tiles, tile_bounds
+
+
+def _brute_force(bounds: np.ndarray, zoom: int) -> set:
+    tiles = set()
+
+    for x in range(2 ** zoom):
+        for y in range(2 ** zoom):
+            xmin, ymin, xmax, ymax = tile_bounds(zoom, x, y)
+            if ((bounds[:, 0] < xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax) & (bounds[:, 3] > ymin)).any():
+                tiles.add((x, y))
+
+    return tiles
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == (-MERCATOR_HALF, -MERCATOR_HALF, MERCATOR_HALF, MERCATOR_HALF)
+
+    # y counts down from the top
+    xmin, ymin, xmax, ymax = tile_bounds(1, 1, 0)
+    assert (xmin, ymin) == (0, 0) and abs(xmax - MERCATOR_HALF) < 1e-6 and abs(ymax - MERCATOR_HALF) < 1e-6
+
+
+def test_covering_tiles_matches_brute_force():
+    rng = np.random.default_rng(0)
+
+    corners = rng.uniform(-MERCATOR_HALF, MERCATOR_HALF, (50, 2))
+    sizes = rng.exponential(2e6, (50, 2))
+    bounds = np.column_stack([corners, corners + sizes])
+
+    for zoom in range(5):
+        tiles = covering_tiles(bounds, zoom)
+
+        assert {tuple(t) for t in tiles} == _brute_force(np.minimum(bounds, MERCATOR_HALF), zoom)
+        assert len(np.unique(tiles, axis=0)) == len(tiles)
+
+
+def test_build_mbtiles(tmp_path):
+    layer = gpd.GeoDataFrame({
+        "pwsid":    ["TX1", "EMPTY"],
+        "tier":     [1, 2],
+        "pws_name": ["AUSTIN", "NONE"],
+        "geometry": [shapely.box(-97.8, 30.2, -97.6, 30.4), shapely.Polygon()]
+    }, crs="EPSG:4326")
+
+    path = str(tmp_path / "temm.mbtiles")
+    build_mbtiles(layer, path, max_zoom=4, workers=1)
+
+    with sqlite3.connect(path) as db:
+        tiles = db.execute("SELECT zoom_level, COUNT(*) FROM tiles GROUP BY zoom_level").fetchall()
+
+    # One tile per zoom: the system is far from any tile edge
+    assert tiles == [(z, 1) for z in range(5)]
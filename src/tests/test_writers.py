@@ -0,0 +1,46 @@
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+import shapely
+
+from export.writers import read_geoparquet, write_flatgeobuf, write_geoparquet
+
+
+LAYER = gpd.GeoDataFrame({
+    "pwsid":        ["TX2", "NM1", "TX1", "CA1"],
+    "state_code":   ["TX", "NM", "TX", "CA"],
+    "tier":         pd.array([1, 2, None, 3], dtype="Int64"),
+    "geometry":     [shapely.box(0, 0, 1, 1), shapely.box(5, 5, 6, 6), shapely.box(2, 2, 3, 3), shapely.Polygon()]
+}, crs="EPSG:4326")
+
+
+def test_geoparquet_round_trip(tmp_path):
+    path = str(tmp_path / "temm.parquet")
+    write_geoparquet(LAYER, path)
+
+    layer = read_geoparquet(path)
+
+    # Sorted by state, then pwsid
+    assert layer["pwsid"].tolist() == ["CA1", "NM1", "TX1", "TX2"]
+    assert layer.crs == LAYER.crs
+    assert layer.set_index("pwsid")["tier"].isna().tolist() == [False, False, True, False]
+    assert layer.geometry.iloc[3].equals(shapely.box(0, 0, 1, 1))
+    assert "bbox" not in layer.columns
+
+
+def test_geoparquet_filters(tmp_path):
+    path = str(tmp_path / "temm.parquet")
+    write_geoparquet(LAYER, path)
+
+    assert read_geoparquet(path, states=["TX"])["pwsid"].tolist() == ["TX1", "TX2"]
+    assert read_geoparquet(path, bbox=(0.5, 0.5, 2.5, 2.5))["pwsid"].tolist() == ["TX1", "TX2"]
+    assert read_geoparquet(path, states=["NM"], bbox=(0, 0, 1, 1))["pwsid"].tolist() == []
+
+    assert read_geoparquet(path, columns=["pwsid"]).columns.tolist() == ["pwsid", "geometry"]
+
+
+def test_flatgeobuf_skips_empty_geometries(tmp_path):
+    path = str(tmp_path / "temm.fgb")
+    write_flatgeobuf(LAYER, path)
+
+    assert sorted(pyogrio.read_dataframe(path)["pwsid"]) == ["NM1", "TX1", "TX2"]